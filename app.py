@@ -1,35 +1,426 @@
+import argparse
 import datetime
+import email.utils
+import importlib
 import re
 import time
 import json
 import os
-from urllib.parse import urlparse, unquote
+import sys
+import threading
+import mmap
+import multiprocessing
+import heapq
+import hashlib
+import itertools
+import sqlite3
+import random
+import codecs
+import queue
+import signal
+import socket
+import unicodedata
+import uuid
+from html.parser import HTMLParser
+from xml.etree import ElementTree
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, unquote, urlunparse, parse_qsl, urlencode
 from dotenv import load_dotenv
 
 # Carrega variáveis do arquivo .env
 load_dotenv()
 
-# Importar dependências externas
-from slack import WebClient
-from slack.errors import SlackApiError
-from google.cloud import bigquery
-import pydata_google_auth
-import requests
-from googlesearch import search
-import openai
+# Importa um módulo (ou um atributo dele) só no primeiro uso, para uma execução avulsa não
+# pagar a importação das bibliotecas antes de precisar delas; ao_carregar configura o módulo
+class ImportacaoTardia:
+    def __init__(self, modulo, atributo=None, ao_carregar=None):
+        self._modulo = modulo
+        self._atributo = atributo
+        self._ao_carregar = ao_carregar
+        self._alvo = None
+        self._lock = threading.Lock()
+    
+    def carregar(self):
+        if self._alvo is None:
+            with self._lock:
+                if self._alvo is None:
+                    modulo = importlib.import_module(self._modulo)
+                    if self._ao_carregar:
+                        self._ao_carregar(modulo)
+                    self._alvo = getattr(modulo, self._atributo) if self._atributo else modulo
+        return self._alvo
+    
+    def __getattr__(self, nome):
+        return getattr(self.carregar(), nome)
+    
+    def __call__(self, *args, **kwargs):
+        return self.carregar()(*args, **kwargs)
 
 # Configurar a API do OpenAI
-openai.api_key = os.getenv("OPENAI_API_KEY")
+def configurar_openai(modulo):
+    modulo.api_key = os.getenv("OPENAI_API_KEY")
+    # As novas tentativas ficam a cargo de chamar_openai, que respeita os limites de taxa
+    modulo.max_retries = 0
+
+# Importar dependências externas (carregadas no primeiro uso)
+WebClient = ImportacaoTardia("slack", "WebClient")
+slack_errors = ImportacaoTardia("slack.errors")
+bigquery = ImportacaoTardia("google.cloud.bigquery")
+google_auth = ImportacaoTardia("google.auth")
+pydata_google_auth = ImportacaoTardia("pydata_google_auth")
+requests = ImportacaoTardia("requests")
+search = ImportacaoTardia("googlesearch", "search")
+openai = ImportacaoTardia("openai", ao_carregar=configurar_openai)
+
+# NumPy é opcional: sem ele, os scores dos candidatos são calculados par a par
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Modelo usado na extração de entidades
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-2024-11-20")
+
+# Limites de uso da API da OpenAI (requisições e tokens por minuto) e concorrência
+OPENAI_MAX_CONCORRENCIA = int(os.getenv("OPENAI_MAX_CONCORRENCIA", "8"))
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "30000"))
+OPENAI_MAX_TENTATIVAS = int(os.getenv("OPENAI_MAX_TENTATIVAS", "6"))
+OPENAI_TOKENS_RESPOSTA = int(os.getenv("OPENAI_TOKENS_RESPOSTA", "500"))
+
+# Notícias longas são divididas em trechos (por frases, com sobreposição) extraídos em paralelo
+OPENAI_TRECHO_MAX_TOKENS = int(os.getenv("OPENAI_TRECHO_MAX_TOKENS", "1000"))
+OPENAI_TRECHO_SOBREPOSICAO = int(os.getenv("OPENAI_TRECHO_SOBREPOSICAO", "1"))
+
+# Agrupamento de notícias curtas em um único prompt
+OPENAI_AGRUPAR = os.getenv("OPENAI_AGRUPAR", "0") == "1"
+OPENAI_GRUPO_MAX_CARACTERES = int(os.getenv("OPENAI_GRUPO_MAX_CARACTERES", "8000"))
+OPENAI_GRUPO_MAX_NOTICIAS = int(os.getenv("OPENAI_GRUPO_MAX_NOTICIAS", "5"))
 
 # Configuração do Slack
 SLACK_TOKEN = os.getenv("SLACK_TOKEN")
 CHANNEL_ID = os.getenv("SLACK_CHANNEL_ID")
+SLACK_MAX_TENTATIVAS = int(os.getenv("SLACK_MAX_TENTATIVAS", "5"))
+
+# Agrupamento das mensagens em resumos (links e alertas) antes de enviar ao Slack
+SLACK_RESUMO_MAX_LINHAS = int(os.getenv("SLACK_RESUMO_MAX_LINHAS", "20"))
+SLACK_RESUMO_MAX_CARACTERES = int(os.getenv("SLACK_RESUMO_MAX_CARACTERES", "3500"))
+SLACK_RESUMO_INTERVALO = float(os.getenv("SLACK_RESUMO_INTERVALO", "2"))
 
 # Configuração do BigQuery
 BIGQUERY_PROJECT_ID = os.getenv("BIGQUERY_PROJECT_ID", "infinitepay-production")
+# Arquivo JSON de uma conta de serviço; sem ele, usa o login salvo ou as credenciais padrão do Google Cloud
+BIGQUERY_CREDENCIAIS = os.getenv("BIGQUERY_CREDENCIAIS") or os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+# Custo das consultas: cada uma é estimada antes com um dry run e não roda se passar de
+# BIGQUERY_MAX_BYTES_CONSULTA bytes ou do que resta de BIGQUERY_ORCAMENTO_BYTES no ciclo (0 = sem limite)
+# Depois de rodar, o ciclo é cobrado pelos bytes faturados de fato; na tabela de tokens (em que o
+# dry run estima a tabela inteira), o limite por consulta vale só como maximum_bytes_billed
+BIGQUERY_MAX_BYTES_CONSULTA = int(os.getenv("BIGQUERY_MAX_BYTES_CONSULTA", "0"))
+BIGQUERY_ORCAMENTO_BYTES = int(os.getenv("BIGQUERY_ORCAMENTO_BYTES", "0"))
+# Tabela com uma linha por palavra do nome de cada merchant, clusterizada pela palavra (criada com
+# --criar-tabela-tokens); com BIGQUERY_USAR_TOKENS=1 as buscas são feitas nela
+BIGQUERY_USAR_TOKENS = os.getenv("BIGQUERY_USAR_TOKENS", "0") == "1"
+BIGQUERY_TABELA_TOKENS = os.getenv("BIGQUERY_TABELA_TOKENS", "maindb.merchant_tokens")
+# Linhas guardadas em cache por padrão; padrões mais amplos que isso são consultados a cada vez
+BIGQUERY_CACHE_MAX_LINHAS = int(os.getenv("BIGQUERY_CACHE_MAX_LINHAS", "20000"))
+
+# Modo serviço: intervalo entre o início de dois ciclos, em segundos
+SERVICO_INTERVALO = float(os.getenv("SERVICO_INTERVALO", "900"))
+
+# Configuração do download das páginas de notícias
+# HTTP_MAX_CONCORRENCIA (downloads simultâneos, via PIPELINE_WORKERS_DOWNLOAD) e HTTP_MAX_POR_HOST
+# valem para a execução inteira: com FILA_PROCESSOS, são divididos entre os processos trabalhadores
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "20"))
+HTTP_MAX_CONCORRENCIA = int(os.getenv("HTTP_MAX_CONCORRENCIA", "16"))
+HTTP_MAX_POR_HOST = int(os.getenv("HTTP_MAX_POR_HOST", "2"))
+HTTP_MAX_BYTES = int(os.getenv("HTTP_MAX_BYTES", str(2 * 1024 * 1024)))
+CONTEUDO_MAX_CARACTERES = int(os.getenv("CONTEUDO_MAX_CARACTERES", "100000"))
+
+# Configuração do snapshot local de merchants (índice de trigramas para busca offline)
+USAR_INDICE_LOCAL = os.getenv("USAR_INDICE_LOCAL", "0") == "1"
+MERCHANT_SNAPSHOT_DIR = os.getenv("MERCHANT_SNAPSHOT_DIR", "dados/merchants")
+MERCHANT_WATERMARK_COLUMN = os.getenv("MERCHANT_WATERMARK_COLUMN", "updated_at")
+MERCHANT_SNAPSHOT_RECARGA_HORAS = float(os.getenv("MERCHANT_SNAPSHOT_RECARGA_HORAS", "24"))
+MATCH_LOCAL_TOP_K = int(os.getenv("MATCH_LOCAL_TOP_K", "5"))
+
+# Configuração do cache em disco de páginas e de extrações do GPT
+CACHE_ATIVO = os.getenv("CACHE_ATIVO", "1") == "1"
+CACHE_DIR = os.getenv("CACHE_DIR", "dados/cache")
+CACHE_TTL_PAGINAS = int(os.getenv("CACHE_TTL_PAGINAS", str(24 * 3600)))
+CACHE_TTL_ENTIDADES = int(os.getenv("CACHE_TTL_ENTIDADES", str(30 * 24 * 3600)))
+CACHE_TTL_CORRESPONDENCIAS = int(os.getenv("CACHE_TTL_CORRESPONDENCIAS", str(24 * 3600)))
+# Resultados da busca e feeds RSS/Atom têm vida curta; depois disso o feed é revalidado (GET condicional)
+CACHE_TTL_BUSCAS = int(os.getenv("CACHE_TTL_BUSCAS", "600"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Configuração do pipeline busca -> download -> extração -> correspondência -> alerta
+PIPELINE_WORKERS_BUSCA = int(os.getenv("PIPELINE_WORKERS_BUSCA", "4"))
+PIPELINE_WORKERS_DOWNLOAD = int(os.getenv("PIPELINE_WORKERS_DOWNLOAD", str(HTTP_MAX_CONCORRENCIA)))
+PIPELINE_WORKERS_EXTRACAO = int(os.getenv("PIPELINE_WORKERS_EXTRACAO", str(OPENAI_MAX_CONCORRENCIA)))
+PIPELINE_WORKERS_CORRESPONDENCIA = int(os.getenv("PIPELINE_WORKERS_CORRESPONDENCIA", "2"))
+PIPELINE_LOTE_ENTIDADES = int(os.getenv("PIPELINE_LOTE_ENTIDADES", "50"))
+# Limite de notícias à espera de download ou de extração; acima dele a busca espera (0 = sem limite)
+PIPELINE_MAX_PENDENTES = int(os.getenv("PIPELINE_MAX_PENDENTES", "200"))
+
+# Palavras-chave para busca, uma por linha em PALAVRAS_CHAVE_ARQUIVO (PALAVRAS_CHAVE se o arquivo não existir)
+PALAVRAS_CHAVE = [
+    "lavagem de dinheiro",
+    "fintech"
+]
+PALAVRAS_CHAVE_ARQUIVO = os.getenv("PALAVRAS_CHAVE_ARQUIVO", "palavras_chave.txt")
+
+# Feeds RSS/Atom de portais de notícias, um por linha em FONTES_RSS_ARQUIVO
+FONTES_RSS_ARQUIVO = os.getenv("FONTES_RSS_ARQUIVO", "fontes_rss.txt")
+
+# Buscas no Google: balde de tokens com BUSCA_TAXA buscas por segundo e rajadas de até BUSCA_RAJADA
+# Se o Google bloquear (429), todas as buscas param por BUSCA_PAUSA_BLOQUEIO segundos
+BUSCA_TAXA = float(os.getenv("BUSCA_TAXA", "0.5"))
+BUSCA_RAJADA = int(os.getenv("BUSCA_RAJADA", "2"))
+BUSCA_PAUSA_BLOQUEIO = float(os.getenv("BUSCA_PAUSA_BLOQUEIO", "60"))
+
+# Score mínimo para uma correspondência virar alerta; as abaixo dele são descartadas assim que pontuadas
+SCORE_MINIMO_ALERTA = 0.4
+# Maiores correspondências da execução mantidas no ranking final
+ALERTAS_RANKING_TOP_N = int(os.getenv("ALERTAS_RANKING_TOP_N", "10"))
+# Linhas do BigQuery acumuladas por padrão antes de pontuar (limita a memória em padrões amplos)
+BIGQUERY_LOTE_LINHAS = int(os.getenv("BIGQUERY_LOTE_LINHAS", "5000"))
+
+# Score vetorizado (NumPy) de entidades x merchants, usado a partir de SCORE_VETORIZADO_MINIMO pares
+SCORE_VETORIZADO = os.getenv("SCORE_VETORIZADO", "1") == "1"
+SCORE_VETORIZADO_MINIMO = int(os.getenv("SCORE_VETORIZADO_MINIMO", "200"))
+
+# Pré-filtro local: notícias sem nomes candidatos (ou sem conteúdo) não vão para o GPT
+# Com PREFILTRO_INDICE=1 (e o índice local em uso), os candidatos são conferidos no snapshot
+# de merchants e só as frases com candidatos relevantes são enviadas
+# Notícias curtas (até PREFILTRO_TEXTO_CURTO caracteres) vão para o GPT mesmo sem candidatos,
+# porque um nome no início da manchete ("Nubank demite...") não é reconhecido pelo pré-filtro
+PREFILTRO_ATIVO = os.getenv("PREFILTRO_ATIVO", "1") == "1"
+PREFILTRO_INDICE = os.getenv("PREFILTRO_INDICE", "0") == "1"
+PREFILTRO_SCORE_MINIMO = float(os.getenv("PREFILTRO_SCORE_MINIMO", str(SCORE_MINIMO_ALERTA)))
+PREFILTRO_TEXTO_CURTO = int(os.getenv("PREFILTRO_TEXTO_CURTO", "300"))
+
+# Registro entre execuções de URLs já processadas e impressões digitais (SimHash) do conteúdo
+REGISTRO_ATIVO = os.getenv("REGISTRO_ATIVO", "1") == "1"
+REGISTRO_ARQUIVO = os.getenv("REGISTRO_ARQUIVO", "dados/registro.sqlite")
+REGISTRO_RETENCAO_DIAS = int(os.getenv("REGISTRO_RETENCAO_DIAS", "30"))
+SIMHASH_DISTANCIA_MAXIMA = int(os.getenv("SIMHASH_DISTANCIA_MAXIMA", "10"))
+
+# Fila de trabalhos em disco: a etapa de cada notícia da execução fica gravada, e uma execução
+# interrompida continua de onde parou. Com FILA_PROCESSOS > 0, as etapas rodam nesse número de
+# processos trabalhadores; com 0, em threads do próprio processo
+FILA_ARQUIVO = os.getenv("FILA_ARQUIVO", "dados/fila.sqlite")
+FILA_PROCESSOS = int(os.getenv("FILA_PROCESSOS", "0"))
+FILA_RESERVA_SEGUNDOS = float(os.getenv("FILA_RESERVA_SEGUNDOS", "300"))
+FILA_MAX_TENTATIVAS = int(os.getenv("FILA_MAX_TENTATIVAS", "3"))
+FILA_INTERVALO_CONSULTA = float(os.getenv("FILA_INTERVALO_CONSULTA", "0.2"))
+
+# Métricas da execução: spans das etapas em JSON lines e totais em um textfile do Prometheus
+METRICAS_ATIVO = os.getenv("METRICAS_ATIVO", "1") == "1"
+METRICAS_JSONL_ARQUIVO = os.getenv("METRICAS_JSONL_ARQUIVO", "dados/metricas.jsonl")
+METRICAS_PROMETHEUS_ARQUIVO = os.getenv("METRICAS_PROMETHEUS_ARQUIVO", "dados/shearch.prom")
+
+HEADERS_NAVEGADOR = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Cache-Control': 'max-age=0'
+}
+
+# Limites (em segundos) do histograma de duração das etapas exportado para o Prometheus
+LIMITES_HISTOGRAMA = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Métricas da execução
+# - spans: cada chamada rastreada (@metricas.rastrear) vira uma linha em METRICAS_JSONL_ARQUIVO
+#   com duração, span pai (na mesma thread) e os atributos anotados durante a chamada
+# - contadores: bytes baixados, tokens, linhas lidas, novas tentativas... somados por rótulos
+# No fim da execução, exportar() grava os contadores e o histograma de duração por etapa
+# em METRICAS_PROMETHEUS_ARQUIVO (formato textfile do node_exporter)
+class Metricas:
+    def __init__(self, arquivo_jsonl=METRICAS_JSONL_ARQUIVO, arquivo_prometheus=METRICAS_PROMETHEUS_ARQUIVO, ativo=METRICAS_ATIVO):
+        self.arquivo_jsonl = arquivo_jsonl
+        self.arquivo_prometheus = arquivo_prometheus
+        self.ativo = ativo
+        self.execucao = f"{int(time.time())}-{uuid.uuid4().hex[:12]}"
+        self.contadores = Counter()
+        self.duracoes = {}
+        self.histogramas = {}
+        self.erros = Counter()
+        self._proximo_id = 0
+        self._arquivo = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+    
+    def _pilha(self):
+        if not hasattr(self._local, "pilha"):
+            self._local.pilha = []
+        return self._local.pilha
+    
+    # Decorador que mede cada chamada da função como um span com o nome da etapa
+    def rastrear(self, nome):
+        def decorador(funcao):
+            def rastreada(*args, **kwargs):
+                if not self.ativo:
+                    return funcao(*args, **kwargs)
+                
+                with self._lock:
+                    self._proximo_id += 1
+                    span = {"id": self._proximo_id, "atributos": {}}
+                pilha = self._pilha()
+                span["pai"] = pilha[-1]["id"] if pilha else None
+                pilha.append(span)
+                inicio = time.time()
+                relogio = time.perf_counter()
+                try:
+                    return funcao(*args, **kwargs)
+                except Exception as e:
+                    span["atributos"]["erro"] = f"{type(e).__name__}: {e}"
+                    raise
+                finally:
+                    pilha.pop()
+                    self._finalizar(nome, span, inicio, time.perf_counter() - relogio)
+            
+            rastreada.__name__ = funcao.__name__
+            rastreada.__wrapped__ = funcao
+            return rastreada
+        return decorador
+    
+    # Anota atributos no span em andamento nesta thread (ex.: tamanho, linhas, erro)
+    def anotar(self, **atributos):
+        pilha = self._pilha() if self.ativo else None
+        if pilha:
+            pilha[-1]["atributos"].update(atributos)
+    
+    # Soma um valor ao contador com os rótulos informados
+    def contar(self, nome, valor=1, **rotulos):
+        if self.ativo and valor:
+            with self._lock:
+                self.contadores[(nome, tuple(sorted(rotulos.items())))] += valor
+    
+    def _finalizar(self, nome, span, inicio, duracao):
+        ok = "erro" not in span["atributos"]
+        registro = {
+            "tipo": "span",
+            "execucao": self.execucao,
+            "id": span["id"],
+            "pai": span["pai"],
+            "nome": nome,
+            "inicio": inicio,
+            "duracao_s": round(duracao, 6),
+            "ok": ok,
+            "thread": threading.current_thread().name,
+            "atributos": span["atributos"],
+        }
+        with self._lock:
+            self.duracoes.setdefault(nome, []).append(duracao)
+            # Histograma acumulado desde o início do processo (no modo serviço, somando os ciclos)
+            histograma = self.histogramas.setdefault(nome, {"buckets": [0] * len(LIMITES_HISTOGRAMA), "soma": 0.0, "quantidade": 0})
+            for i, limite in enumerate(LIMITES_HISTOGRAMA):
+                if duracao <= limite:
+                    histograma["buckets"][i] += 1
+            histograma["soma"] += duracao
+            histograma["quantidade"] += 1
+            if not ok:
+                self.erros[nome] += 1
+            self._escrever(registro)
+    
+    # Cada registro vai em uma única escrita, sem buffer, no arquivo aberto com O_APPEND: com
+    # FILA_PROCESSOS > 0, as linhas gravadas pelos vários processos não se misturam
+    def _escrever(self, registro):
+        if not self.arquivo_jsonl:
+            return
+        try:
+            if self._arquivo is None:
+                os.makedirs(os.path.dirname(self.arquivo_jsonl) or ".", exist_ok=True)
+                self._arquivo = os.open(self.arquivo_jsonl, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            os.write(self._arquivo, (json.dumps(registro, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+        except OSError as e:
+            print(f"Erro ao gravar métricas em {self.arquivo_jsonl}: {e}")
+            self.arquivo_jsonl = None
+    
+    # Texto no formato de exposição do Prometheus com os contadores e as durações
+    def formatar_prometheus(self):
+        def rotulos(pares):
+            if not pares:
+                return ""
+            valores = []
+            for chave, valor in pares:
+                valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                valores.append(f'{chave}="{valor}"')
+            return "{" + ",".join(valores) + "}"
+        
+        linhas = []
+        with self._lock:
+            por_nome = {}
+            for (nome, pares), valor in sorted(self.contadores.items()):
+                por_nome.setdefault(nome, []).append((pares, valor))
+            for nome, series in por_nome.items():
+                linhas.append(f"# TYPE shearch_{nome}_total counter")
+                linhas.extend(f"shearch_{nome}_total{rotulos(pares)} {valor}" for pares, valor in series)
+            
+            linhas.append("# TYPE shearch_etapa_duracao_segundos histogram")
+            for nome, histograma in sorted(self.histogramas.items()):
+                for limite, quantidade in zip(LIMITES_HISTOGRAMA, histograma["buckets"]):
+                    linhas.append(f"shearch_etapa_duracao_segundos_bucket{rotulos([('etapa', nome), ('le', limite)])} {quantidade}")
+                linhas.append(f"shearch_etapa_duracao_segundos_bucket{rotulos([('etapa', nome), ('le', '+Inf')])} {histograma['quantidade']}")
+                linhas.append(f"shearch_etapa_duracao_segundos_sum{rotulos([('etapa', nome)])} {histograma['soma']:.6f}")
+                linhas.append(f"shearch_etapa_duracao_segundos_count{rotulos([('etapa', nome)])} {histograma['quantidade']}")
+            
+            linhas.append("# TYPE shearch_etapa_erros_total counter")
+            for nome in sorted(self.histogramas):
+                linhas.append(f"shearch_etapa_erros_total{rotulos([('etapa', nome)])} {self.erros[nome]}")
+        
+        linhas.append("# TYPE shearch_ultima_execucao_timestamp_segundos gauge")
+        linhas.append(f"shearch_ultima_execucao_timestamp_segundos {time.time():.0f}")
+        return "\n".join(linhas) + "\n"
+    
+    # Grava os totais da execução: uma linha de contadores no JSONL e o textfile do Prometheus
+    def exportar(self):
+        if not self.ativo:
+            return
+        with self._lock:
+            contadores = [
+                {"nome": nome, "rotulos": dict(pares), "valor": valor}
+                for (nome, pares), valor in sorted(self.contadores.items())
+            ]
+            self._escrever({"tipo": "contadores", "execucao": self.execucao, "fim": time.time(), "contadores": contadores})
+        
+        if self.arquivo_prometheus:
+            try:
+                os.makedirs(os.path.dirname(self.arquivo_prometheus) or ".", exist_ok=True)
+                # Grava em um temporário e troca, para o coletor nunca ler um arquivo pela metade
+                temporario = self.arquivo_prometheus + ".tmp"
+                with open(temporario, "w", encoding="utf-8") as f:
+                    f.write(self.formatar_prometheus())
+                os.replace(temporario, self.arquivo_prometheus)
+            except OSError as e:
+                print(f"Erro ao gravar métricas em {self.arquivo_prometheus}: {e}")
+    
+    # Começa um novo ciclo do modo serviço: o resumo passa a contar só as etapas do ciclo,
+    # enquanto os contadores e histogramas do Prometheus continuam acumulando
+    def novo_ciclo(self):
+        with self._lock:
+            self.duracoes = {}
+    
+    # Resumo das etapas para o fim da execução (ou do ciclo)
+    def resumo(self):
+        with self._lock:
+            etapas = [
+                f"{nome}: {len(duracoes)} chamadas, {sum(duracoes):.1f}s"
+                for nome, duracoes in sorted(self.duracoes.items(), key=lambda item: -sum(item[1]))
+            ]
+        return "Tempo por etapa: " + ("; ".join(etapas) if etapas else "nenhuma etapa medida")
+
+metricas = Metricas()
 
 # Configuração de autenticação para BigQuery
-def autenticar_bigquery(projeto_id=BIGQUERY_PROJECT_ID):
+# Na ordem: conta de serviço (BIGQUERY_CREDENCIAIS), login de usuário salvo por uma execução
+# anterior, credenciais padrão do Google Cloud (gcloud, metadados da VM) e, por último, o login
+# interativo no navegador, que só é aberto quando interativo=True
+def autenticar_bigquery(projeto_id=BIGQUERY_PROJECT_ID, interativo=True):
     print(f"Iniciando autenticação com o Google Cloud para o projeto: {projeto_id}...")
     
     # Escopos necessários para BigQuery
@@ -39,13 +430,30 @@ def autenticar_bigquery(projeto_id=BIGQUERY_PROJECT_ID):
     ]
     
     try:
-        # Solicita autenticação interativa
-        credentials = pydata_google_auth.get_user_credentials(
-            SCOPES,
-            auth_local_webserver=True,
-            client_id=None,  # Usa as credenciais padrão
-            client_secret=None,  # Usa as credenciais padrão
-        )
+        if BIGQUERY_CREDENCIAIS:
+            credentials = pydata_google_auth.load_service_account_credentials(BIGQUERY_CREDENCIAIS, scopes=SCOPES)
+        else:
+            credentials = pydata_google_auth.cache.READ_WRITE.load()
+        
+        if credentials is None:
+            try:
+                credentials, _ = google_auth.default(scopes=SCOPES)
+            except google_auth.exceptions.DefaultCredentialsError:
+                credentials = None
+        
+        if credentials is None:
+            if not interativo:
+                raise RuntimeError(
+                    "nenhuma credencial não interativa encontrada; defina BIGQUERY_CREDENCIAIS "
+                    "ou faça o login uma vez com python app.py"
+                )
+            # Solicita autenticação interativa (o login fica salvo para as próximas execuções)
+            credentials = pydata_google_auth.get_user_credentials(
+                SCOPES,
+                auth_local_webserver=True,
+                client_id=None,  # Usa as credenciais padrão
+                client_secret=None,  # Usa as credenciais padrão
+            )
         
         # Cria o cliente BigQuery com as credenciais autenticadas
         client = bigquery.Client(credentials=credentials, project=projeto_id)
@@ -55,17 +463,75 @@ def autenticar_bigquery(projeto_id=BIGQUERY_PROJECT_ID):
         print(f"Erro durante autenticação: {e}")
         raise
 
+# Balde de tokens: libera até `capacidade` chamadas seguidas e depois `taxa` chamadas por segundo,
+# compartilhado por todas as threads
+class BaldeTokens:
+    def __init__(self, taxa, capacidade):
+        self.taxa = taxa
+        self.capacidade = max(capacidade, 1)
+        self._tokens = float(self.capacidade)
+        self._atualizado = time.monotonic()
+        self._pausado_ate = 0.0
+        self._lock = threading.Lock()
+    
+    def aguardar(self):
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._tokens = min(self.capacidade, self._tokens + (agora - self._atualizado) * self.taxa)
+                self._atualizado = agora
+                
+                if agora >= self._pausado_ate and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                
+                if agora < self._pausado_ate:
+                    espera = self._pausado_ate - agora
+                else:
+                    espera = (1 - self._tokens) / self.taxa
+            time.sleep(max(espera, 0.01))
+    
+    def pausar(self, segundos):
+        with self._lock:
+            self._pausado_ate = max(self._pausado_ate, time.monotonic() + segundos)
+
+limitador_busca = BaldeTokens(BUSCA_TAXA, BUSCA_RAJADA)
+
+# Função para ler uma lista de um arquivo texto (uma entrada por linha, # para comentários)
+# Sem o arquivo, devolve a lista padrão
+def carregar_lista(caminho, padrao=()):
+    if not caminho or not os.path.exists(caminho):
+        return list(padrao)
+    with open(caminho, encoding="utf-8") as f:
+        linhas = (linha.split("#", 1)[0].strip() for linha in f)
+        return list(dict.fromkeys(linha for linha in linhas if linha))
+
+def carregar_palavras_chave():
+    return carregar_lista(PALAVRAS_CHAVE_ARQUIVO, PALAVRAS_CHAVE)
+
+def carregar_fontes_rss():
+    return carregar_lista(FONTES_RSS_ARQUIVO)
+
 # Função para buscar notícias
+# As buscas respeitam limitador_busca e o resultado fica em cache_buscas por CACHE_TTL_BUSCAS
+@metricas.rastrear("buscar_noticias")
 def buscar_noticias(query, num_results=10, dias_anteriores=1):
     hoje = datetime.date.today()
     data_anterior = hoje - datetime.timedelta(days=dias_anteriores)
     
     print(f"Buscando notícias dos últimos {dias_anteriores} dias para '{query}'...")
     
+    # Adiciona "after:" para limitar pela data
+    query_com_data = f"{query} after:{data_anterior.strftime('%Y-%m-%d')}"
+    chave = chave_conteudo(query_com_data, str(num_results))
+    em_cache = cache_buscas.obter(chave)
+    if em_cache:
+        metricas.anotar(query=query, links=len(em_cache[0]), origem="cache")
+        return em_cache[0]
+    
     resultados = []
     try:
-        # Adiciona "after:" para limitar pela data
-        query_com_data = f"{query} after:{data_anterior.strftime('%Y-%m-%d')}"
+        limitador_busca.aguardar()
         
         # Domínios a ignorar (redes sociais, etc)
         dominios_ignorar = [
@@ -79,463 +545,3177 @@ def buscar_noticias(query, num_results=10, dias_anteriores=1):
             if not any(dominio in j for dominio in dominios_ignorar):
                 resultados.append(j)
                 print(f"Encontrado: {j}")
-            
+        
+        cache_buscas.gravar(chave, resultados)
+        metricas.anotar(query=query, links=len(resultados))
         return resultados
     except Exception as e:
+        # Bloqueio do Google (429): pausa as buscas de todas as threads
+        if getattr(getattr(e, "response", None), "status_code", None) == 429:
+            limitador_busca.pausar(BUSCA_PAUSA_BLOQUEIO)
+            metricas.contar("buscas_bloqueadas")
         print(f"Erro ao buscar '{query}': {e}")
+        metricas.anotar(query=query, erro=str(e))
         return []
 
-# Função para extrair o conteúdo completo da notícia
-def obter_conteudo_da_pagina(url):
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Cache-Control': 'max-age=0'
-        }
-        
-        # Aumentar o timeout para sites mais lentos
-        response = requests.get(url, headers=headers, timeout=20)
-        response.raise_for_status()
-        
-        # Salvar o HTML original para depuração
-        html = response.text
-        
-        # Extrair o título
-        titulo_match = re.search(r'<title>(.*?)</title>', html, re.IGNORECASE)
-        titulo = titulo_match.group(1).strip() if titulo_match else extrair_titulo_da_url(url)
-        
-        # Etapa 1: Limpar o HTML de elementos não relevantes
-        # Remover scripts, estilos, comentários e tags de navegação
-        html_limpo = re.sub(r'<script[^>]*>.*?</script>', ' ', html, flags=re.DOTALL)
-        html_limpo = re.sub(r'<style[^>]*>.*?</style>', ' ', html_limpo, flags=re.DOTALL)
-        html_limpo = re.sub(r'<!--.*?-->', ' ', html_limpo, flags=re.DOTALL)
-        html_limpo = re.sub(r'<nav[^>]*>.*?</nav>', ' ', html_limpo, flags=re.DOTALL)
-        html_limpo = re.sub(r'<header[^>]*>.*?</header>', ' ', html_limpo, flags=re.DOTALL)
-        html_limpo = re.sub(r'<footer[^>]*>.*?</footer>', ' ', html_limpo, flags=re.DOTALL)
-        html_limpo = re.sub(r'<aside[^>]*>.*?</aside>', ' ', html_limpo, flags=re.DOTALL)
-        html_limpo = re.sub(r'<iframe[^>]*>.*?</iframe>', ' ', html_limpo, flags=re.DOTALL)
-        
-        # Etapa 2: Tentar identificar o conteúdo principal da notícia
-        # Estratégia 1: Buscar elementos com classes/IDs comuns de conteúdo principal
-        conteudo = ""
-        
-        # Lista de padrões para encontrar o conteúdo principal em sites de notícias
-        padroes_conteudo = [
-            # Elementos <article>
-            r'<article[^>]*>(.*?)</article>',
-            # Divs com classes comuns para conteúdo de notícias
-            r'<div[^>]*class="[^"]*(?:content|article|post|news|materia|texto|entry|body|main)[^"]*"[^>]*>(.*?)</div>',
-            # Divs com ID de conteúdo
-            r'<div[^>]*id="[^"]*(?:content|article|post|news|materia|texto|entry|body|main)[^"]*"[^>]*>(.*?)</div>',
-            # Elementos <main>
-            r'<main[^>]*>(.*?)</main>',
-            # Seções de conteúdo
-            r'<section[^>]*class="[^"]*(?:content|article|post|news|materia)[^"]*"[^>]*>(.*?)</section>'
-        ]
-        
-        # Tentar cada padrão até encontrar conteúdo significativo
-        for padrao in padroes_conteudo:
-            matches = re.findall(padrao, html_limpo, re.DOTALL)
-            
-            # Verificar se encontrou algo significativo
-            if matches:
-                for match in matches:
-                    # Verificar se o conteúdo tem tamanho mínimo para ser relevante
-                    if len(match) > 500:  # Pelo menos 500 caracteres
-                        conteudo = match
-                        break
-                
-                if conteudo:
-                    break
+# Cache em disco (SQLite) com expiração por TTL e remoção LRU quando passa de max_bytes
+# Os valores são gravados em JSON; cada entrada pode ter metadados (ex.: ETag da página)
+class CacheDisco:
+    def __init__(self, nome, ttl, max_bytes=CACHE_MAX_BYTES, diretorio=CACHE_DIR, descricao=None):
+        self.nome = nome
+        self.descricao = descricao or nome
+        self.caminho = os.path.join(diretorio, f"{nome}.sqlite")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.acertos = 0
+        self.falhas = 0
+        self.revalidados = 0
+        self._conexao = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+    
+    # Na conexão, soma uma vez o tamanho das entradas; depois o total é mantido a cada gravação
+    def _conectar(self):
+        if self._conexao is None:
+            os.makedirs(os.path.dirname(self.caminho) or ".", exist_ok=True)
+            self._conexao = sqlite3.connect(self.caminho, check_same_thread=False, timeout=30)
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            self._conexao.execute(
+                """CREATE TABLE IF NOT EXISTS cache (
+                    chave TEXT PRIMARY KEY,
+                    valor TEXT NOT NULL,
+                    meta TEXT,
+                    criado_em REAL NOT NULL,
+                    acessado_em REAL NOT NULL,
+                    tamanho INTEGER NOT NULL
+                )"""
+            )
+            self._conexao.execute("CREATE INDEX IF NOT EXISTS idx_cache_acesso ON cache (acessado_em)")
+            self._bytes = self._somar_tamanhos(self._conexao)
+        return self._conexao
+    
+    def _somar_tamanhos(self, conexao):
+        return conexao.execute("SELECT COALESCE(SUM(tamanho), 0) FROM cache").fetchone()[0]
+    
+    # Retorna (valor, meta, fresco) ou None; com incluir_expirado=True devolve também
+    # entradas vencidas, para revalidação condicional
+    def obter(self, chave, incluir_expirado=False):
+        if not CACHE_ATIVO:
+            self.falhas += 1
+            return None
         
-        # Estratégia 2: Se não encontrou conteúdo pelo padrão,
-        # extrair todos os parágrafos <p> com conteúdo significativo
-        if not conteudo or len(conteudo) < 500:
-            paragrafos = re.findall(r'<p[^>]*>(.*?)</p>', html_limpo, re.DOTALL)
-            conteudo = ' '.join([p for p in paragrafos if len(p) > 30])  # Parágrafos com pelo menos 30 caracteres
-        
-        # Etapa 3: Limpar o conteúdo extraído
-        # Remover todas as tags HTML restantes, preservando o texto
-        conteudo_limpo = re.sub(r'<[^>]+>', ' ', conteudo)
-        
-        # Normalizar espaços e quebras de linha
-        conteudo_limpo = re.sub(r'\s+', ' ', conteudo_limpo).strip()
-        
-        # Converter entidades HTML para caracteres
-        conteudo_limpo = conteudo_limpo.replace('&nbsp;', ' ')
-        conteudo_limpo = conteudo_limpo.replace('&amp;', '&')
-        conteudo_limpo = conteudo_limpo.replace('&lt;', '<')
-        conteudo_limpo = conteudo_limpo.replace('&gt;', '>')
-        conteudo_limpo = conteudo_limpo.replace('&quot;', '"')
-        conteudo_limpo = conteudo_limpo.replace('&#39;', "'")
-        
-        # Se o conteúdo for muito pequeno, usar fallback
-        if len(conteudo_limpo) < 300:
-            # Extrair todo o texto do HTML como último recurso
-            todo_texto = re.sub(r'<[^>]+>', ' ', html_limpo)
-            todo_texto = re.sub(r'\s+', ' ', todo_texto).strip()
+        with self._lock:
+            conexao = self._conectar()
+            linha = conexao.execute(
+                "SELECT valor, meta, criado_em FROM cache WHERE chave = ?", (chave,)
+            ).fetchone()
             
-            # Dividir em parágrafos por pontuação final
-            paragrafos = re.split(r'(?<=[.!?])\s+', todo_texto)
+            fresco = linha is not None and time.time() - linha[2] <= self.ttl
+            if fresco:
+                self.acertos += 1
+            else:
+                self.falhas += 1
             
-            # Selecionar apenas parágrafos significativos (com mais de X caracteres)
-            paragrafos_significativos = [p for p in paragrafos if len(p) > 50]
+            if linha is None or (not fresco and not incluir_expirado):
+                return None
             
-            conteudo_limpo = ' '.join(paragrafos_significativos)
+            conexao.execute("UPDATE cache SET acessado_em = ? WHERE chave = ?", (time.time(), chave))
+            conexao.commit()
+            return json.loads(linha[0]), json.loads(linha[1] or "{}"), fresco
+    
+    def gravar(self, chave, valor, meta=None):
+        if not CACHE_ATIVO:
+            return
         
-        # Se ainda for muito grande, limitar o tamanho
-        if len(conteudo_limpo) > 15000:
-            conteudo_limpo = conteudo_limpo[:15000]
-            
-        # Imprime o tamanho do conteúdo extraído para depuração
-        print(f"Tamanho do conteúdo extraído: {len(conteudo_limpo)} caracteres")
+        valor_json = json.dumps(valor, ensure_ascii=False)
+        meta_json = json.dumps(meta or {}, ensure_ascii=False)
+        agora = time.time()
         
-        return {
-            "titulo": titulo, 
-            "conteudo": conteudo_limpo,
-            "url": url
-        }
-    except Exception as e:
-        print(f"Erro ao obter conteúdo de {url}: {e}")
-        return {"titulo": extrair_titulo_da_url(url), "conteudo": "", "url": url}
+        tamanho = len(valor_json) + len(meta_json) + len(chave)
+        
+        with self._lock:
+            conexao = self._conectar()
+            anterior = conexao.execute("SELECT tamanho FROM cache WHERE chave = ?", (chave,)).fetchone()
+            conexao.execute(
+                "INSERT OR REPLACE INTO cache (chave, valor, meta, criado_em, acessado_em, tamanho) VALUES (?, ?, ?, ?, ?, ?)",
+                (chave, valor_json, meta_json, agora, agora, tamanho)
+            )
+            self._bytes += tamanho - (anterior[0] if anterior else 0)
+            if self._bytes > self.max_bytes:
+                self._remover_excedente(conexao)
+            conexao.commit()
+    
+    # Marca uma entrada como fresca novamente (página respondeu 304 Not Modified)
+    def renovar(self, chave):
+        with self._lock:
+            conexao = self._conectar()
+            agora = time.time()
+            conexao.execute("UPDATE cache SET criado_em = ?, acessado_em = ? WHERE chave = ?", (agora, agora, chave))
+            conexao.commit()
+            self.revalidados += 1
+    
+    # Remove as entradas usadas há mais tempo até o cache caber em max_bytes
+    # O total é somado de novo antes da remoção, porque outros processos podem gravar no mesmo
+    # arquivo; isso só acontece quando o total mantido por este processo passa do limite
+    def _remover_excedente(self, conexao):
+        self._bytes = self._somar_tamanhos(conexao)
+        if self._bytes <= self.max_bytes:
+            return
+        
+        remover = []
+        for chave, tamanho in conexao.execute("SELECT chave, tamanho FROM cache ORDER BY acessado_em"):
+            if self._bytes <= self.max_bytes:
+                break
+            remover.append((chave,))
+            self._bytes -= tamanho
+        conexao.executemany("DELETE FROM cache WHERE chave = ?", remover)
+    
+    def resumo(self):
+        texto = f"Cache de {self.descricao}: {self.acertos} acertos, {self.falhas} falhas"
+        if self.revalidados:
+            texto += f", {self.revalidados} revalidadas (304)"
+        return texto
 
-def extrair_titulo_da_url(url):
-    # Extrai título a partir da URL como fallback
-    parse_result = urlparse(url)
-    path = parse_result.path
+# Função para gerar a chave de cache de um conteúdo (hash do modelo + texto)
+def chave_conteudo(*partes):
+    return hashlib.sha256("\n".join(partes).encode("utf-8")).hexdigest()
+
+# Caches da execução: URL -> conteúdo extraído e hash(texto + modelo) -> entidades filtradas
+cache_paginas = CacheDisco("paginas", CACHE_TTL_PAGINAS, descricao="páginas")
+cache_entidades = CacheDisco("entidades", CACHE_TTL_ENTIDADES)
+cache_correspondencias = CacheDisco("correspondencias", CACHE_TTL_CORRESPONDENCIAS, descricao="correspondências")
+cache_buscas = CacheDisco("buscas", CACHE_TTL_BUSCAS)
+cache_feeds = CacheDisco("feeds", CACHE_TTL_BUSCAS)
+cache_padroes = CacheDisco("padroes", CACHE_TTL_CORRESPONDENCIAS, descricao="padrões do BigQuery")
+
+# Parâmetros de rastreamento removidos das URLs antes de compará-las
+PARAMETROS_RASTREAMENTO = {"fbclid", "gclid", "mc_cid", "mc_eid", "ref", "amp", "outputtype", "cmpid", "origem"}
+
+# Função para canonicalizar uma URL de notícia: host em minúsculas sem "www.", sem fragmento,
+# sem parâmetros de rastreamento (utm_*, fbclid...), sem sufixo /amp e sem barra final
+def canonicalizar_url(url):
+    partes = urlparse(url.strip())
+    host = partes.hostname or ""
+    if host.startswith("www."):
+        host = host[4:]
+    if partes.port and partes.port not in (80, 443):
+        host = f"{host}:{partes.port}"
     
-    # Obter o último segmento da URL e substituir hífens por espaços
-    titulo = unquote(path.split('/')[-1].replace('-', ' '))
-    return titulo
+    caminho = re.sub(r'/amp/?$', '', partes.path) or "/"
+    if len(caminho) > 1:
+        caminho = caminho.rstrip("/")
+    
+    parametros = sorted(
+        (chave, valor) for chave, valor in parse_qsl(partes.query, keep_blank_values=True)
+        if not chave.lower().startswith("utm_") and chave.lower() not in PARAMETROS_RASTREAMENTO
+    )
+    return urlunparse(("https" if partes.scheme in ("http", "https") else partes.scheme,
+                       host, caminho, "", urlencode(parametros), ""))
 
-# Função para extrair entidades usando GPT
-def extrair_entidades_gpt(texto):
-    try:
-        # Configura a chamada para a API do OpenAI usando a nova interface v1.x
-        params = {
-            "model": "gpt-4o-2024-11-20",  # Usar GPT-4o direto
-            "messages": [
-                {"role": "system", "content": "Você é um especialista em análise de textos. Sua tarefa é extrair somente nomes próprios completos de pessoas e empresas mencionadas em notícias."},
-                {"role": "user", "content": f"""
-                Analise o seguinte texto de notícia e extraia APENAS:
-                
-                1. Nomes COMPLETOS de PESSOAS
-                2. Nomes COMPLETOS de EMPRESAS
-                
-                IMPORTANTE:
-                - NÃO extraia nomes de cidades, estados ou países
-                - NÃO extraia órgãos públicos como "Polícia Federal", "Ministério Público", etc
-                - NÃO extraia termos genéricos como "empresa", "companhia", "organização"
-                - Extraia apenas nomes próprios completos específicos
-                
-                Texto da notícia: {texto}
-                
-                Forneça APENAS o seguinte formato JSON sem explicações adicionais:
-                [
-                  {{"texto": "Nome da Pessoa", "tipo": "PER"}},
-                  {{"texto": "Nome da Empresa", "tipo": "ORG"}}
-                ]
-                
-                Se não houver nenhuma pessoa ou empresa específica mencionada, retorne uma lista vazia [].
-                """}
-            ],
-            "temperature": 0.0  # Zero para respostas determinísticas
-        }
-        
-        # Faz a chamada para a API do OpenAI
-        response = openai.chat.completions.create(**params)
+# Função para calcular o SimHash (64 bits) de um texto a partir de trincas de palavras
+# Textos quase iguais (mesma matéria republicada em outro portal) têm poucos bits diferentes
+def calcular_simhash(texto):
+    palavras = re.findall(r'\w+', texto.lower())
+    trincas = {" ".join(palavras[i:i + 3]) for i in range(max(len(palavras) - 2, 1))}
+    pesos = [0] * 64
+    for trinca in trincas:
+        valor = int.from_bytes(hashlib.blake2b(trinca.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            pesos[bit] += 1 if valor >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if pesos[bit] > 0)
+
+# Registro persistente (SQLite) das notícias já processadas, entre execuções
+# - urls: URLs canonicalizadas já processadas, para as execuções seguintes pularem
+# - impressoes: SimHash do conteúdo das notícias do período de retenção; a comparação
+#   percorre todas (alguns milhares de inteiros) contando os bits diferentes
+class RegistroNoticias:
+    def __init__(self, caminho=REGISTRO_ARQUIVO, retencao_dias=REGISTRO_RETENCAO_DIAS):
+        self.caminho = caminho
+        self.retencao_dias = retencao_dias
+        self.urls_puladas = 0
+        self.quase_duplicatas = 0
+        self._conexao = None
+        self._lock = threading.Lock()
+    
+    def _conectar(self):
+        if self._conexao is None:
+            os.makedirs(os.path.dirname(self.caminho) or ".", exist_ok=True)
+            self._conexao = sqlite3.connect(self.caminho, check_same_thread=False, timeout=30)
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            self._conexao.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, visto_em REAL NOT NULL)")
+            self._conexao.execute(
+                "CREATE TABLE IF NOT EXISTS impressoes (impressao INTEGER NOT NULL, url TEXT NOT NULL, criado_em REAL NOT NULL)"
+            )
+            
+            # Descarta o que passou do período de retenção
+            limite = time.time() - self.retencao_dias * 86400
+            self._conexao.execute("DELETE FROM urls WHERE visto_em < ?", (limite,))
+            self._conexao.execute("DELETE FROM impressoes WHERE criado_em < ?", (limite,))
+            self._conexao.commit()
+        return self._conexao
+    
+    def ja_processada(self, url):
+        if not REGISTRO_ATIVO:
+            return False
+        with self._lock:
+            linha = self._conectar().execute(
+                "SELECT 1 FROM urls WHERE url = ?", (canonicalizar_url(url),)
+            ).fetchone()
+            if linha:
+                self.urls_puladas += 1
+            return linha is not None
+    
+    def marcar_processada(self, url):
+        if not REGISTRO_ATIVO:
+            return
+        with self._lock:
+            conexao = self._conectar()
+            conexao.execute("INSERT OR REPLACE INTO urls (url, visto_em) VALUES (?, ?)", (canonicalizar_url(url), time.time()))
+            conexao.commit()
+    
+    def _procurar_conteudo(self, conexao, impressao):
+        for outra, url_original in conexao.execute("SELECT impressao, url FROM impressoes"):
+            if bin((outra & 0xFFFFFFFFFFFFFFFF) ^ impressao).count("1") <= SIMHASH_DISTANCIA_MAXIMA:
+                return url_original
+        return None
+    
+    # Retorna a URL de uma notícia já registrada com conteúdo quase idêntico, ou None
+    # Textos muito curtos (avisos de cookies, paywall) não são comparados
+    def conteudo_parecido(self, texto):
+        if not REGISTRO_ATIVO or len(texto.split()) < 50:
+            return None
         
-        # Extrai a resposta
-        resultado = response.choices[0].message.content.strip()
-        print(f"Resposta GPT: {resultado}")
+        with self._lock:
+            url_original = self._procurar_conteudo(self._conectar(), calcular_simhash(texto))
+            if url_original:
+                self.quase_duplicatas += 1
+            return url_original
+    
+    # Registra o conteúdo de uma notícia já extraída, se não houver outro quase idêntico
+    # Só entra no registro a notícia extraída com sucesso: uma cópia processada ao mesmo
+    # tempo que ela pode passar também, mas uma falha na extração não faz as cópias se perderem
+    def registrar_conteudo(self, texto, url):
+        if not REGISTRO_ATIVO or len(texto.split()) < 50:
+            return None
         
-        # Tenta converter a resposta para JSON
-        try:
-            # Remover qualquer texto que não seja JSON
-            if resultado.startswith("```json"):
-                resultado = resultado.replace("```json", "").replace("```", "")
-            elif resultado.startswith("```"):
-                resultado = resultado.replace("```", "")
-                
-            resultado = resultado.strip()
+        impressao = calcular_simhash(texto)
+        with self._lock:
+            conexao = self._conectar()
+            url_original = self._procurar_conteudo(conexao, impressao)
+            if url_original:
+                return url_original
             
-            # Tentar converter para JSON
-            entidades = json.loads(resultado)
+            # SQLite guarda inteiros de 64 bits com sinal
+            conexao.execute(
+                "INSERT INTO impressoes (impressao, url, criado_em) VALUES (?, ?, ?)",
+                (impressao - (1 << 64) if impressao >= 1 << 63 else impressao, url, time.time())
+            )
+            conexao.commit()
+            return None
+    
+    def resumo(self):
+        evitadas = self.urls_puladas + self.quase_duplicatas
+        return (
+            f"Notícias puladas: {self.urls_puladas} já processadas em execuções anteriores, "
+            f"{self.quase_duplicatas} quase duplicadas (mesma matéria em outro portal); "
+            f"{evitadas} chamadas ao GPT e {evitadas} buscas de entidades no BigQuery evitadas"
+        )
+
+registro_noticias = RegistroNoticias()
+
+# Etapas de uma notícia na fila de trabalhos, na ordem; "descartada" (sem entidades ou quase
+# duplicada) e "falhou" (passou de FILA_MAX_TENTATIVAS) também encerram a notícia
+ETAPAS_FILA = ("pendente", "baixada", "extraida", "comparada", "alertada")
+
+# Fila de trabalhos em disco (SQLite), compartilhada pelos processos da execução
+# Cada notícia da execução tem a etapa em que está e o que já foi produzido (conteúdo, entidades
+# e as correspondências encontradas). Um trabalhador reserva notícias de uma etapa por
+# FILA_RESERVA_SEGUNDOS, grava o resultado e a notícia avança; reservas de um processo que
+# morreu vencem e a notícia volta para a fila
+class FilaTrabalhos:
+    def __init__(self, caminho=FILA_ARQUIVO, retencao_dias=REGISTRO_RETENCAO_DIAS):
+        self.caminho = caminho
+        self.retencao_dias = retencao_dias
+        self._conexao = None
+        self._lock = threading.Lock()
+    
+    def _conectar(self):
+        if self._conexao is None:
+            os.makedirs(os.path.dirname(self.caminho) or ".", exist_ok=True)
+            self._conexao = sqlite3.connect(self.caminho, check_same_thread=False, timeout=30)
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            self._conexao.executescript(
+                """CREATE TABLE IF NOT EXISTS execucoes (
+                    id TEXT PRIMARY KEY,
+                    iniciada_em REAL NOT NULL,
+                    busca_concluida INTEGER NOT NULL DEFAULT 0,
+                    concluida_em REAL
+                );
+                CREATE TABLE IF NOT EXISTS fontes (
+                    execucao TEXT NOT NULL,
+                    fonte TEXT NOT NULL,
+                    PRIMARY KEY (execucao, fonte)
+                );
+                CREATE TABLE IF NOT EXISTS trabalhos (
+                    id INTEGER PRIMARY KEY,
+                    execucao TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    chave TEXT NOT NULL,
+                    etapa TEXT NOT NULL,
+                    dados TEXT,
+                    entidades TEXT,
+                    dono TEXT,
+                    reservado_ate REAL,
+                    tentativas INTEGER NOT NULL DEFAULT 0,
+                    erro TEXT,
+                    atualizado_em REAL NOT NULL,
+                    UNIQUE (execucao, chave)
+                );
+                CREATE INDEX IF NOT EXISTS idx_trabalhos_etapa ON trabalhos (execucao, etapa);
+                CREATE TABLE IF NOT EXISTS resultados (
+                    execucao TEXT NOT NULL,
+                    trabalho INTEGER NOT NULL,
+                    entidade TEXT NOT NULL,
+                    tipo TEXT,
+                    user_id,
+                    merchant_name TEXT,
+                    score REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_resultados_trabalho ON resultados (execucao, trabalho);
+                CREATE TABLE IF NOT EXISTS alertas (
+                    execucao TEXT NOT NULL,
+                    user_id NOT NULL,
+                    PRIMARY KEY (execucao, user_id)
+                );"""
+            )
             
-            # Verificar se é uma lista e tem elementos
-            if isinstance(entidades, list) and len(entidades) > 0:
-                # Filtrar entidades para remover entidades não desejadas
-                entidades_filtradas = []
-                termos_ignorar = [
-                    "g1", "brasil", "cnn brasil", "cnn", "veja", "estadão", "youtube", 
-                    "agência brasil", "rio de janeiro", "são paulo", "polícia civil", 
-                    "polícia federal", "pf", "banco digital", "banco", "fintech", 
-                    "empresa", "companhia", "organização", "instituição"
-                ]
-                
-                # Lista de nomes de cidades brasileiras comuns que podem ser erroneamente extraídas como entidades
-                cidades = ["rio", "são paulo", "brasília", "salvador", "fortaleza", "recife", 
-                          "belo horizonte", "manaus", "curitiba", "porto alegre", "belém",
-                          "goiânia", "guarulhos", "campinas", "são luís", "maceió"]
-                
-                for entidade in entidades:
-                    nome = entidade.get("texto", "").lower()
-                    
-                    # Não incluir termos genéricos ou locais geográficos
-                    if (nome and nome not in termos_ignorar and 
-                        not any(cidade in nome for cidade in cidades) and
-                        not any(orgao.lower() in nome for orgao in ["ministério", "polícia", "receita", "secretaria"])):
-                        entidades_filtradas.append(entidade)
-                
-                print(f"Entidades extraídas e filtradas: {entidades_filtradas}")
-                return entidades_filtradas
-            return []
-        except json.JSONDecodeError:
-            print(f"Erro ao decodificar JSON da resposta GPT: {resultado}")
-            return []
+            # Descarta as execuções concluídas que passaram do período de retenção
+            limite = time.time() - self.retencao_dias * 86400
+            antigas = [linha[0] for linha in self._conexao.execute(
+                "SELECT id FROM execucoes WHERE concluida_em IS NOT NULL AND concluida_em < ?", (limite,)
+            )]
+            for tabela, coluna in (("trabalhos", "execucao"), ("resultados", "execucao"), ("fontes", "execucao"),
+                                   ("alertas", "execucao"), ("execucoes", "id")):
+                self._conexao.executemany(f"DELETE FROM {tabela} WHERE {coluna} = ?", [(execucao,) for execucao in antigas])
+            self._conexao.commit()
+        return self._conexao
+    
+    def _executar(self, sql, parametros=()):
+        with self._lock:
+            conexao = self._conectar()
+            cursor = conexao.execute(sql, parametros)
+            conexao.commit()
+            return cursor.rowcount
+    
+    def _consultar(self, sql, parametros=()):
+        with self._lock:
+            return self._conectar().execute(sql, parametros).fetchall()
+    
+    # Retoma a última execução não concluída ou começa uma nova; retorna (id, retomada)
+    # Com nova=True, a execução interrompida é abandonada
+    # As reservas da execução retomada são liberadas, já que os processos que as tinham não existem mais
+    def iniciar_execucao(self, nova=False):
+        with self._lock:
+            conexao = self._conectar()
+            linha = conexao.execute(
+                "SELECT id FROM execucoes WHERE concluida_em IS NULL ORDER BY iniciada_em DESC LIMIT 1"
+            ).fetchone()
+            if linha and nova:
+                conexao.execute("UPDATE execucoes SET concluida_em = ? WHERE concluida_em IS NULL", (time.time(),))
+                linha = None
             
-    except Exception as e:
-        print(f"Erro ao chamar API do OpenAI: {e}")
-        return []
-
-# Função para extrair entidades (pessoas e organizações) do conteúdo da notícia
-def extrair_entidades_do_conteudo(url):
-    # Tenta obter o título e conteúdo real da página
-    dados = obter_conteudo_da_pagina(url)
-    print(f"Título extraído: {dados['titulo']}")
+            if linha:
+                execucao = linha[0]
+                conexao.execute("UPDATE execucoes SET busca_concluida = 0 WHERE id = ?", (execucao,))
+                conexao.execute("UPDATE trabalhos SET dono = NULL, reservado_ate = NULL WHERE execucao = ?", (execucao,))
+            else:
+                # O mesmo processo pode abrir várias execuções no mesmo segundo (--intervalo 0)
+                execucao = f"{int(time.time())}-{uuid.uuid4().hex[:12]}"
+                conexao.execute("INSERT INTO execucoes (id, iniciada_em) VALUES (?, ?)", (execucao, time.time()))
+            conexao.commit()
+            return execucao, linha is not None
     
-    # Combina título e conteúdo para a análise
-    texto_completo = f"{dados['titulo']} \n\n {dados['conteudo']}"
+    def concluir_execucao(self, execucao):
+        self._executar("UPDATE execucoes SET concluida_em = ? WHERE id = ?", (time.time(), execucao))
     
-    # Use a função de extração de entidades baseada em GPT
-    entidades = extrair_entidades_gpt(texto_completo)
+    # Palavras-chave e feeds já buscados na execução (não são buscados de novo ao retomar)
+    def fonte_concluida(self, execucao, fonte):
+        return bool(self._consultar("SELECT 1 FROM fontes WHERE execucao = ? AND fonte = ?", (execucao, fonte)))
     
-    return entidades
-
-# Função para buscar entidades no BigQuery
-def buscar_no_bigquery(entidades):
-    # Usa o cliente global já autenticado
-    client = bigquery_client
+    def concluir_fonte(self, execucao, fonte):
+        self._executar("INSERT OR IGNORE INTO fontes (execucao, fonte) VALUES (?, ?)", (execucao, fonte))
     
-    resultados = []
+    def concluir_busca(self, execucao):
+        self._executar("UPDATE execucoes SET busca_concluida = 1 WHERE id = ?", (execucao,))
     
-    for entidade in entidades:
-        # Constrói a consulta SQL para encontrar correspondências parciais no merchant_name
-        query = f"""
-        SELECT user_id, merchant_name
-        FROM `{BIGQUERY_PROJECT_ID}.maindb.merchants`
-        WHERE LOWER(merchant_name) LIKE '%{entidade["texto"].lower()}%'
-        """
-        
-        try:
-            # Executa a consulta
-            query_job = client.query(query)
-            
-            # Processa os resultados
-            for row in query_job:
-                score = calcular_score_fuzzy(entidade, row.merchant_name)
-                resultados.append({
-                    "entidade": entidade["texto"],
-                    "tipo": entidade["tipo"],
-                    "user_id": row.user_id,
-                    "merchant_name": row.merchant_name,
-                    "score": score
-                })
-        except Exception as e:
-            print(f"Erro ao consultar BigQuery para '{entidade['texto']}': {e}")
+    def busca_concluida(self, execucao):
+        linha = self._consultar("SELECT busca_concluida FROM execucoes WHERE id = ?", (execucao,))
+        return bool(linha and linha[0][0])
     
-    return resultados
-
-# Função para calcular score de relevância
-def calcular_score_fuzzy(entidade, merchant_name):
-    entidade_texto = entidade["texto"].lower()
-    merchant_lower = merchant_name.lower()
+    # Coloca a notícia na fila; retorna False se ela já estava na execução
+    def adicionar(self, execucao, url):
+        return self._executar(
+            "INSERT OR IGNORE INTO trabalhos (execucao, url, chave, etapa, atualizado_em) VALUES (?, ?, ?, 'pendente', ?)",
+            (execucao, url, canonicalizar_url(url), time.time())
+        ) > 0
     
-    # Score base de acordo com o tipo de entidade
-    base_score = {
-        "PER": 0.5,  # Pessoas
-        "ORG": 0.6,  # Organizações
-        "ENT": 0.4   # Entidades genéricas
-    }.get(entidade["tipo"], 0.3)
+    # Reserva até `limite` notícias da etapa para o dono; com max_entidades, para de juntar
+    # notícias quando a soma das entidades passaria do máximo (sempre reserva ao menos uma)
+    def reservar(self, execucao, etapa, dono, limite=1, max_entidades=None):
+        agora = time.time()
+        with self._lock:
+            conexao = self._conectar()
+            conexao.execute("BEGIN IMMEDIATE")
+            try:
+                linhas = conexao.execute(
+                    """SELECT id, url, dados, entidades, COALESCE(json_array_length(entidades), 0) FROM trabalhos
+                    WHERE execucao = ? AND etapa = ? AND (dono IS NULL OR reservado_ate < ?)
+                    ORDER BY id LIMIT ?""",
+                    (execucao, etapa, agora, limite)
+                ).fetchall()
+                
+                reservados = []
+                total = 0
+                for id_, url, dados, entidades, quantidade in linhas:
+                    if max_entidades and reservados and total + quantidade > max_entidades:
+                        break
+                    total += quantidade
+                    reservados.append({
+                        "id": id_,
+                        "url": url,
+                        "dados": json.loads(dados) if dados else None,
+                        "entidades": json.loads(entidades) if entidades else None
+                    })
+                conexao.executemany(
+                    "UPDATE trabalhos SET dono = ?, reservado_ate = ? WHERE id = ?",
+                    [(dono, agora + FILA_RESERVA_SEGUNDOS, trabalho["id"]) for trabalho in reservados]
+                )
+                conexao.commit()
+            except Exception:
+                conexao.rollback()
+                raise
+            return reservados
     
-    # Calcular similaridade
-    token_similarity = calcular_similaridade(entidade_texto, merchant_lower)
-    substring_similarity = calcular_similaridade_substring(entidade_texto, merchant_lower)
+    # Grava o que a etapa produziu e passa a notícia para a próxima etapa (checkpoint)
+    # Retorna False se a reserva venceu e a notícia foi pega por outro trabalhador
+    def avancar(self, trabalho_id, dono, etapa, dados=None, entidades=None):
+        return self._executar(
+            """UPDATE trabalhos SET etapa = ?, dados = COALESCE(?, dados), entidades = COALESCE(?, entidades),
+            dono = NULL, reservado_ate = NULL, erro = NULL, atualizado_em = ? WHERE id = ? AND dono = ?""",
+            (etapa, json.dumps(dados, ensure_ascii=False) if dados is not None else None,
+             json.dumps(entidades, ensure_ascii=False) if entidades is not None else None,
+             time.time(), trabalho_id, dono)
+        ) > 0
     
-    # Verificar correspondência exata
-    if entidade_texto == merchant_lower:
-        exact_match = 1.0
-    # Verificar se entidade é uma palavra inteira dentro do merchant name
-    elif re.search(r'\b' + re.escape(entidade_texto) + r'\b', merchant_lower):
-        exact_match = 0.8
-    else:
-        exact_match = 0.0
+    # Grava as correspondências da notícia e a marca como comparada, na mesma transação
+    def gravar_resultados(self, execucao, trabalho_id, dono, resultados):
+        with self._lock:
+            conexao = self._conectar()
+            try:
+                atualizado = conexao.execute(
+                    """UPDATE trabalhos SET etapa = 'comparada', dono = NULL, reservado_ate = NULL, erro = NULL,
+                    atualizado_em = ? WHERE id = ? AND dono = ?""",
+                    (time.time(), trabalho_id, dono)
+                ).rowcount
+                if atualizado:
+                    conexao.executemany(
+                        "INSERT INTO resultados (execucao, trabalho, entidade, tipo, user_id, merchant_name, score) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [(execucao, trabalho_id, resultado["entidade"], resultado["tipo"], resultado["user_id"],
+                          resultado["merchant_name"], resultado["score"]) for resultado in resultados]
+                    )
+                conexao.commit()
+                return atualizado > 0
+            except Exception:
+                conexao.rollback()
+                raise
     
-    # Calcular score final combinando os resultados
-    final_score = (token_similarity * 0.3) + (substring_similarity * 0.3) + (exact_match * 0.4) + (base_score * 0.2)
+    # Devolve a notícia para a fila sem contar uma tentativa (ex.: o orçamento do ciclo acabou)
+    def liberar(self, trabalho_id, dono):
+        self._executar(
+            "UPDATE trabalhos SET dono = NULL, reservado_ate = NULL, atualizado_em = ? WHERE id = ? AND dono = ?",
+            (time.time(), trabalho_id, dono)
+        )
     
-    # Limitar a 1.0
-    return min(final_score, 1.0)
-
-# Função para calcular similaridade entre conjuntos de tokens
-def calcular_similaridade(str1, str2):
-    # Converter para minúsculas e dividir em tokens (palavras)
-    tokens1 = set(str1.lower().split())
-    tokens2 = set(str2.lower().split())
+    # Devolve a notícia para a fila após um erro, ou a dá como falha após FILA_MAX_TENTATIVAS
+    def registrar_falha(self, trabalho_id, dono, erro):
+        self._executar(
+            """UPDATE trabalhos SET tentativas = tentativas + 1, erro = ?, dono = NULL, reservado_ate = NULL,
+            etapa = CASE WHEN tentativas + 1 >= ? THEN 'falhou' ELSE etapa END, atualizado_em = ?
+            WHERE id = ? AND dono = ?""",
+            (erro, FILA_MAX_TENTATIVAS, time.time(), trabalho_id, dono)
+        )
     
-    # Verificar se os conjuntos estão vazios
-    if not tokens1 or not tokens2:
-        return 0.0
+    # Quantidade de notícias da execução nas etapas informadas (reservadas ou não)
+    def em_aberto(self, execucao, etapas):
+        marcadores = ", ".join("?" * len(etapas))
+        return self._consultar(
+            f"SELECT COUNT(*) FROM trabalhos WHERE execucao = ? AND etapa IN ({marcadores})", (execucao, *etapas)
+        )[0][0]
     
-    # Calcular interseção (palavras em comum)
-    intersecao = tokens1.intersection(tokens2)
+    # Notícias comparadas, na ordem em que terminaram, com as suas correspondências
+    def comparados(self, execucao):
+        comparados = []
+        for (trabalho_id,) in self._consultar(
+            "SELECT id FROM trabalhos WHERE execucao = ? AND etapa = 'comparada' ORDER BY atualizado_em, id", (execucao,)
+        ):
+            comparados.append((trabalho_id, self.resultados(execucao, trabalho_id)))
+        return comparados
     
-    # Calcular coeficiente de similaridade (Jaccard)
-    return len(intersecao) / max(len(tokens1), len(tokens2))
+    def resultados(self, execucao, trabalho_id=None, etapa=None):
+        sql = """SELECT r.entidade, r.tipo, r.user_id, r.merchant_name, r.score FROM resultados r
+            JOIN trabalhos t ON t.id = r.trabalho WHERE r.execucao = ?"""
+        parametros = [execucao]
+        if trabalho_id is not None:
+            sql += " AND r.trabalho = ?"
+            parametros.append(trabalho_id)
+        if etapa is not None:
+            sql += " AND t.etapa = ?"
+            parametros.append(etapa)
+        return [
+            {"entidade": entidade, "tipo": tipo, "user_id": user_id, "merchant_name": merchant_name, "score": score}
+            for entidade, tipo, user_id, merchant_name, score in self._consultar(sql + " ORDER BY r.rowid", parametros)
+        ]
+    
+    def marcar_alertada(self, trabalho_id):
+        self._executar("UPDATE trabalhos SET etapa = 'alertada', atualizado_em = ? WHERE id = ?", (time.time(), trabalho_id))
+    
+    # user_ids já alertados na execução (não são alertados de novo ao retomar)
+    def registrar_alerta(self, execucao, user_id):
+        self._executar("INSERT OR IGNORE INTO alertas (execucao, user_id) VALUES (?, ?)", (execucao, user_id))
+    
+    def usuarios_alertados(self, execucao):
+        return {linha[0] for linha in self._consultar("SELECT user_id FROM alertas WHERE execucao = ?", (execucao,))}
+    
+    def resumo(self, execucao):
+        contagem = dict(self._consultar(
+            "SELECT etapa, COUNT(*) FROM trabalhos WHERE execucao = ? GROUP BY etapa", (execucao,)
+        ))
+        etapas = ETAPAS_FILA + ("descartada", "falhou")
+        return "Fila de trabalhos: " + ", ".join(f"{contagem.get(etapa, 0)} {etapa}" for etapa in etapas)
 
-# Função para verificar se uma string está contida em outra
-def calcular_similaridade_substring(str1, str2):
-    # Verificar se uma string é substring da outra
-    if str1 in str2:
-        return 0.7 + (len(str1) / len(str2)) * 0.3  # Valoriza strings maiores
-    elif str2 in str1:
-        return 0.7 + (len(str2) / len(str1)) * 0.3
-    
-    # Verificar substrings parciais
-    # Comprimento mínimo para considerar uma substring
-    min_length = 3
-    max_substr = ""
-    
-    # Verificar substrings de str1 em str2
-    for i in range(len(str1)):
-        for j in range(i + min_length, len(str1) + 1):
-            substr = str1[i:j]
-            if substr in str2 and len(substr) > len(max_substr):
-                max_substr = substr
-    
-    # Se encontrou uma substring significativa
-    if len(max_substr) > min_length:
-        return 0.4 + (len(max_substr) / len(str1)) * 0.3
-    
-    return 0.0
+fila_trabalhos = FilaTrabalhos()
 
-# Função para enviar mensagem para o Slack
-def enviar_para_slack(mensagem, thread_ts=None):
-    try:
-        # Inicializa o cliente do Slack
-        slack_client = WebClient(token=SLACK_TOKEN)
-        
-        response = slack_client.chat_postMessage(
-            channel=CHANNEL_ID,
-            text=mensagem,
-            thread_ts=thread_ts
-        )
-        print(f"Mensagem enviada para o Slack: {mensagem[:50]}...")
-        return response
-    except Exception as e:
-        print(f"Erro ao enviar mensagem para o Slack: {e}")
-        return None
+# Sessão HTTP compartilhada (pool de conexões reaproveitado entre as páginas)
+_sessao_http = None
+_sessao_http_lock = threading.Lock()
 
-def main():
-    # Palavras-chave para busca
-    palavras_chave = [
-        "lavagem de dinheiro",
-        "fintech"
-    ]
+# Semáforos para limitar as conexões simultâneas a um mesmo site
+_semaforos_por_host = {}
+_semaforos_por_host_lock = threading.Lock()
+
+def obter_sessao_http():
+    global _sessao_http
+    with _sessao_http_lock:
+        if _sessao_http is None:
+            sessao = requests.Session()
+            adaptador = requests.adapters.HTTPAdapter(
+                pool_connections=HTTP_MAX_CONCORRENCIA,
+                pool_maxsize=max(HTTP_MAX_POR_HOST, 1)
+            )
+            sessao.mount("http://", adaptador)
+            sessao.mount("https://", adaptador)
+            sessao.headers.update(HEADERS_NAVEGADOR)
+            _sessao_http = sessao
+        return _sessao_http
+
+def _semaforo_do_host(url):
+    host = urlparse(url).netloc.lower()
+    with _semaforos_por_host_lock:
+        if host not in _semaforos_por_host:
+            _semaforos_por_host[host] = threading.BoundedSemaphore(max(HTTP_MAX_POR_HOST, 1))
+        return _semaforos_por_host[host]
+
+# Função para descobrir a codificação da página: cabeçalho HTTP, <meta charset> ou UTF-8
+def detectar_codificacao(response, primeiro_bloco):
+    if "charset" in response.headers.get("Content-Type", "").lower() and response.encoding:
+        return response.encoding
     
-    # Inicializa o cliente BigQuery
-    global bigquery_client
-    bigquery_client = autenticar_bigquery()
+    meta_charset = re.search(rb'<meta[^>]+charset=["\']?([\w-]+)', primeiro_bloco[:4096], re.IGNORECASE)
+    if meta_charset:
+        codificacao = meta_charset.group(1).decode("ascii")
+        try:
+            codecs.lookup(codificacao)
+            return codificacao
+        except LookupError:
+            pass
+    return "utf-8"
+
+# Função para baixar uma página extraindo o conteúdo enquanto os bytes chegam
+# O download para ao atingir HTTP_MAX_BYTES; o HTML completo nunca fica em memória
+# Com etag/last_modified faz um GET condicional; retorna (dados, headers) e dados=None em 304
+def baixar_pagina(url, etag=None, last_modified=None):
+    sessao = obter_sessao_http()
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
     
-    # Buscar notícias para cada palavra-chave
-    todas_noticias = {}
-    for palavra in palavras_chave:
-        print(f"\nBuscando notícias para '{palavra}'...")
-        todas_noticias[palavra] = buscar_noticias(palavra)
-        time.sleep(2)  # Pausa para evitar bloqueio API
-    
-    # Analisar notícias, extrair entidades e buscar no BigQuery
-    todos_resultados = []
-    
-    for palavra, links in todas_noticias.items():
-        if links:
-            # Enviar links de notícias
-            mensagem = f"Top notícias do último dia para '{palavra}':"
-            response = enviar_para_slack(mensagem)
-            thread_ts = response.data.get('ts') if response else None
+    with _semaforo_do_host(url):
+        inicio = time.monotonic()
+        with sessao.get(url, headers=headers, timeout=HTTP_TIMEOUT, stream=True) as response:
+            if response.status_code == 304:
+                metricas.anotar(status=304)
+                return None, response.headers
+            response.raise_for_status()
             
-            for i, link in enumerate(links, 1):
-                mensagem = f"{i}. {link}"
-                enviar_para_slack(mensagem, thread_ts)
-                
-                # Extrair entidades do conteúdo completo da notícia
-                entidades = extrair_entidades_do_conteudo(link)
-                
-                if entidades:
-                    print(f"Entidades extraídas de '{link}': {entidades}")
-                    
-                    # Buscar entidades no BigQuery
-                    resultados = buscar_no_bigquery(entidades)
-                    todos_resultados.extend(resultados)
-                else:
-                    print(f"Nenhuma entidade encontrada em: {link}")
-        else:
-            print(f"Nenhuma notícia encontrada para '{palavra}'")
+            extrator = ExtratorConteudoHTML()
+            decodificador = None
+            total = 0
+            for bloco in response.iter_content(chunk_size=16384):
+                bloco = bloco[:HTTP_MAX_BYTES - total]
+                if decodificador is None:
+                    decodificador = codecs.getincrementaldecoder(detectar_codificacao(response, bloco))(errors="replace")
+                extrator.feed(decodificador.decode(bloco))
+                total += len(bloco)
+                # Para no limite de bytes ou se o site estiver enviando o corpo devagar demais
+                if total >= HTTP_MAX_BYTES or time.monotonic() - inicio > HTTP_TIMEOUT:
+                    break
+            
+            if decodificador is not None:
+                extrator.feed(decodificador.decode(b"", final=True))
+            extrator.close()
+            metricas.contar("bytes_baixados", total)
+            metricas.anotar(bytes=total, status=response.status_code)
+            return extrator.resultado(url), response.headers
+
+# Função para extrair o conteúdo completo da notícia
+@metricas.rastrear("obter_conteudo_da_pagina")
+def obter_conteudo_da_pagina(url):
+    metricas.anotar(url=url)
     
-    # Agrupar resultados por user_id para evitar duplicações
-    resultados_por_usuario = {}
-    for resultado in todos_resultados:
-        user_id = resultado["user_id"]
+    # Conteúdo ainda dentro do TTL vem direto do cache, sem acessar a rede
+    em_cache = cache_paginas.obter(url, incluir_expirado=True)
+    if em_cache and em_cache[2]:
+        metricas.anotar(origem="cache")
+        return em_cache[0]
+    
+    try:
+        meta = em_cache[1] if em_cache else {}
+        dados, headers = baixar_pagina(url, meta.get("etag"), meta.get("last_modified"))
         
-        if user_id in resultados_por_usuario:
-            # Atualiza o score se o novo for maior
-            if resultado["score"] > resultados_por_usuario[user_id]["score"]:
-                resultados_por_usuario[user_id] = resultado
-        else:
-            resultados_por_usuario[user_id] = resultado
+        # Página não mudou desde a última visita (304): reaproveita o conteúdo extraído
+        if dados is None:
+            cache_paginas.renovar(url)
+            return em_cache[0]
+        
+        if dados["conteudo"]:
+            cache_paginas.gravar(url, dados, {
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified")
+            })
+        return dados
+    except Exception as e:
+        print(f"Erro ao obter conteúdo de {url}: {e}")
+        metricas.anotar(erro=str(e))
+        return {"titulo": extrair_titulo_da_url(url), "conteudo": "", "url": url}
+
+# Namespaces dos feeds Atom e de conteúdo
+ATOM = "{http://www.w3.org/2005/Atom}"
+RSS_CONTEUDO = "{http://purl.org/rss/1.0/modules/content/}encoded"
+
+# Função para ler os itens de um feed RSS 2.0 ou Atom: link, título, resumo e data de publicação
+def interpretar_feed(xml):
+    raiz = ElementTree.fromstring(xml)
+    itens = []
     
-    # Ordenar resultados por score (decrescente)
-    resultados_ordenados = sorted(
-        resultados_por_usuario.values(), 
-        key=lambda x: x["score"], 
-        reverse=True
-    )
+    def texto(elemento, *caminhos):
+        for caminho in caminhos:
+            filho = elemento.find(caminho)
+            if filho is not None and filho.text:
+                return filho.text.strip()
+        return ""
     
-    # Enviar resultados para o Slack
-    if resultados_ordenados:
-        mensagem = "*ALERTA: Possíveis correspondências de entidades em notícias recentes*"
-        response = enviar_para_slack(mensagem)
-        thread_ts = response.data.get('ts') if response else None
+    for item in raiz.iter("item"):
+        publicado = texto(item, "pubDate", "{http://purl.org/dc/elements/1.1/}date")
+        itens.append({"link": texto(item, "link", "guid"), "titulo": texto(item, "title"),
+                      "resumo": texto(item, "description", RSS_CONTEUDO), "publicado": publicado})
+    
+    for entrada in raiz.iter(f"{ATOM}entry"):
+        link = ""
+        for elemento in entrada.findall(f"{ATOM}link"):
+            if elemento.get("rel", "alternate") == "alternate" and elemento.get("href"):
+                link = elemento.get("href")
+                break
+        itens.append({"link": link, "titulo": texto(entrada, f"{ATOM}title"),
+                      "resumo": texto(entrada, f"{ATOM}summary", f"{ATOM}content"),
+                      "publicado": texto(entrada, f"{ATOM}published", f"{ATOM}updated")})
+    
+    for item in itens:
+        item["publicado"] = converter_data_feed(item["publicado"])
+    return [item for item in itens if item["link"].startswith(("http://", "https://"))]
+
+# Função para converter a data de um item (RFC 822 no RSS, ISO 8601 no Atom) em timestamp
+def converter_data_feed(texto):
+    if not texto:
+        return None
+    try:
+        data = email.utils.parsedate_to_datetime(texto)
+    except (TypeError, ValueError):
+        try:
+            data = datetime.datetime.fromisoformat(texto.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if data.tzinfo is None:
+        data = data.replace(tzinfo=datetime.timezone.utc)
+    return data.timestamp()
+
+# Função para obter os itens de um feed RSS/Atom
+# Dentro de CACHE_TTL_BUSCAS vem do cache; depois, o feed é pedido com If-None-Match /
+# If-Modified-Since e, se não mudou (304), os itens guardados são reaproveitados
+@metricas.rastrear("buscar_feed")
+def buscar_feed(url, dias_anteriores=1):
+    metricas.anotar(url=url)
+    em_cache = cache_feeds.obter(url, incluir_expirado=True)
+    if em_cache and em_cache[2]:
+        itens = em_cache[0]
+        metricas.anotar(origem="cache")
+    else:
+        meta = em_cache[1] if em_cache else {}
+        headers = {"Accept": "application/rss+xml, application/atom+xml, application/xml;q=0.9, */*;q=0.8"}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        
+        try:
+            with _semaforo_do_host(url):
+                with obter_sessao_http().get(url, headers=headers, timeout=HTTP_TIMEOUT, stream=True) as response:
+                    if response.status_code == 304 and em_cache:
+                        cache_feeds.renovar(url)
+                        metricas.anotar(status=304)
+                        itens = em_cache[0]
+                    else:
+                        response.raise_for_status()
+                        corpo = bytearray()
+                        for bloco in response.iter_content(chunk_size=16384):
+                            corpo += bloco
+                            if len(corpo) >= HTTP_MAX_BYTES:
+                                break
+                        metricas.contar("bytes_baixados", len(corpo))
+                        itens = interpretar_feed(bytes(corpo[:HTTP_MAX_BYTES]))
+                        cache_feeds.gravar(url, itens, {
+                            "etag": response.headers.get("ETag"),
+                            "last_modified": response.headers.get("Last-Modified")
+                        })
+                        metricas.anotar(status=response.status_code, bytes=len(corpo))
+        except Exception as e:
+            print(f"Erro ao ler o feed {url}: {e}")
+            metricas.anotar(erro=str(e))
+            return []
+    
+    # Itens sem data entram; os publicados antes do período da busca, não
+    limite = time.time() - dias_anteriores * 86400
+    recentes = [item for item in itens if item["publicado"] is None or item["publicado"] >= limite]
+    metricas.anotar(itens=len(itens), recentes=len(recentes))
+    return recentes
+
+# Função para normalizar um texto para comparação com as palavras-chave
+# (sem acentos, minúsculas e só letras e números separados por um espaço)
+def normalizar_para_busca(texto):
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", remover_acentos(texto.lower())).split())
+
+# Função para escolher os itens de um feed que citam alguma palavra-chave (no título ou no resumo)
+# A última palavra pode ter continuação, para aceitar plurais ("fintech" encontra "fintechs")
+# Retorna pares (item, palavra-chave)
+def filtrar_itens_do_feed(itens, palavras_chave):
+    palavras = [(palavra, f" {normalizar_para_busca(palavra)}") for palavra in palavras_chave]
+    palavras = [(palavra, normalizada) for palavra, normalizada in palavras if normalizada.strip()]
+    selecionados = []
+    for item in itens:
+        texto = f" {normalizar_para_busca(item['titulo'] + ' ' + item['resumo'])} "
+        for palavra, normalizada in palavras:
+            if normalizada in texto:
+                selecionados.append((item, palavra))
+                break
+    return selecionados
+
+# Tags cujo conteúdo nunca faz parte do texto da notícia
+TAGS_IGNORADAS = {"script", "style", "noscript", "template", "svg", "nav", "header", "footer", "aside", "iframe"}
+
+# Tags sem fechamento, que não entram na pilha de elementos abertos
+TAGS_VAZIAS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+
+# Tags que fecham implicitamente um <p> aberto
+TAGS_BLOCO = {"p", "div", "section", "article", "main", "ul", "ol", "table", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "figure", "pre"}
+
+# Tags que separam palavras no texto extraído
+TAGS_SEPARADORAS = TAGS_BLOCO | {"li", "td", "th", "tr", "dd", "dt", "figcaption"}
+
+# Classes/IDs comuns para o conteúdo principal em sites de notícias
+PADRAO_CLASSE_CONTEUDO = re.compile(r'content|article|post|news|materia|texto|entry|body|main', re.IGNORECASE)
+
+# Extrator incremental do conteúdo principal de uma notícia, em uma única passada pelo HTML
+# - descarta as subárvores de TAGS_IGNORADAS e os comentários
+# - guarda o texto visível em segmentos, na ordem do documento
+# - cada bloco candidato (<article>, <main>, <div>/<section> com classe/ID de conteúdo) e cada
+#   <p> viram faixas [início, fim) sobre a lista de segmentos, sem copiar texto
+# - os caracteres em <p> e em links são somados em contadores do documento inteiro; cada bloco
+#   guarda os contadores na abertura e, no fechamento, fica com a diferença (o custo por nó de
+#   texto não depende de quantos blocos estão abertos)
+# No final escolhe o bloco com mais texto em parágrafos fora de links
+class ExtratorConteudoHTML(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.titulo = None
+        self._no_titulo = False
+        self._texto_titulo = []
+        self._segmentos = []
+        self._pilha = []  # [tag, bloco ou None]
+        self._ignorando = 0
+        self._em_link = 0
+        self._em_paragrafo = None
+        self._paragrafos = []
+        self._blocos = []  # [tag, início, fim, caracteres em <p>, caracteres em links]
+        self._tags_abertas = Counter()
+        self._caracteres_paragrafo = 0
+        self._caracteres_link = 0
+    
+    def _eh_candidato(self, tag, attrs):
+        if tag in ("article", "main"):
+            return True
+        if tag in ("div", "section"):
+            atributos = dict(attrs)
+            return bool(PADRAO_CLASSE_CONTEUDO.search(f"{atributos.get('class') or ''} {atributos.get('id') or ''}"))
+        return False
+    
+    def _fechar_paragrafo(self):
+        if self._em_paragrafo is not None:
+            self._paragrafos.append((self._em_paragrafo, len(self._segmentos)))
+            self._em_paragrafo = None
+    
+    # Fecha o último elemento aberto com a tag e tudo que ficou aberto dentro dele (HTML malformado)
+    def _fechar_ate(self, tag):
+        # Tags de fechamento sem abertura correspondente não percorrem a pilha
+        if not self._tags_abertas[tag]:
+            return
+        for posicao in range(len(self._pilha) - 1, -1, -1):
+            if self._pilha[posicao][0] == tag:
+                while len(self._pilha) > posicao:
+                    self._fechar_elemento(*self._pilha.pop())
+                return
+    
+    def _fechar_elemento(self, tag, bloco):
+        self._tags_abertas[tag] -= 1
+        if tag in TAGS_IGNORADAS:
+            self._ignorando -= 1
+        elif tag == "a":
+            self._em_link -= 1
+        elif tag == "p":
+            self._fechar_paragrafo()
+        if bloco is not None:
+            self._concluir_bloco(bloco)
+    
+    # Fecha a faixa do bloco e troca os contadores da abertura pelos caracteres dentro dele
+    def _concluir_bloco(self, bloco):
+        bloco[2] = len(self._segmentos)
+        bloco[3] = self._caracteres_paragrafo - bloco[3]
+        bloco[4] = self._caracteres_link - bloco[4]
+    
+    def handle_starttag(self, tag, attrs):
+        if tag == "title" and self.titulo is None:
+            self._no_titulo = True
+            return
+        if tag in TAGS_VAZIAS:
+            if tag == "br" and not self._ignorando:
+                self._segmentos.append(" ")
+            return
+        if tag in TAGS_BLOCO and self._em_paragrafo is not None:
+            self._fechar_ate("p")
+        if tag in TAGS_SEPARADORAS:
+            self._segmentos.append(" ")
+        
+        bloco = None
+        if tag in TAGS_IGNORADAS:
+            self._ignorando += 1
+        elif tag == "a":
+            self._em_link += 1
+        elif tag == "p" and not self._ignorando:
+            self._em_paragrafo = len(self._segmentos)
+        elif not self._ignorando and self._eh_candidato(tag, attrs):
+            bloco = [tag, len(self._segmentos), None, self._caracteres_paragrafo, self._caracteres_link]
+            self._blocos.append(bloco)
+        self._pilha.append([tag, bloco])
+        self._tags_abertas[tag] += 1
+    
+    def handle_startendtag(self, tag, attrs):
+        if tag == "br" and not self._ignorando:
+            self._segmentos.append(" ")
+    
+    def handle_endtag(self, tag):
+        if tag == "title" and self._no_titulo:
+            self._no_titulo = False
+            self.titulo = " ".join("".join(self._texto_titulo).split())
+            return
+        self._fechar_ate(tag)
+        if tag in TAGS_SEPARADORAS:
+            self._segmentos.append(" ")
+    
+    def handle_data(self, data):
+        if self._no_titulo:
+            self._texto_titulo.append(data)
+            return
+        if self._ignorando or not data.strip():
+            return
         
-        for resultado in resultados_ordenados:
-            # Mostra apenas resultados com score significativo
-            if resultado['score'] > 0.4:
-                score_percentual = int(resultado['score'] * 100)
+        self._segmentos.append(data)
+        tamanho = len(data.strip())
+        if self._em_paragrafo is not None:
+            self._caracteres_paragrafo += tamanho
+        if self._em_link:
+            self._caracteres_link += tamanho
+    
+    def _texto(self, inicio, fim):
+        return " ".join("".join(self._segmentos[inicio:fim]).split())
+    
+    def _escolher_bloco(self):
+        # Blocos que ficaram abertos (HTML malformado) vão até o fim do documento
+        for bloco in self._blocos:
+            if bloco[2] is None:
+                self._concluir_bloco(bloco)
+        
+        # Texto em parágrafos, descontando o que está dentro de links (menus, "leia também")
+        pontuados = [(max(bloco[3] - bloco[4], 0), bloco) for bloco in self._blocos]
+        if not pontuados:
+            return None
+        melhor = max(pontuacao for pontuacao, _ in pontuados)
+        if melhor == 0:
+            return None
+        
+        # Entre os blocos com quase todo o texto do melhor, prefere o mais interno (menor)
+        proximos = [bloco for pontuacao, bloco in pontuados if pontuacao >= melhor * 0.9]
+        return min(proximos, key=lambda bloco: bloco[2] - bloco[1])
+    
+    # Monta o resultado com as mesmas regras de tamanho mínimo da extração anterior
+    def resultado(self, url):
+        self._fechar_paragrafo()
+        titulo = self.titulo or extrair_titulo_da_url(url)
+        
+        # Estratégia 1: conteúdo do melhor bloco candidato
+        conteudo = ""
+        bloco = self._escolher_bloco()
+        if bloco is not None:
+            conteudo = self._texto(bloco[1], bloco[2])
+        
+        # Estratégia 2: todos os parágrafos <p> com conteúdo significativo
+        if len(conteudo) < 500:
+            paragrafos = (self._texto(inicio, fim) for inicio, fim in self._paragrafos)
+            conteudo = " ".join(p for p in paragrafos if len(p) > 30)
+        
+        # Último recurso: frases significativas de todo o texto visível
+        if len(conteudo) < 300:
+            todo_texto = self._texto(0, len(self._segmentos))
+            paragrafos = re.split(r'(?<=[.!?])\s+', todo_texto)
+            conteudo = " ".join(p for p in paragrafos if len(p) > 50)
+        
+        # Se ainda for muito grande, limitar o tamanho (o GPT recebe o texto dividido em trechos)
+        if len(conteudo) > CONTEUDO_MAX_CARACTERES:
+            conteudo = conteudo[:CONTEUDO_MAX_CARACTERES]
+        
+        metricas.anotar(caracteres=len(conteudo))
+        
+        return {
+            "titulo": titulo,
+            "conteudo": conteudo,
+            "url": url
+        }
+
+# Função para extrair título e texto principal de um HTML já baixado
+def extrair_conteudo_do_html(html, url):
+    try:
+        extrator = ExtratorConteudoHTML()
+        extrator.feed(html)
+        extrator.close()
+        return extrator.resultado(url)
+    except Exception as e:
+        print(f"Erro ao extrair conteúdo de {url}: {e}")
+        return {"titulo": extrair_titulo_da_url(url), "conteudo": "", "url": url}
+
+def extrair_titulo_da_url(url):
+    # Extrai título a partir da URL como fallback
+    parse_result = urlparse(url)
+    path = parse_result.path
+    
+    # Obter o último segmento da URL e substituir hífens por espaços
+    titulo = unquote(path.split('/')[-1].replace('-', ' '))
+    return titulo
+
+# Limitador de taxa em janela deslizante de um minuto, compartilhado entre as threads
+# Controla requisições e tokens por minuto; pausar() segura todas as threads após um 429
+class LimitadorTaxa:
+    def __init__(self, requisicoes_por_minuto, tokens_por_minuto, janela=60.0):
+        self.requisicoes_por_minuto = requisicoes_por_minuto
+        self.tokens_por_minuto = tokens_por_minuto
+        self.janela = janela
+        self._eventos = deque()
+        self._tokens_na_janela = 0
+        self._pausado_ate = 0.0
+        self._lock = threading.Lock()
+    
+    def aguardar(self, tokens):
+        # Uma requisição maior que o orçamento inteiro ainda pode passar, sozinha na janela
+        tokens = min(tokens, self.tokens_por_minuto)
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                while self._eventos and agora - self._eventos[0][0] >= self.janela:
+                    self._tokens_na_janela -= self._eventos.popleft()[1]
                 
-                # Definir nível de alerta com base no score
-                if resultado['score'] > 0.8:
-                    nivel_alerta = "🔴 ALTO"
-                elif resultado['score'] > 0.6:
-                    nivel_alerta = "🟠 MÉDIO"
+                if agora >= self._pausado_ate and (
+                    len(self._eventos) < self.requisicoes_por_minuto and
+                    self._tokens_na_janela + tokens <= self.tokens_por_minuto
+                ):
+                    self._eventos.append((agora, tokens))
+                    self._tokens_na_janela += tokens
+                    return
+                
+                if agora < self._pausado_ate:
+                    espera = self._pausado_ate - agora
                 else:
-                    nivel_alerta = "🟡 BAIXO"
-                    
-                mensagem = (
-                    f"*Entidade:* {resultado['entidade']} ({resultado['tipo']})\n"
-                    f"*User ID:* {resultado['user_id']}\n"
-                    f"*Merchant Name:* {resultado['merchant_name']}\n"
-                    f"*Score:* {score_percentual}% ({nivel_alerta})"
+                    espera = self.janela - (agora - self._eventos[0][0])
+            time.sleep(max(espera, 0.05))
+    
+    def pausar(self, segundos):
+        with self._lock:
+            self._pausado_ate = max(self._pausado_ate, time.monotonic() + segundos)
+
+limitador_openai = LimitadorTaxa(OPENAI_RPM, OPENAI_TPM)
+
+# Função para estimar os tokens de uma chamada (~4 caracteres por token + resposta)
+def estimar_tokens(params):
+    caracteres = sum(len(mensagem["content"]) for mensagem in params["messages"])
+    return caracteres // 4 + OPENAI_TOKENS_RESPOSTA
+
+# Função para chamar a API da OpenAI respeitando RPM/TPM, com backoff exponencial e jitter
+# em caso de 429, timeout ou erro do servidor (usa o Retry-After quando a API informa)
+def chamar_openai(params):
+    tokens = estimar_tokens(params)
+    
+    for tentativa in range(OPENAI_MAX_TENTATIVAS):
+        limitador_openai.aguardar(tokens)
+        try:
+            response = openai.chat.completions.create(**params)
+            uso = getattr(response, "usage", None)
+            if uso is not None:
+                metricas.contar("tokens_enviados", uso.prompt_tokens, modelo=params["model"])
+                metricas.contar("tokens_recebidos", uso.completion_tokens, modelo=params["model"])
+                metricas.anotar(tokens_enviados=uso.prompt_tokens, tokens_recebidos=uso.completion_tokens)
+            metricas.contar("chamadas_openai", modelo=params["model"])
+            return response
+        except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+            if tentativa == OPENAI_MAX_TENTATIVAS - 1:
+                raise
+            
+            resposta = getattr(e, "response", None)
+            retry_after = resposta.headers.get("retry-after") if resposta is not None else None
+            try:
+                espera = float(retry_after)
+            except (TypeError, ValueError):
+                espera = min(2 ** tentativa, 60)
+            espera += random.uniform(0, espera)
+            
+            if isinstance(e, openai.RateLimitError):
+                limitador_openai.pausar(espera)
+            metricas.contar("novas_tentativas", servico="openai", motivo=type(e).__name__)
+            print(f"OpenAI indisponível ({type(e).__name__}), nova tentativa em {espera:.1f}s")
+            time.sleep(espera)
+
+# Função para montar as mensagens do prompt de extração de entidades
+def montar_mensagens_entidades(texto):
+    return [
+        {"role": "system", "content": "Você é um especialista em análise de textos. Sua tarefa é extrair somente nomes próprios completos de pessoas e empresas mencionadas em notícias."},
+        {"role": "user", "content": f"""
+        Analise o seguinte texto de notícia e extraia APENAS:
+        
+        1. Nomes COMPLETOS de PESSOAS
+        2. Nomes COMPLETOS de EMPRESAS
+        
+        IMPORTANTE:
+        - NÃO extraia nomes de cidades, estados ou países
+        - NÃO extraia órgãos públicos como "Polícia Federal", "Ministério Público", etc
+        - NÃO extraia termos genéricos como "empresa", "companhia", "organização"
+        - Extraia apenas nomes próprios completos específicos
+        
+        Texto da notícia: {texto}
+        
+        Forneça APENAS o seguinte formato JSON sem explicações adicionais:
+        [
+          {{"texto": "Nome da Pessoa", "tipo": "PER"}},
+          {{"texto": "Nome da Empresa", "tipo": "ORG"}}
+        ]
+        
+        Se não houver nenhuma pessoa ou empresa específica mencionada, retorne uma lista vazia [].
+        """}
+    ]
+
+# Função para montar as mensagens de um prompt com várias notícias numeradas
+def montar_mensagens_entidades_agrupadas(textos):
+    noticias = "\n\n".join(f"Notícia {i}: {texto}" for i, texto in enumerate(textos, 1))
+    return [
+        {"role": "system", "content": "Você é um especialista em análise de textos. Sua tarefa é extrair somente nomes próprios completos de pessoas e empresas mencionadas em notícias."},
+        {"role": "user", "content": f"""
+        Analise cada uma das notícias numeradas abaixo e extraia APENAS:
+        
+        1. Nomes COMPLETOS de PESSOAS
+        2. Nomes COMPLETOS de EMPRESAS
+        
+        IMPORTANTE:
+        - NÃO extraia nomes de cidades, estados ou países
+        - NÃO extraia órgãos públicos como "Polícia Federal", "Ministério Público", etc
+        - NÃO extraia termos genéricos como "empresa", "companhia", "organização"
+        - Extraia apenas nomes próprios completos específicos
+        - Analise cada notícia separadamente
+        
+        {noticias}
+        
+        Forneça APENAS um objeto JSON, sem explicações adicionais, em que cada chave é o número da notícia:
+        {{
+          "1": [{{"texto": "Nome da Pessoa", "tipo": "PER"}}, {{"texto": "Nome da Empresa", "tipo": "ORG"}}],
+          "2": []
+        }}
+        
+        Use uma lista vazia [] para notícias sem nenhuma pessoa ou empresa específica.
+        """}
+    ]
+
+# Função para converter a resposta do GPT em JSON, removendo blocos de código markdown
+def interpretar_json_gpt(resultado):
+    # Remover qualquer texto que não seja JSON
+    if resultado.startswith("```json"):
+        resultado = resultado.replace("```json", "").replace("```", "")
+    elif resultado.startswith("```"):
+        resultado = resultado.replace("```", "")
+    
+    return json.loads(resultado.strip())
+
+# Termos genéricos que o GPT às vezes devolve como entidade
+TERMOS_IGNORAR = [
+    "g1", "brasil", "cnn brasil", "cnn", "veja", "estadão", "youtube", 
+    "agência brasil", "rio de janeiro", "são paulo", "polícia civil", 
+    "polícia federal", "pf", "banco digital", "banco", "fintech", 
+    "empresa", "companhia", "organização", "instituição"
+]
+
+# Lista de nomes de cidades brasileiras comuns que podem ser erroneamente extraídas como entidades
+CIDADES = ["rio", "são paulo", "brasília", "salvador", "fortaleza", "recife", 
+           "belo horizonte", "manaus", "curitiba", "porto alegre", "belém",
+           "goiânia", "guarulhos", "campinas", "são luís", "maceió"]
+
+# Órgãos públicos (qualquer nome que contenha um destes termos é descartado)
+ORGAOS_PUBLICOS = ["ministério", "polícia", "receita", "secretaria"]
+
+# Função para verificar se um nome é termo genérico, local geográfico ou órgão público
+def entidade_ignorada(nome):
+    nome = nome.lower()
+    return (not nome or nome in TERMOS_IGNORAR or
+            any(cidade in nome for cidade in CIDADES) or
+            any(orgao in nome for orgao in ORGAOS_PUBLICOS))
+
+# Sufixos societários ignorados na forma canônica dos nomes ("S.A." vira "s a")
+SUFIXOS_SOCIETARIOS = {"ltda", "limitada", "me", "mei", "epp", "eireli", "cia"}
+
+# Função para remover os acentos de um texto (é -> e, ç -> c)
+def remover_acentos(texto):
+    return "".join(c for c in unicodedata.normalize("NFD", texto) if not unicodedata.combining(c))
+
+# Função para obter a forma canônica de um nome de pessoa ou empresa: sem acentos, em
+# minúsculas, sem pontuação e sem sufixos societários no fim ("Ltda", "S.A.", "ME"...)
+# "TransLog Logística S.A." e "Translog Logistica" têm a mesma forma: "translog logistica"
+# O sufixo só sai se sobrarem ao menos duas palavras ("Serviços Ltda" não vira "servicos")
+def canonicalizar_entidade(texto):
+    palavras = re.sub(r"[^a-z0-9]+", " ", remover_acentos(texto.lower())).split()
+    while True:
+        if len(palavras) > 2 and palavras[-1] in SUFIXOS_SOCIETARIOS:
+            palavras.pop()
+        elif len(palavras) > 3 and palavras[-2:] == ["s", "a"]:
+            del palavras[-2:]
+        else:
+            break
+    return " ".join(palavras)
+
+# Função para filtrar entidades genéricas, locais geográficos e órgãos públicos
+def filtrar_entidades(entidades):
+    if not isinstance(entidades, list):
+        return []
+    
+    entidades_filtradas = []
+    for entidade in entidades:
+        if not isinstance(entidade, dict):
+            continue
+        
+        # Não incluir termos genéricos ou locais geográficos
+        if not entidade_ignorada(entidade.get("texto", "")):
+            entidades_filtradas.append(entidade)
+    
+    return entidades_filtradas
+
+# Função para extrair entidades usando GPT
+@metricas.rastrear("extrair_entidades_gpt")
+def extrair_entidades_gpt(texto):
+    metricas.anotar(caracteres=len(texto))
+    
+    # Texto idêntico já analisado pelo mesmo modelo: usa as entidades do cache
+    em_cache = cache_entidades.obter(chave_conteudo(OPENAI_MODEL, texto))
+    if em_cache:
+        metricas.anotar(origem="cache", entidades=len(em_cache[0]))
+        return em_cache[0]
+    
+    return _consultar_gpt_entidades(texto)
+
+# Uma falha na API (ou uma resposta sem JSON) é repassada: "sem entidades" só vale para uma
+# resposta válida, e a notícia com erro volta para a fila para ser extraída de novo
+def _consultar_gpt_entidades(texto):
+    try:
+        # Configura a chamada para a API do OpenAI usando a nova interface v1.x
+        params = {
+            "model": OPENAI_MODEL,  # GPT-4o por padrão
+            "messages": montar_mensagens_entidades(texto),
+            "temperature": 0.0  # Zero para respostas determinísticas
+        }
+        
+        # Faz a chamada para a API do OpenAI
+        response = chamar_openai(params)
+        
+        # Extrai a resposta
+        resultado = response.choices[0].message.content.strip()
+        
+        # Tenta converter a resposta para JSON
+        try:
+            entidades_filtradas = filtrar_entidades(interpretar_json_gpt(resultado))
+            metricas.anotar(entidades=len(entidades_filtradas))
+            cache_entidades.gravar(chave_conteudo(OPENAI_MODEL, texto), entidades_filtradas)
+            return entidades_filtradas
+        except json.JSONDecodeError:
+            print(f"Erro ao decodificar JSON da resposta GPT: {resultado}")
+            metricas.anotar(erro="resposta sem JSON válido")
+            raise
+            
+    except json.JSONDecodeError:
+        raise
+    except Exception as e:
+        print(f"Erro ao chamar API do OpenAI: {e}")
+        metricas.anotar(erro=str(e))
+        raise
+
+# Função para extrair entidades de várias notícias em um único prompt
+# Se a resposta não trouxer alguma das notícias, ela é analisada individualmente
+def _consultar_gpt_entidades_agrupadas(textos):
+    resultados = [None] * len(textos)
+    try:
+        params = {
+            "model": OPENAI_MODEL,
+            "messages": montar_mensagens_entidades_agrupadas(textos),
+            "temperature": 0.0
+        }
+        response = chamar_openai(params)
+        resultado = response.choices[0].message.content.strip()
+        
+        por_noticia = interpretar_json_gpt(resultado)
+        if isinstance(por_noticia, dict):
+            for i, texto in enumerate(textos):
+                if str(i + 1) in por_noticia:
+                    resultados[i] = filtrar_entidades(por_noticia[str(i + 1)])
+                    cache_entidades.gravar(chave_conteudo(OPENAI_MODEL, texto), resultados[i])
+    except Exception as e:
+        print(f"Erro na extração agrupada, analisando as notícias individualmente: {e}")
+    
+    return [
+        entidades if entidades is not None else _consultar_gpt_entidades(texto)
+        for texto, entidades in zip(textos, resultados)
+    ]
+
+# Função para separar as notícias em grupos para o modo agrupado
+# Notícias longas seguem sozinhas; as curtas são reunidas até o limite de caracteres
+def agrupar_textos(indices, textos):
+    if not OPENAI_AGRUPAR:
+        return [[i] for i in indices]
+    
+    grupos = []
+    grupo_atual = []
+    caracteres = 0
+    for i in sorted(indices, key=lambda i: len(textos[i])):
+        tamanho = len(textos[i])
+        if grupo_atual and (caracteres + tamanho > OPENAI_GRUPO_MAX_CARACTERES or
+                            len(grupo_atual) >= OPENAI_GRUPO_MAX_NOTICIAS):
+            grupos.append(grupo_atual)
+            grupo_atual = []
+            caracteres = 0
+        grupo_atual.append(i)
+        caracteres += tamanho
+    if grupo_atual:
+        grupos.append(grupo_atual)
+    return grupos
+
+# Função para extrair entidades de várias notícias de forma concorrente
+# Retorna uma lista de entidades por texto, na mesma ordem de entrada
+def extrair_entidades_em_lote(textos):
+    resultados = [None] * len(textos)
+    
+    # Textos já analisados saem do cache sem chamar a API
+    pendentes = []
+    for i, texto in enumerate(textos):
+        em_cache = cache_entidades.obter(chave_conteudo(OPENAI_MODEL, texto))
+        if em_cache:
+            resultados[i] = em_cache[0]
+        else:
+            pendentes.append(i)
+    
+    grupos = agrupar_textos(pendentes, textos)
+    if grupos:
+        print(f"Extraindo entidades de {len(pendentes)} notícias em {len(grupos)} chamadas ao GPT...")
+        with ThreadPoolExecutor(max_workers=min(OPENAI_MAX_CONCORRENCIA, len(grupos))) as executor:
+            futuros = {}
+            for grupo in grupos:
+                if len(grupo) == 1:
+                    futuro = executor.submit(lambda texto: [_consultar_gpt_entidades(texto)], textos[grupo[0]])
+                else:
+                    futuro = executor.submit(_consultar_gpt_entidades_agrupadas, [textos[i] for i in grupo])
+                futuros[futuro] = grupo
+            
+            for futuro in as_completed(futuros):
+                for i, entidades in zip(futuros[futuro], futuro.result()):
+                    resultados[i] = entidades
+    
+    return resultados
+
+# Função para combinar título e conteúdo de uma notícia para a análise
+def montar_texto_da_noticia(dados):
+    return f"{dados['titulo']} \n\n {dados['conteudo']}"
+
+# Função para dividir um texto em frases (após ".", "!" ou "?")
+def dividir_frases(texto):
+    return [frase for frase in re.split(r'(?<=[.!?])\s+', texto) if frase.strip()]
+
+# Palavras com inicial maiúscula que aparecem no início das frases e não fazem parte de nomes
+PALAVRAS_INICIO_FRASE = {
+    "A", "As", "O", "Os", "Um", "Uma", "Em", "No", "Na", "Nos", "Nas", "Ao", "Aos", "À", "Às",
+    "De", "Do", "Da", "Dos", "Das", "Pelo", "Pela", "Para", "Por", "Com", "Sem", "Sobre", "Entre",
+    "Segundo", "Conforme", "Após", "Antes", "Durante", "Desde", "Até", "Mas", "E", "Ou", "Se",
+    "Ele", "Ela", "Eles", "Elas", "Este", "Esta", "Esse", "Essa", "Nesta", "Neste", "Nessa", "Nesse",
+    "Também", "Já", "Ainda", "Quando", "Como", "Onde", "Leia", "Veja", "Foto", "Fotos",
+}
+
+# Instituições públicas e regiões que não estão nas listas de filtrar_entidades e
+# também não são pessoas nem empresas (completam o gazetteer do pré-filtro)
+GAZETTEER_PREFILTRO = [
+    "banco central", "supremo", "tribunal", "justiça", "congresso", "senado", "câmara",
+    "prefeitura", "governo", "procuradoria", "defensoria", "comissão de valores mobiliários",
+    "conselho de controle", "assembleia", "copom", "defesa civil", "corpo de bombeiros",
+    "guarda municipal", "caixa econômica",
+    "estado de", "zona sul", "zona norte", "zona leste", "zona oeste", "nordeste", "sudeste",
+]
+
+# Sequência de palavras com inicial maiúscula, admitindo "da", "de", "dos", "e", "&" entre elas
+PALAVRA_CAPITALIZADA = r"[A-ZÁÀÂÃÉÊÍÓÔÕÚÇ][\wÀ-ÿ'’.&/-]*"
+PADRAO_NOME_CANDIDATO = re.compile(
+    rf"{PALAVRA_CAPITALIZADA}(?:\s+(?:(?:d[aeo]s?|e|&)\s+)?{PALAVRA_CAPITALIZADA})*"
+)
+
+# Siglas e marcas em maiúsculas ("CVM", "XP", "C6")
+PADRAO_SIGLA = re.compile(r"[A-ZÁÀÂÃÉÊÍÓÔÕÚÇ][A-ZÁÀÂÃÉÊÍÓÔÕÚÇ0-9&]+")
+
+# Função para detectar, sem o GPT, os possíveis nomes de pessoas e empresas de um texto
+# Descarta palavras de início de frase e nomes do gazetteer (cidades, órgãos, termos genéricos)
+# Uma palavra isolada só conta se não abrir a frase ("A Binance foi multada") ou se for uma sigla
+def detectar_nomes_candidatos(texto):
+    candidatos = {}
+    for frase in dividir_frases(texto):
+        for trecho in PADRAO_NOME_CANDIDATO.finditer(frase):
+            palavras = trecho.group().rstrip(".").split()
+            inicio_frase = trecho.start() == 0
+            while palavras and palavras[0] in PALAVRAS_INICIO_FRASE:
+                palavras.pop(0)
+                inicio_frase = False
+            if not palavras:
+                continue
+            if len(palavras) == 1 and inicio_frase and not PADRAO_SIGLA.fullmatch(palavras[0]):
+                continue
+            
+            nome = " ".join(palavras)
+            if entidade_ignorada(nome) or any(termo in nome.lower() for termo in GAZETTEER_PREFILTRO):
+                continue
+            candidatos.setdefault(nome, None)
+    return list(candidatos)
+
+# Função para conferir os candidatos no índice local de merchants
+# Usa o tipo ORG (maior score base) para nunca descartar um nome que poderia virar alerta
+def candidatos_relevantes_no_indice(candidatos, snapshot):
+    melhores = {}
+    entidades = [{"texto": candidato, "tipo": "ORG"} for candidato in candidatos]
+    for resultado in buscar_no_indice_local(entidades, snapshot, top_k=1):
+        melhores[resultado["entidade"]] = max(melhores.get(resultado["entidade"], 0.0), resultado["score"])
+    return [candidato for candidato in candidatos if melhores.get(candidato, 0.0) > PREFILTRO_SCORE_MINIMO]
+
+# Frases vistas por site nesta execução
+# Uma frase que aparece em notícias diferentes do mesmo site (assinatura, "Leia também",
+# aviso de direitos autorais) é boilerplate e não precisa ir para o GPT
+class FrasesRepetidas:
+    def __init__(self, tamanho_minimo=20, max_frases=200000):
+        self.tamanho_minimo = tamanho_minimo
+        self.max_frases = max_frases
+        self.removidas = 0
+        self._vistas = {}
+        self._lock = threading.Lock()
+    
+    # Retorna as frases da notícia sem as repetidas (na própria notícia ou em outra do mesmo site)
+    def filtrar(self, url, frases):
+        host = urlparse(url).netloc.lower()
+        mantidas = []
+        na_noticia = set()
+        with self._lock:
+            for frase in frases:
+                normalizada = " ".join(frase.lower().split())
+                if len(normalizada) < self.tamanho_minimo:
+                    mantidas.append(frase)
+                    continue
+                
+                chave = (host, hashlib.blake2b(normalizada.encode("utf-8"), digest_size=8).digest())
+                primeira_url = self._vistas.setdefault(chave, url)
+                if chave in na_noticia or primeira_url != url:
+                    self.removidas += 1
+                    continue
+                na_noticia.add(chave)
+                mantidas.append(frase)
+            
+            # No modo serviço o processo não termina: esquece as frases mais antigas
+            excesso = len(self._vistas) - self.max_frases
+            if excesso > 0:
+                for chave in list(itertools.islice(self._vistas, excesso)):
+                    del self._vistas[chave]
+        return mantidas
+
+frases_repetidas = FrasesRepetidas()
+
+# Função para decidir o que enviar ao GPT para uma notícia
+# Remove as frases repetidas (boilerplate) e retorna None quando a notícia não tem conteúdo
+# ou, se não for curta, nenhum nome candidato (o GPT não é chamado); com PREFILTRO_INDICE, envia só o título
+# e as frases que citam candidatos presentes nos merchants
+def selecionar_texto_para_gpt(dados):
+    frases = frases_repetidas.filtrar(dados["url"], dividir_frases(dados["conteudo"]))
+    texto = f"{dados['titulo']} \n\n {' '.join(frases)}"
+    if not PREFILTRO_ATIVO:
+        return texto
+    
+    if not frases:
+        metricas.contar("gpt_evitado", motivo="sem_conteudo")
+        return None
+    
+    candidatos = detectar_nomes_candidatos(texto)
+    if not candidatos:
+        if len(texto) <= PREFILTRO_TEXTO_CURTO:
+            return texto
+        metricas.contar("gpt_evitado", motivo="sem_candidatos")
+        return None
+    
+    snapshot = obter_snapshot_merchants() if PREFILTRO_INDICE and USAR_INDICE_LOCAL else None
+    if snapshot is not None and snapshot.total:
+        relevantes = candidatos_relevantes_no_indice(candidatos, snapshot)
+        if not relevantes:
+            metricas.contar("gpt_evitado", motivo="sem_merchants")
+            return None
+        
+        selecionadas = [frase for frase in frases if any(nome in frase for nome in relevantes)]
+        texto = f"{dados['titulo']} \n\n {' '.join(selecionadas)}"
+    
+    return texto
+
+# Função para dividir um texto em trechos de até max_tokens (~4 caracteres por token),
+# sempre em fim de frase e repetindo as últimas `sobreposicao` frases no início do trecho
+# seguinte, para não perder um nome citado na fronteira entre dois trechos
+def dividir_em_trechos(texto, max_tokens=OPENAI_TRECHO_MAX_TOKENS, sobreposicao=OPENAI_TRECHO_SOBREPOSICAO):
+    max_caracteres = max_tokens * 4
+    if len(texto) <= max_caracteres:
+        return [texto]
+    
+    # Frases maiores que o trecho inteiro são quebradas por palavras
+    frases = []
+    for frase in dividir_frases(texto):
+        while len(frase) > max_caracteres:
+            corte = frase.rfind(" ", 0, max_caracteres)
+            corte = corte if corte > 0 else max_caracteres
+            frases.append(frase[:corte])
+            frase = frase[corte:].strip()
+        frases.append(frase)
+    
+    trechos = []
+    atual = []
+    novas = 0
+    for frase in frases:
+        if novas and sum(len(f) + 1 for f in atual) + len(frase) > max_caracteres:
+            trechos.append(" ".join(atual))
+            atual = atual[-sobreposicao:] if sobreposicao else []
+            novas = 0
+        # A sobreposição só é repetida se couber junto com a próxima frase
+        while atual and sum(len(f) + 1 for f in atual) + len(frase) > max_caracteres:
+            atual.pop(0)
+        atual.append(frase)
+        novas += 1
+    if novas:
+        trechos.append(" ".join(atual))
+    return trechos
+
+# Função para juntar as entidades extraídas de vários trechos, sem repetir nomes
+def mesclar_entidades(listas):
+    entidades = {}
+    for lista in listas:
+        for entidade in lista:
+            entidades.setdefault(canonicalizar_entidade(entidade["texto"]), entidade)
+    return list(entidades.values())
+
+# Função para extrair entidades (pessoas e organizações) do texto de uma notícia
+def extrair_entidades_do_texto(texto):
+    # Notícias longas vão em trechos, extraídos em paralelo, para a latência depender
+    # do tamanho do trecho e não do tamanho da notícia
+    trechos = dividir_em_trechos(texto)
+    if len(trechos) == 1:
+        return extrair_entidades_gpt(texto)
+    
+    metricas.contar("trechos_gpt", len(trechos))
+    with ThreadPoolExecutor(max_workers=min(OPENAI_MAX_CONCORRENCIA, len(trechos))) as executor:
+        return mesclar_entidades(executor.map(extrair_entidades_gpt, trechos))
+
+# Função para extrair as entidades de várias notícias já baixadas
+# Com OPENAI_AGRUPAR, as notícias curtas (um único trecho) vão juntas em prompts agrupados;
+# as longas seguem em trechos, uma a uma
+# Retorna uma lista de entidades por notícia, na mesma ordem de entrada
+def extrair_entidades_das_noticias(lista_dados):
+    resultados = [None] * len(lista_dados)
+    curtas = []
+    for i, dados in enumerate(lista_dados):
+        # Combina título e conteúdo para a análise, pulando notícias sem nomes candidatos
+        texto = selecionar_texto_para_gpt(dados)
+        if texto is None:
+            resultados[i] = []
+        elif OPENAI_AGRUPAR and len(dividir_em_trechos(texto)) == 1:
+            curtas.append((i, texto))
+        else:
+            resultados[i] = extrair_entidades_do_texto(texto)
+    
+    if curtas:
+        entidades_curtas = extrair_entidades_em_lote([texto for _, texto in curtas])
+        for (i, _), entidades in zip(curtas, entidades_curtas):
+            resultados[i] = entidades
+    return resultados
+
+# Nome do merchant normalizado em SQL da mesma forma que a forma canônica das entidades
+# (sem acentos, minúsculo, pontuação trocada por espaço)
+NOME_NORMALIZADO_SQL = r"REGEXP_REPLACE(REGEXP_REPLACE(NORMALIZE(LOWER({coluna}), NFD), r'\pM', ''), r'[^a-z0-9]+', ' ')"
+
+# Consulta recusada porque o orçamento de bytes do ciclo acabou (só volta a valer no próximo ciclo)
+class OrcamentoBigQueryEsgotado(RuntimeError):
+    pass
+
+# Orçamento de bytes do BigQuery: cada consulta reserva os bytes estimados pelo dry run e é
+# recusada se passar do limite por consulta ou do que resta no ciclo (0 = sem limite); quando ela
+# termina, a reserva é trocada pelos bytes faturados
+# Em tabelas clusterizadas o dry run não considera a poda dos blocos: a consulta não reserva nada
+# antes e só é recusada se o ciclo já tiver esgotado o orçamento
+class OrcamentoBigQuery:
+    def __init__(self, limite_consulta=BIGQUERY_MAX_BYTES_CONSULTA, limite_ciclo=BIGQUERY_ORCAMENTO_BYTES):
+        self.limite_consulta = limite_consulta
+        self.limite_ciclo = limite_ciclo
+        self.usados = 0
+        self.recusadas = 0
+        self._lock = threading.Lock()
+    
+    # Retorna os bytes reservados, a serem acertados com ajustar() quando a consulta terminar
+    def reservar(self, estimados, clusterizada=False):
+        with self._lock:
+            if clusterizada:
+                if self.limite_ciclo and self.usados >= self.limite_ciclo:
+                    self.recusadas += 1
+                    raise OrcamentoBigQueryEsgotado(
+                        f"Orçamento do ciclo esgotado ({self.usados} de {self.limite_ciclo} bytes já usados)"
+                    )
+                return 0
+            if self.limite_consulta and estimados > self.limite_consulta:
+                self.recusadas += 1
+                raise RuntimeError(
+                    f"Consulta estimada em {estimados} bytes passa do limite de {self.limite_consulta} bytes por consulta"
                 )
-                enviar_para_slack(mensagem, thread_ts)
+            if self.limite_ciclo and self.usados + estimados > self.limite_ciclo:
+                self.recusadas += 1
+                raise OrcamentoBigQueryEsgotado(
+                    f"Consulta estimada em {estimados} bytes passa do orçamento do ciclo "
+                    f"({self.usados} de {self.limite_ciclo} bytes já usados)"
+                )
+            self.usados += estimados
+            return estimados
+    
+    # Troca a reserva de uma consulta pelos bytes faturados (0 se ela falhou)
+    def ajustar(self, reservados, faturados):
+        with self._lock:
+            self.usados += faturados - reservados
+    
+    def reiniciar(self):
+        with self._lock:
+            self.usados = 0
+            self.recusadas = 0
+    
+    def resumo(self):
+        limite = f" de {self.limite_ciclo}" if self.limite_ciclo else ""
+        return f"BigQuery: {self.usados}{limite} bytes faturados no ciclo, {self.recusadas} consultas recusadas"
+
+orcamento_bigquery = OrcamentoBigQuery()
+
+# Função para executar uma consulta no BigQuery dentro do orçamento: estima os bytes com um dry
+# run (que não é cobrado), recusa a consulta que passar dos limites, limita os bytes cobrados e,
+# quando a consulta termina, acerta o orçamento com os bytes faturados
+# Com clusterizada=True (tabela de tokens), a estimativa não recusa a consulta: o limite por
+# consulta fica a cargo do maximum_bytes_billed
+def consultar_bigquery(client, query, parametros=(), clusterizada=False):
+    estimativa = client.query(query, job_config=bigquery.QueryJobConfig(
+        query_parameters=list(parametros), dry_run=True, use_query_cache=False
+    ))
+    estimados = getattr(estimativa, "total_bytes_processed", None) or 0
+    metricas.contar("bytes_estimados_bigquery", estimados)
+    try:
+        reservados = orcamento_bigquery.reservar(estimados, clusterizada)
+    except RuntimeError:
+        metricas.contar("consultas_recusadas_bigquery")
+        raise
+    
+    job_config = bigquery.QueryJobConfig(query_parameters=list(parametros))
+    if orcamento_bigquery.limite_consulta:
+        job_config.maximum_bytes_billed = orcamento_bigquery.limite_consulta
+    try:
+        query_job = client.query(query, job_config=job_config)
+        query_job.result()
+    except Exception:
+        orcamento_bigquery.ajustar(reservados, 0)
+        raise
+    
+    faturados = getattr(query_job, "total_bytes_billed", None)
+    if faturados is None:
+        faturados = getattr(query_job, "total_bytes_processed", None) or 0
+    orcamento_bigquery.ajustar(reservados, faturados)
+    metricas.contar("bytes_faturados_bigquery", faturados)
+    return query_job
+
+# Função para criar (ou recriar) a tabela de tokens dos merchants: uma linha por palavra do nome
+# normalizado, clusterizada pela palavra, para que a busca seja uma junção por igualdade de
+# palavras e não um STRPOS na tabela inteira. Recrie periodicamente para acompanhar os merchants
+def criar_tabela_tokens(client, projeto_id=BIGQUERY_PROJECT_ID, tabela=BIGQUERY_TABELA_TOKENS):
+    query = f"""
+    CREATE OR REPLACE TABLE `{projeto_id}.{tabela}`
+    CLUSTER BY token AS
+    SELECT DISTINCT token, m.user_id, m.merchant_name, nome_normalizado
+    FROM `{projeto_id}.maindb.merchants` AS m
+    CROSS JOIN UNNEST([TRIM({NOME_NORMALIZADO_SQL.format(coluna="m.merchant_name")})]) AS nome_normalizado
+    CROSS JOIN UNNEST(SPLIT(nome_normalizado, ' ')) AS token
+    WHERE token != ''
+    """
+    print(f"Criando a tabela de tokens {projeto_id}.{tabela}...")
+    list(consultar_bigquery(client, query))
+    print("Tabela de tokens criada.")
+
+# Palavra mais longa do padrão (no empate, a primeira em ordem alfabética), como na consulta da tabela de tokens
+def palavra_mais_longa(padrao):
+    return min(padrao.split(), key=lambda palavra: (-len(palavra), palavra))
+
+# Função para buscar entidades no BigQuery
+# Todas as entidades são resolvidas em uma única consulta parametrizada: os padrões
+# vão como um array (UNNEST) e cada linha volta marcada com o padrão que casou
+# O padrão é a forma canônica da entidade e o merchant_name é normalizado da mesma forma
+# As linhas de cada padrão ficam em cache_padroes: um padrão já consultado não volta ao BigQuery,
+# nem com outro tipo de entidade. Com BIGQUERY_USAR_TOKENS, a consulta é feita na tabela de tokens
+# e só encontra nomes em que a palavra mais longa do padrão aparece inteira
+# Com propagar_erros=True, uma falha na consulta (ou a recusa pelo orçamento) é repassada em vez de devolver []
+@metricas.rastrear("buscar_no_bigquery")
+def buscar_no_bigquery(entidades, propagar_erros=False, score_minimo=SCORE_MINIMO_ALERTA):
+    # Usa o cliente global já autenticado
+    client = bigquery_client
+    modo = "tokens" if BIGQUERY_USAR_TOKENS else "substring"
+    
+    # Agrupar entidades pelo padrão de busca, para consultar cada padrão uma única vez
+    entidades_por_padrao = {}
+    for entidade in entidades:
+        padrao = canonicalizar_entidade(entidade["texto"])
+        if padrao:
+            entidades_por_padrao.setdefault(padrao, []).append(entidade)
+    
+    if not entidades_por_padrao:
+        return []
+    
+    resultados = []
+    
+    # Pontua de uma vez as entidades x merchants de um padrão e guarda só as acima de score_minimo
+    def pontuar(padrao, rows):
+        entidades_padrao = entidades_por_padrao.get(padrao, [])
+        scores = calcular_scores_em_lote(entidades_padrao, [merchant_name for _, merchant_name in rows])
+        for j, (user_id, merchant_name) in enumerate(rows):
+            for i, entidade in enumerate(entidades_padrao):
+                if scores[i][j] > score_minimo:
+                    resultados.append({
+                        "entidade": entidade["texto"],
+                        "tipo": entidade["tipo"],
+                        "user_id": user_id,
+                        "merchant_name": merchant_name,
+                        "score": scores[i][j]
+                    })
+    
+    # Padrões já consultados são pontuados a partir do cache, sem consulta
+    pendentes = []
+    for padrao in entidades_por_padrao:
+        em_cache = cache_padroes.obter(chave_conteudo(BIGQUERY_PROJECT_ID, modo, padrao))
+        if em_cache is None:
+            pendentes.append(padrao)
+            continue
+        rows = [tuple(linha) for linha in em_cache[0]]
+        for inicio in range(0, len(rows), BIGQUERY_LOTE_LINHAS):
+            pontuar(padrao, rows[inicio:inicio + BIGQUERY_LOTE_LINHAS])
+    
+    if not pendentes:
+        metricas.anotar(padroes=len(entidades_por_padrao), em_cache=len(entidades_por_padrao))
+        return resultados
+    
+    if BIGQUERY_USAR_TOKENS:
+        # Cada padrão é procurado pela sua palavra mais longa (em geral a mais seletiva), por
+        # igualdade: o filtro por @tokens deixa o BigQuery ler só os blocos da tabela clusterizada
+        # com essas palavras, e o STRPOS confirma o padrão inteiro só nas linhas encontradas
+        query = f"""
+        WITH padroes AS (
+            SELECT padrao, (
+                SELECT palavra FROM UNNEST(SPLIT(padrao, ' ')) AS palavra ORDER BY LENGTH(palavra) DESC, palavra LIMIT 1
+            ) AS palavra
+            FROM UNNEST(@padroes) AS padrao
+        )
+        SELECT p.padrao, t.user_id, t.merchant_name
+        FROM padroes AS p
+        JOIN `{BIGQUERY_PROJECT_ID}.{BIGQUERY_TABELA_TOKENS}` AS t ON t.token = p.palavra
+        WHERE t.token IN UNNEST(@tokens) AND STRPOS(t.nome_normalizado, p.padrao) > 0
+        """
+        parametros = [
+            bigquery.ArrayQueryParameter("padroes", "STRING", pendentes),
+            bigquery.ArrayQueryParameter("tokens", "STRING", sorted({palavra_mais_longa(padrao) for padrao in pendentes}))
+        ]
+    else:
+        # STRPOS equivale ao LIKE '%...%' sem precisar escapar curingas do padrão
+        query = f"""
+        SELECT padrao, m.user_id, m.merchant_name
+        FROM `{BIGQUERY_PROJECT_ID}.maindb.merchants` AS m
+        CROSS JOIN UNNEST(@padroes) AS padrao
+        WHERE STRPOS({NOME_NORMALIZADO_SQL.format(coluna="m.merchant_name")}, padrao) > 0
+        """
+        parametros = [bigquery.ArrayQueryParameter("padroes", "STRING", pendentes)]
+    
+    try:
+        # Executa a consulta
+        query_job = consultar_bigquery(client, query, parametros, clusterizada=BIGQUERY_USAR_TOKENS)
+        
+        # Agrupa as linhas pelo padrão conforme chegam e pontua cada padrão a cada
+        # BIGQUERY_LOTE_LINHAS linhas, sem guardar o resultado inteiro da consulta
+        # Para o cache, as linhas de cada padrão são guardadas até BIGQUERY_CACHE_MAX_LINHAS
+        linhas = 0
+        linhas_por_padrao = {}
+        linhas_para_cache = {padrao: [] for padrao in pendentes}
+        for row in query_job:
+            linhas += 1
+            linha = (row.user_id, row.merchant_name)
+            rows = linhas_por_padrao.setdefault(row.padrao, [])
+            rows.append(linha)
+            if len(rows) >= BIGQUERY_LOTE_LINHAS:
+                pontuar(row.padrao, rows)
+                del linhas_por_padrao[row.padrao]
+            
+            para_cache = linhas_para_cache.get(row.padrao)
+            if para_cache is not None and len(para_cache) < BIGQUERY_CACHE_MAX_LINHAS:
+                para_cache.append(linha)
+            elif para_cache is not None:
+                linhas_para_cache[row.padrao] = None
+        
+        for padrao, rows in linhas_por_padrao.items():
+            pontuar(padrao, rows)
+        
+        # Padrões sem nenhuma linha também vão para o cache
+        for padrao, para_cache in linhas_para_cache.items():
+            if para_cache is not None:
+                cache_padroes.gravar(chave_conteudo(BIGQUERY_PROJECT_ID, modo, padrao), para_cache)
+        
+        bytes_processados = getattr(query_job, "total_bytes_processed", None) or 0
+        metricas.contar("linhas_lidas", linhas, fonte="bigquery")
+        metricas.contar("bytes_processados_bigquery", bytes_processados)
+        metricas.anotar(
+            padroes=len(entidades_por_padrao), em_cache=len(entidades_por_padrao) - len(pendentes),
+            linhas=linhas, bytes_processados=bytes_processados
+        )
+    except Exception as e:
+        print(f"Erro ao consultar BigQuery para {len(pendentes)} entidades: {e}")
+        metricas.anotar(padroes=len(entidades_por_padrao), erro=str(e))
+        if propagar_erros:
+            raise
+    
+    return resultados
+
+# Função para gerar os trigramas de caracteres de um nome (com espaços nas bordas)
+def gerar_trigramas(texto):
+    texto = f" {' '.join(texto.lower().split())} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+# Snapshot local de (user_id, merchant_name) com índice invertido de trigramas
+# Arquivos no diretório do snapshot:
+#   meta.json        -> watermark da última atualização, hora da última recarga completa e total de linhas
+#   nomes.bin/.idx   -> nomes em UTF-8 concatenados + offsets (uint64)
+#   user_ids.bin/.idx-> user_ids em UTF-8 concatenados + offsets (uint64)
+#   postings.bin     -> listas de linhas (uint32) de cada trigrama
+#   trigramas.json   -> trigrama -> [início, fim] dentro de postings.bin
+# Os arquivos binários são abertos com mmap, então carregar o snapshot não lê a tabela inteira
+class SnapshotMerchants:
+    def __init__(self, diretorio=MERCHANT_SNAPSHOT_DIR):
+        self.diretorio = diretorio
+        self.watermark = None
+        self.recarregado_em = None
+        self.total = 0
+        self._trigramas = {}
+        self._mapas = []
+        self._visoes = []
+        self.carregar()
+    
+    def __len__(self):
+        return self.total
+    
+    def _caminho(self, nome):
+        return os.path.join(self.diretorio, nome)
+    
+    def _mapear(self, nome, formato="B"):
+        caminho = self._caminho(nome)
+        if os.path.getsize(caminho) == 0:
+            return memoryview(b"").cast(formato)
+        with open(caminho, "rb") as f:
+            mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapas.append(mapa)
+        visao = memoryview(mapa).cast(formato)
+        self._visoes.append(visao)
+        return visao
+    
+    def _fechar(self):
+        for visao in self._visoes:
+            visao.release()
+        for mapa in self._mapas:
+            mapa.close()
+        self._visoes = []
+        self._mapas = []
+    
+    def carregar(self):
+        caminho_meta = self._caminho("meta.json")
+        if not os.path.exists(caminho_meta):
+            return
+        
+        self._fechar()
+        with open(caminho_meta, encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(self._caminho("trigramas.json"), encoding="utf-8") as f:
+            self._trigramas = json.load(f)
+        
+        self.watermark = meta.get("watermark")
+        self.recarregado_em = meta.get("recarregado_em")
+        self.total = meta.get("total", 0)
+        self._nomes = self._mapear("nomes.bin")
+        self._offsets_nomes = self._mapear("nomes.idx", "Q")
+        self._user_ids = self._mapear("user_ids.bin")
+        self._offsets_user_ids = self._mapear("user_ids.idx", "Q")
+        self._postings = self._mapear("postings.bin", "I")
+        print(f"Snapshot de merchants carregado: {self.total} linhas (watermark: {self.watermark})")
+    
+    # Retorna (user_id, merchant_name) da linha i do snapshot
+    def linha(self, i):
+        nome = bytes(self._nomes[self._offsets_nomes[i]:self._offsets_nomes[i + 1]]).decode("utf-8")
+        user_id = bytes(self._user_ids[self._offsets_user_ids[i]:self._offsets_user_ids[i + 1]]).decode("utf-8")
+        return user_id, nome
+    
+    def linhas(self):
+        for i in range(self.total):
+            yield self.linha(i)
+    
+    # Retorna as linhas que mais compartilham trigramas com o texto
+    def candidatos(self, texto, limite=50):
+        faixas = [self._trigramas[t] for t in gerar_trigramas(texto) if t in self._trigramas]
+        if not faixas:
+            return []
+        
+        # Percorre dos trigramas mais raros para os mais comuns; trigramas presentes em mais
+        # de 10% das linhas (" da", "ltd"...) só são usados se nenhum outro casou
+        faixas.sort(key=lambda faixa: faixa[1] - faixa[0])
+        limite_frequencia = max(self.total // 10, 1)
+        
+        contagem = Counter()
+        for inicio, fim in faixas:
+            if fim - inicio > limite_frequencia and contagem:
+                continue
+            contagem.update(self._postings[inicio:fim])
+        
+        return [i for i, _ in contagem.most_common(limite)]
+    
+    # Atualiza o snapshot a partir do BigQuery
+    # Cada linha é um par (user_id, merchant_name), e um user_id pode ter vários nomes. Na
+    # atualização incremental, todas as linhas dos user_ids alterados desde o último watermark
+    # são lidas de novo e substituem as do snapshot (nomes trocados ou removidos desses user_ids
+    # saem); a cada MERCHANT_SNAPSHOT_RECARGA_HORAS a tabela é relida inteira, o que também tira
+    # os user_ids apagados dela
+    def atualizar(self, client, projeto_id=BIGQUERY_PROJECT_ID):
+        coluna = MERCHANT_WATERMARK_COLUMN
+        incremental = bool(self.watermark) and time.time() - (self.recarregado_em or 0) < MERCHANT_SNAPSHOT_RECARGA_HORAS * 3600
+        query = f"""
+        SELECT CAST(user_id AS STRING) AS user_id, merchant_name, {coluna} AS watermark
+        FROM `{projeto_id}.maindb.merchants`
+        """
+        parametros = []
+        if incremental:
+            query += f"WHERE user_id IN (SELECT user_id FROM `{projeto_id}.maindb.merchants` WHERE {coluna} > @watermark)"
+            parametros.append(bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", self.watermark))
+        
+        print(f"Atualizando snapshot de merchants a partir de: {self.watermark if incremental else 'início'}...")
+        query_job = consultar_bigquery(client, query, parametros)
+        
+        # Nomes de cada user_id lido, sem repetir o mesmo par
+        nomes_por_user_id = {}
+        maior_watermark = None
+        lidas = 0
+        for row in query_job:
+            nomes_por_user_id.setdefault(row.user_id, {})[row.merchant_name or ""] = None
+            lidas += 1
+            if row.watermark is not None and (maior_watermark is None or row.watermark > maior_watermark):
+                maior_watermark = row.watermark
+        
+        if incremental and not lidas:
+            print("Snapshot de merchants já está atualizado.")
+            return 0
+        
+        linhas = [(user_id, nome) for user_id, nome in self.linhas() if user_id not in nomes_por_user_id] if incremental else []
+        linhas += [(user_id, nome) for user_id, nomes in nomes_por_user_id.items() for nome in nomes]
+        watermark = maior_watermark.isoformat() if maior_watermark is not None else self.watermark
+        self.gravar(linhas, watermark, self.recarregado_em if incremental else time.time())
+        print(
+            f"Snapshot de merchants {'atualizado' if incremental else 'recarregado'}: "
+            f"{lidas} linhas lidas de {len(nomes_por_user_id)} user_ids, {len(linhas)} linhas no total"
+        )
+        return lidas
+    
+    # Grava o snapshot completo e o índice de trigramas no diretório
+    def gravar(self, linhas, watermark=None, recarregado_em=None):
+        os.makedirs(self.diretorio, exist_ok=True)
+        
+        nomes, offsets_nomes = bytearray(), array("Q", [0])
+        user_ids, offsets_user_ids = bytearray(), array("Q", [0])
+        indice = {}
+        for i, (user_id, nome) in enumerate(linhas):
+            nomes += nome.encode("utf-8")
+            offsets_nomes.append(len(nomes))
+            user_ids += str(user_id).encode("utf-8")
+            offsets_user_ids.append(len(user_ids))
+            for trigrama in gerar_trigramas(nome):
+                indice.setdefault(trigrama, []).append(i)
+        
+        postings = array("I")
+        trigramas = {}
+        for trigrama in sorted(indice):
+            inicio = len(postings)
+            postings.extend(indice[trigrama])
+            trigramas[trigrama] = [inicio, len(postings)]
+        
+        # Fecha os mapas atuais antes de substituir os arquivos; meta.json é gravado por último
+        self._fechar()
+        arquivos = {
+            "nomes.bin": bytes(nomes),
+            "nomes.idx": offsets_nomes.tobytes(),
+            "user_ids.bin": bytes(user_ids),
+            "user_ids.idx": offsets_user_ids.tobytes(),
+            "postings.bin": postings.tobytes(),
+            "trigramas.json": json.dumps(trigramas, ensure_ascii=False).encode("utf-8"),
+            "meta.json": json.dumps(
+                {"watermark": watermark, "recarregado_em": recarregado_em, "total": len(offsets_nomes) - 1}
+            ).encode("utf-8"),
+        }
+        for nome, conteudo in arquivos.items():
+            temporario = self._caminho(nome + ".tmp")
+            with open(temporario, "wb") as f:
+                f.write(conteudo)
+            os.replace(temporario, self._caminho(nome))
+        
+        self.carregar()
+
+# Snapshot compartilhado, carregado sob demanda
+_snapshot_merchants = None
+
+def obter_snapshot_merchants():
+    global _snapshot_merchants
+    if _snapshot_merchants is None:
+        _snapshot_merchants = SnapshotMerchants()
+    return _snapshot_merchants
+
+# Função para buscar entidades no índice local de merchants, sem acessar o BigQuery
+# Retorna os top_k candidatos de cada entidade no mesmo formato de buscar_no_bigquery
+# (com top_k=None, todos os candidatos encontrados pelos trigramas, já pontuados)
+@metricas.rastrear("buscar_no_indice_local")
+def buscar_no_indice_local(entidades, snapshot=None, top_k=MATCH_LOCAL_TOP_K):
+    if snapshot is None:
+        snapshot = obter_snapshot_merchants()
+    
+    resultados = []
+    linhas = 0
+    for entidade in entidades:
+        candidatos = snapshot.candidatos(entidade["texto"], limite=(top_k or MATCH_LOCAL_TOP_K) * 10)
+        linhas += len(candidatos)
+        linhas_candidatas = [snapshot.linha(i) for i in candidatos]
+        scores = calcular_scores_em_lote([entidade], [merchant_name for _, merchant_name in linhas_candidatas])[0]
+        
+        for posicao in range(len(scores)) if top_k is None else selecionar_melhores(scores, top_k):
+            user_id, merchant_name = linhas_candidatas[posicao]
+            score = scores[posicao]
+            resultados.append({
+                "entidade": entidade["texto"],
+                "tipo": entidade["tipo"],
+                "user_id": user_id,
+                "merchant_name": merchant_name,
+                "score": score
+            })
+    
+    metricas.contar("linhas_lidas", linhas, fonte="indice_local")
+    metricas.anotar(entidades=len(entidades), linhas=linhas)
+    return resultados
+
+# Função para buscar nomes curtos ("XP", "C6", "Oi") só entre os merchants de nome idêntico
+# Com menos de MIN_SUBSTRING caracteres, a busca por substring (ou por palavra) casaria com boa
+# parte da tabela; aqui só casa o merchant cujo nome normalizado é o próprio nome
+# Uma falha na consulta é repassada, como em buscar_no_bigquery com propagar_erros
+@metricas.rastrear("buscar_nomes_exatos")
+def buscar_nomes_exatos(entidades, snapshot=None, score_minimo=SCORE_MINIMO_ALERTA):
+    entidades_por_nome = {}
+    for entidade in entidades:
+        entidades_por_nome.setdefault(canonicalizar_entidade(entidade["texto"]), []).append(entidade)
+    
+    if snapshot is not None:
+        linhas = [
+            (nome, *snapshot.linha(i)) for nome in entidades_por_nome for i in snapshot.candidatos(nome, limite=None)
+        ]
+        linhas = [(nome, user_id, merchant_name) for nome, user_id, merchant_name in linhas
+                  if canonicalizar_entidade(merchant_name) == nome]
+        metricas.contar("linhas_lidas", len(linhas), fonte="indice_local")
+    else:
+        if BIGQUERY_USAR_TOKENS:
+            # Na tabela de tokens, o nome curto é a única palavra do nome normalizado
+            query = f"""
+            SELECT t.token AS padrao, t.user_id, t.merchant_name
+            FROM `{BIGQUERY_PROJECT_ID}.{BIGQUERY_TABELA_TOKENS}` AS t
+            WHERE t.token IN UNNEST(@nomes) AND t.nome_normalizado = t.token
+            """
+        else:
+            query = f"""
+            SELECT TRIM({NOME_NORMALIZADO_SQL.format(coluna="m.merchant_name")}) AS padrao, m.user_id, m.merchant_name
+            FROM `{BIGQUERY_PROJECT_ID}.maindb.merchants` AS m
+            WHERE TRIM({NOME_NORMALIZADO_SQL.format(coluna="m.merchant_name")}) IN UNNEST(@nomes)
+            """
+        parametros = [bigquery.ArrayQueryParameter("nomes", "STRING", sorted(entidades_por_nome))]
+        query_job = consultar_bigquery(bigquery_client, query, parametros, clusterizada=BIGQUERY_USAR_TOKENS)
+        linhas = [(row.padrao, row.user_id, row.merchant_name) for row in query_job]
+        metricas.contar("linhas_lidas", len(linhas), fonte="bigquery")
+        metricas.contar("bytes_processados_bigquery", getattr(query_job, "total_bytes_processed", None) or 0)
+    
+    resultados = []
+    for nome, user_id, merchant_name in linhas:
+        for entidade in entidades_por_nome.get(nome, []):
+            score = calcular_score_fuzzy(entidade, merchant_name)
+            if score > score_minimo:
+                resultados.append({
+                    "entidade": entidade["texto"],
+                    "tipo": entidade["tipo"],
+                    "user_id": user_id,
+                    "merchant_name": merchant_name,
+                    "score": score
+                })
+    
+    metricas.anotar(nomes=len(entidades_por_nome), linhas=len(linhas))
+    return resultados
+
+# Merchants candidatos das entidades canônicas já buscadas nesta execução
+_correspondencias_memoria = {}
+_correspondencias_lock = threading.Lock()
+
+# Função para buscar as correspondências de um lote de entidades nos merchants
+# As menções são agrupadas pela forma canônica: cada entidade canônica é buscada uma única vez
+# (pela primeira menção) e as linhas (user_id, merchant_name) encontradas viram as candidatas
+# dela. As candidatas ficam em memória durante a execução e em cache_correspondencias entre
+# execuções, então o BigQuery só recebe as entidades ainda não vistas. Cada menção distinta
+# ("TransLog S.A.", "Translog") é pontuada contra as candidatas com o próprio texto e tipo.
+@metricas.rastrear("buscar_correspondencias")
+def buscar_correspondencias(entidades):
+    if USAR_INDICE_LOCAL:
+        snapshot = obter_snapshot_merchants()
+        fonte = f"indice_local:{snapshot.watermark}"
+    else:
+        fonte = f"bigquery:{BIGQUERY_PROJECT_ID}:tokens" if BIGQUERY_USAR_TOKENS else f"bigquery:{BIGQUERY_PROJECT_ID}"
+    
+    # Menções distintas (texto e tipo) de cada entidade canônica; sufixos societários sozinhos
+    # ("ME") não são buscados, e nomes com menos de MIN_SUBSTRING caracteres só casam com nomes idênticos
+    mencoes = {}
+    for entidade in entidades:
+        canonico = canonicalizar_entidade(entidade["texto"])
+        if canonico and canonico not in SUFIXOS_SOCIETARIOS:
+            mencoes.setdefault(canonico, {}).setdefault((entidade["texto"], entidade["tipo"]), entidade)
+    
+    candidatas = {}
+    pendentes = []
+    for canonico in mencoes:
+        chave_cache = chave_conteudo(fonte, "candidatas", canonico)
+        with _correspondencias_lock:
+            memorizado = _correspondencias_memoria.get(chave_cache)
+        if memorizado is None:
+            em_cache = cache_correspondencias.obter(chave_cache)
+            if em_cache:
+                memorizado = em_cache[0]
+                with _correspondencias_lock:
+                    _correspondencias_memoria[chave_cache] = memorizado
+        if memorizado is None:
+            pendentes.append(canonico)
+        else:
+            candidatas[canonico] = memorizado
+    
+    metricas.anotar(mencoes=sum(len(lista) for lista in mencoes.values()), unicas=len(mencoes), pendentes=len(pendentes))
+    metricas.contar("entidades_memorizadas", len(mencoes) - len(pendentes))
+    
+    if pendentes:
+        # Uma menção de cada entidade canônica representa todas na busca, sem corte por score
+        # Uma falha na consulta é repassada: nada é memorizado e a notícia volta para a fila
+        representantes = [next(iter(mencoes[canonico].values())) for canonico in pendentes]
+        curtos = [entidade for canonico, entidade in zip(pendentes, representantes) if len(canonico) < MIN_SUBSTRING]
+        longos = [entidade for canonico, entidade in zip(pendentes, representantes) if len(canonico) >= MIN_SUBSTRING]
+        resultados = []
+        if longos and USAR_INDICE_LOCAL:
+            resultados += buscar_no_indice_local(longos, snapshot, top_k=None)
+        elif longos:
+            resultados += buscar_no_bigquery(longos, propagar_erros=True, score_minimo=float("-inf"))
+        if curtos:
+            resultados += buscar_nomes_exatos(curtos, snapshot if USAR_INDICE_LOCAL else None, score_minimo=float("-inf"))
+        
+        novas = {canonico: {} for canonico in pendentes}
+        for resultado in resultados:
+            novas[canonicalizar_entidade(resultado["entidade"])][(resultado["user_id"], resultado["merchant_name"])] = None
+        # Como em cache_padroes, entidades com mais de BIGQUERY_CACHE_MAX_LINHAS candidatas são buscadas a cada vez
+        for canonico, linhas in novas.items():
+            lista = [list(linha) for linha in linhas]
+            candidatas[canonico] = lista
+            if len(lista) > BIGQUERY_CACHE_MAX_LINHAS:
+                continue
+            chave_cache = chave_conteudo(fonte, "candidatas", canonico)
+            with _correspondencias_lock:
+                _correspondencias_memoria[chave_cache] = lista
+            cache_correspondencias.gravar(chave_cache, lista)
+    
+    # Pontua cada menção contra as candidatas da sua entidade canônica; no índice local, cada
+    # menção fica só com as MATCH_LOCAL_TOP_K melhores, como em buscar_no_indice_local
+    saida = []
+    for canonico, por_mencao in mencoes.items():
+        linhas = candidatas.get(canonico)
+        if not linhas:
+            continue
+        entidades_canonico = list(por_mencao.values())
+        scores = calcular_scores_em_lote(entidades_canonico, [merchant_name for _, merchant_name in linhas])
+        for entidade, scores_entidade in zip(entidades_canonico, scores):
+            posicoes = selecionar_melhores(scores_entidade, MATCH_LOCAL_TOP_K) if USAR_INDICE_LOCAL else range(len(linhas))
+            for posicao in posicoes:
+                if scores_entidade[posicao] > SCORE_MINIMO_ALERTA:
+                    user_id, merchant_name = linhas[posicao]
+                    saida.append({
+                        "entidade": entidade["texto"],
+                        "tipo": entidade["tipo"],
+                        "user_id": user_id,
+                        "merchant_name": merchant_name,
+                        "score": scores_entidade[posicao]
+                    })
+    return saida
+
+# Score base de acordo com o tipo de entidade
+SCORE_BASE_POR_TIPO = {
+    "PER": 0.5,  # Pessoas
+    "ORG": 0.6,  # Organizações
+    "ENT": 0.4   # Entidades genéricas
+}
+
+# Função para calcular score de relevância
+def calcular_score_fuzzy(entidade, merchant_name):
+    entidade_texto = entidade["texto"].lower()
+    merchant_lower = merchant_name.lower()
+    
+    # Score base de acordo com o tipo de entidade
+    base_score = SCORE_BASE_POR_TIPO.get(entidade["tipo"], 0.3)
+    
+    # Calcular similaridade
+    token_similarity = calcular_similaridade(entidade_texto, merchant_lower)
+    substring_similarity = calcular_similaridade_substring(entidade_texto, merchant_lower)
+    
+    # Verificar correspondência exata
+    if entidade_texto == merchant_lower:
+        exact_match = 1.0
+    # Verificar se entidade é uma palavra inteira dentro do merchant name
+    elif re.search(r'\b' + re.escape(entidade_texto) + r'\b', merchant_lower):
+        exact_match = 0.8
     else:
-        mensagem = "Nenhuma correspondência encontrada entre entidades de notícias e dados de merchants."
-        enviar_para_slack(mensagem)
+        exact_match = 0.0
+    
+    # Calcular score final combinando os resultados
+    final_score = (token_similarity * 0.3) + (substring_similarity * 0.3) + (exact_match * 0.4) + (base_score * 0.2)
+    
+    # Limitar a 1.0
+    return min(final_score, 1.0)
+
+# Função para calcular similaridade entre conjuntos de tokens
+def calcular_similaridade(str1, str2):
+    # Converter para minúsculas e dividir em tokens (palavras)
+    tokens1 = set(str1.lower().split())
+    tokens2 = set(str2.lower().split())
+    
+    # Verificar se os conjuntos estão vazios
+    if not tokens1 or not tokens2:
+        return 0.0
+    
+    # Calcular interseção (palavras em comum)
+    intersecao = tokens1.intersection(tokens2)
+    
+    # Calcular coeficiente de similaridade (Jaccard)
+    return len(intersecao) / max(len(tokens1), len(tokens2))
+
+# Comprimento mínimo para considerar uma substring parcial
+MIN_SUBSTRING = 3
+
+# Função para construir o autômato de sufixos de um texto
+# Retorna (transições, links de sufixo, comprimentos); reconhece todas as substrings do texto
+def construir_automato_sufixos(texto):
+    transicoes = [{}]
+    link = [-1]
+    comprimento = [0]
+    ultimo = 0
+    
+    for c in texto:
+        atual = len(comprimento)
+        transicoes.append({})
+        link.append(0)
+        comprimento.append(comprimento[ultimo] + 1)
+        
+        p = ultimo
+        while p != -1 and c not in transicoes[p]:
+            transicoes[p][c] = atual
+            p = link[p]
+        
+        if p != -1:
+            q = transicoes[p][c]
+            if comprimento[p] + 1 == comprimento[q]:
+                link[atual] = q
+            else:
+                # Divide o estado q para manter o autômato mínimo
+                clone = len(comprimento)
+                transicoes.append(dict(transicoes[q]))
+                link.append(link[q])
+                comprimento.append(comprimento[p] + 1)
+                while p != -1 and transicoes[p].get(c) == q:
+                    transicoes[p][c] = clone
+                    p = link[p]
+                link[q] = clone
+                link[atual] = clone
+        
+        ultimo = atual
+    
+    return transicoes, link, comprimento
+
+# Função para calcular o tamanho da maior substring comum em tempo linear,
+# percorrendo o texto sobre o autômato de sufixos da outra string
+def maior_substring_comum(automato, texto):
+    transicoes, link, comprimento = automato
+    estado = 0
+    tamanho = 0
+    maior = 0
+    
+    for c in texto:
+        while estado and c not in transicoes[estado]:
+            estado = link[estado]
+            tamanho = comprimento[estado]
+        
+        if c in transicoes[estado]:
+            estado = transicoes[estado][c]
+            tamanho += 1
+            if tamanho > maior:
+                maior = tamanho
+        else:
+            tamanho = 0
+    
+    return maior
+
+# Função para verificar se uma string está contida em outra
+def calcular_similaridade_substring(str1, str2):
+    return calcular_similaridade_substring_em_lote(str1, [str2])[0]
+
+# Função para calcular a similaridade de substring de uma entidade contra vários nomes
+# O autômato de sufixos da entidade é construído uma única vez para todos os candidatos
+def calcular_similaridade_substring_em_lote(str1, candidatos):
+    automato = None
+    scores = []
+    
+    for str2 in candidatos:
+        # Verificar se uma string é substring da outra
+        if str1 in str2:
+            scores.append(0.7 + (len(str1) / len(str2)) * 0.3)  # Valoriza strings maiores
+            continue
+        elif str2 in str1:
+            scores.append(0.7 + (len(str2) / len(str1)) * 0.3)
+            continue
+        
+        # Verificar substrings parciais: maior substring de str1 que aparece em str2
+        if automato is None:
+            automato = construir_automato_sufixos(str1)
+        tamanho = maior_substring_comum(automato, str2)
+        
+        # Se encontrou uma substring significativa
+        if tamanho > MIN_SUBSTRING:
+            scores.append(0.4 + (tamanho / len(str1)) * 0.3)
+        else:
+            scores.append(0.0)
+    
+    return scores
+
+# Função para calcular calcular_score_fuzzy de várias entidades contra vários merchants
+# Retorna uma lista por entidade com o score de cada merchant, na ordem recebida
+# Com NumPy e lotes grandes usa a versão vetorizada, que dá exatamente os mesmos scores
+def calcular_scores_em_lote(entidades, merchant_names):
+    if (np is None or not SCORE_VETORIZADO or
+            len(entidades) * len(merchant_names) < SCORE_VETORIZADO_MINIMO or
+            not all(entidade["texto"] for entidade in entidades)):
+        return [[calcular_score_fuzzy(entidade, nome) for nome in merchant_names] for entidade in entidades]
+    return _calcular_scores_vetorizado(entidades, merchant_names).tolist()
+
+# Versão vetorizada de calcular_score_fuzzy para a matriz entidades x merchants
+# - palavras e n-gramas de MIN_SUBSTRING + 1 caracteres das entidades formam o vocabulário;
+#   cada merchant vira uma linha esparsa (0/1) nesse vocabulário, e um produto de matrizes
+#   dá as palavras em comum e os n-gramas em comum de todos os pares de uma vez
+# - a maior substring comum só passa de MIN_SUBSTRING se o par tiver um n-grama em comum,
+#   então o autômato de sufixos só roda nesses pares (e quando uma não contém a outra)
+# - a expressão regular de palavra inteira só roda nos merchants que contêm a entidade
+def _calcular_scores_vetorizado(entidades, merchant_names):
+    textos = [entidade["texto"].lower() for entidade in entidades]
+    nomes = [nome.lower() for nome in merchant_names]
+    tamanho_grama = MIN_SUBSTRING + 1
+    
+    tokens_entidades = [set(texto.lower().split()) for texto in textos]
+    gramas_entidades = [{texto[i:i + tamanho_grama] for i in range(len(texto) - tamanho_grama + 1)} for texto in textos]
+    vocabulario_tokens = {token: i for i, token in enumerate(set().union(*tokens_entidades))}
+    vocabulario_gramas = {grama: i for i, grama in enumerate(set().union(*gramas_entidades))}
+    
+    def matriz_entidades(conjuntos, vocabulario):
+        matriz = np.zeros((len(conjuntos), len(vocabulario)), dtype=np.float32)
+        for i, conjunto in enumerate(conjuntos):
+            matriz[i, [vocabulario[item] for item in conjunto]] = 1
+        return matriz
+    
+    # Linhas esparsas dos merchants, guardadas só nas colunas do vocabulário das entidades
+    linhas_tokens, colunas_tokens, linhas_gramas, colunas_gramas = [], [], [], []
+    quantidade_tokens = np.empty(len(nomes))
+    for j, nome in enumerate(nomes):
+        tokens = set(nome.lower().split())
+        quantidade_tokens[j] = len(tokens)
+        for token in tokens:
+            coluna = vocabulario_tokens.get(token)
+            if coluna is not None:
+                linhas_tokens.append(j)
+                colunas_tokens.append(coluna)
+        if vocabulario_gramas:
+            for coluna in {vocabulario_gramas.get(nome[i:i + tamanho_grama]) for i in range(len(nome) - tamanho_grama + 1)}:
+                if coluna is not None:
+                    linhas_gramas.append(j)
+                    colunas_gramas.append(coluna)
+    
+    merchants_tokens = np.zeros((len(nomes), len(vocabulario_tokens)), dtype=np.float32)
+    merchants_tokens[linhas_tokens, colunas_tokens] = 1
+    merchants_gramas = np.zeros((len(nomes), len(vocabulario_gramas)), dtype=np.float32)
+    merchants_gramas[linhas_gramas, colunas_gramas] = 1
+    
+    # Similaridade de palavras: |A ∩ B| / max(|A|, |B|) para a matriz inteira
+    em_comum = (merchants_tokens @ matriz_entidades(tokens_entidades, vocabulario_tokens).T).astype(np.float64)
+    quantidade_entidades = np.array([len(tokens) for tokens in tokens_entidades], dtype=np.float64)
+    maior = np.maximum(quantidade_tokens[:, None], quantidade_entidades[None, :])
+    vazio = (quantidade_tokens[:, None] == 0) | (quantidade_entidades[None, :] == 0)
+    similaridade_tokens = np.divide(em_comum, maior, out=np.zeros_like(em_comum), where=~vazio)
+    
+    gramas_em_comum = merchants_gramas @ matriz_entidades(gramas_entidades, vocabulario_gramas).T
+    
+    nomes_array = np.array(nomes, dtype=str)
+    comprimentos = np.array([len(nome) for nome in nomes], dtype=np.float64)
+    similaridade_substring = np.zeros((len(nomes), len(textos)))
+    correspondencia_exata = np.zeros((len(nomes), len(textos)))
+    
+    for k, texto in enumerate(textos):
+        # A entidade contida no merchant, ou o merchant contido na entidade
+        contem = np.char.find(nomes_array, texto) >= 0
+        contido = ~contem & (np.char.find(texto, nomes_array) >= 0)
+        coluna = similaridade_substring[:, k]
+        coluna[contem] = 0.7 + (len(texto) / comprimentos[contem]) * 0.3
+        coluna[contido] = 0.7 + (comprimentos[contido] / len(texto)) * 0.3
+        
+        # Maior substring comum, só nos pares com algum n-grama em comum
+        parciais = np.flatnonzero(~contem & ~contido & (gramas_em_comum[:, k] > 0))
+        if len(parciais):
+            automato = construir_automato_sufixos(texto)
+            for j in parciais:
+                tamanho = maior_substring_comum(automato, nomes[j])
+                if tamanho > MIN_SUBSTRING:
+                    coluna[j] = 0.4 + (tamanho / len(texto)) * 0.3
+        
+        # Correspondência exata (1.0) ou como palavra inteira (0.8)
+        iguais = nomes_array == texto
+        correspondencia_exata[iguais, k] = 1.0
+        padrao_palavra = re.compile(r'\b' + re.escape(texto) + r'\b')
+        for j in np.flatnonzero(contem & ~iguais):
+            if padrao_palavra.search(nomes[j]):
+                correspondencia_exata[j, k] = 0.8
+    
+    base = np.array([SCORE_BASE_POR_TIPO.get(entidade["tipo"], 0.3) for entidade in entidades])
+    scores = (similaridade_tokens * 0.3) + (similaridade_substring * 0.3) + (correspondencia_exata * 0.4) + (base[None, :] * 0.2)
+    return np.minimum(scores, 1.0).T
 
+# Função para escolher os top_k maiores scores, na mesma ordem de heapq.nlargest
+# (score decrescente e, no empate, a posição original); com NumPy usa seleção parcial
+def selecionar_melhores(scores, top_k):
+    if np is None or len(scores) <= top_k:
+        return heapq.nlargest(top_k, range(len(scores)), key=scores.__getitem__)
+    
+    valores = np.asarray(scores, dtype=np.float64)
+    limite = np.partition(valores, len(valores) - top_k)[len(valores) - top_k]
+    maiores = np.flatnonzero(valores > limite)
+    empatados = np.flatnonzero(valores == limite)[:top_k - len(maiores)]
+    escolhidos = np.concatenate([maiores, empatados])
+    return escolhidos[np.lexsort((escolhidos, -valores[escolhidos]))].tolist()
+
+# Cliente do Slack compartilhado por toda a execução
+_cliente_slack = None
+_cliente_slack_lock = threading.Lock()
+
+def obter_cliente_slack():
+    global _cliente_slack
+    with _cliente_slack_lock:
+        if _cliente_slack is None:
+            _cliente_slack = WebClient(token=SLACK_TOKEN)
+        return _cliente_slack
+
+# Função para enviar mensagem para o Slack
+# Em caso de limite de taxa (429), espera o Retry-After informado pelo Slack e tenta de novo
+@metricas.rastrear("enviar_para_slack")
+def enviar_para_slack(mensagem, thread_ts=None):
+    metricas.anotar(caracteres=len(mensagem))
+    for tentativa in range(SLACK_MAX_TENTATIVAS):
+        try:
+            response = obter_cliente_slack().chat_postMessage(
+                channel=CHANNEL_ID,
+                text=mensagem,
+                thread_ts=thread_ts
+            )
+            metricas.contar("mensagens_slack")
+            return response
+        except slack_errors.SlackApiError as e:
+            if e.response.status_code == 429 and tentativa < SLACK_MAX_TENTATIVAS - 1:
+                espera = int(e.response.headers.get("Retry-After", 1))
+                print(f"Limite de taxa do Slack atingido, nova tentativa em {espera}s")
+                metricas.contar("novas_tentativas", servico="slack", motivo="429")
+                time.sleep(espera)
+                continue
+            print(f"Erro ao enviar mensagem para o Slack: {e}")
+            metricas.anotar(erro=str(e))
+            return None
+        except Exception as e:
+            print(f"Erro ao enviar mensagem para o Slack: {e}")
+            metricas.anotar(erro=str(e))
+            return None
+
+# Caixa de saída do Slack: envia as mensagens em segundo plano, em ordem, por uma única thread
+# As linhas de uma mesma thread do Slack (links de uma palavra-chave, alertas) são agrupadas
+# em mensagens-resumo paginadas, enviadas ao atingir SLACK_RESUMO_MAX_LINHAS ou
+# SLACK_RESUMO_MAX_CARACTERES, ou quando a linha mais antiga espera há SLACK_RESUMO_INTERVALO
+class CaixaSaidaSlack:
+    def __init__(self, max_linhas=SLACK_RESUMO_MAX_LINHAS, max_caracteres=SLACK_RESUMO_MAX_CARACTERES,
+                 intervalo=SLACK_RESUMO_INTERVALO):
+        self.max_linhas = max_linhas
+        self.max_caracteres = max_caracteres
+        self.intervalo = intervalo
+        self.mensagens_enviadas = 0
+        self._fila = queue.Queue()
+        self._threads_ts = {}
+        self._pendentes = {}
+        self._trabalhador = threading.Thread(target=self._executar, name="slack", daemon=True)
+        self._trabalhador.start()
+    
+    # Envia a mensagem principal de uma thread; as linhas adicionadas com a mesma chave vão nela
+    def abrir_thread(self, chave, mensagem):
+        self._fila.put(("abrir", chave, mensagem, None))
+    
+    # ao_enviar(ok) é chamada na thread de envio depois que a mensagem com a linha foi postada
+    # (ok=True) ou falhou (ok=False)
+    def adicionar(self, chave, linha, separador="\n", ao_enviar=None):
+        self._fila.put(("adicionar", chave, linha, (separador, ao_enviar)))
+    
+    def enviar(self, mensagem):
+        self._fila.put(("enviar", None, mensagem, None))
+    
+    # Aguarda o envio de tudo que já foi colocado na caixa, incluindo os resumos pendentes
+    def descarregar(self):
+        concluido = threading.Event()
+        self._fila.put(("descarregar", None, None, concluido))
+        concluido.wait()
+    
+    # Envia os resumos pendentes e encerra a thread de envio (a caixa não é mais usada depois)
+    def fechar(self):
+        self._fila.put(("fechar", None, None, None))
+        self._trabalhador.join()
+    
+    def _postar(self, mensagem, thread_ts=None):
+        response = enviar_para_slack(mensagem, thread_ts)
+        self.mensagens_enviadas += 1
+        return response
+    
+    def _enviar_resumo(self, chave):
+        pendente = self._pendentes.pop(chave, None)
+        if pendente and pendente["linhas"]:
+            response = self._postar(pendente["separador"].join(pendente["linhas"]), self._threads_ts.get(chave))
+            for ao_enviar in pendente["confirmacoes"]:
+                try:
+                    ao_enviar(response is not None)
+                except Exception as e:
+                    print(f"Erro ao confirmar o envio de uma mensagem do Slack: {e}")
+    
+    def _executar(self):
+        while True:
+            try:
+                operacao, chave, conteudo, extra = self._fila.get(timeout=0.2)
+            except queue.Empty:
+                operacao = None
+            
+            if operacao == "abrir":
+                response = self._postar(conteudo)
+                self._threads_ts[chave] = response.data.get('ts') if response else None
+            elif operacao == "enviar":
+                self._postar(conteudo)
+            elif operacao == "adicionar":
+                separador, ao_enviar = extra
+                novo = lambda: {"linhas": [], "caracteres": 0, "desde": time.monotonic(), "separador": separador, "confirmacoes": []}
+                pendente = self._pendentes.setdefault(chave, novo())
+                if pendente["linhas"] and pendente["caracteres"] + len(conteudo) > self.max_caracteres:
+                    self._enviar_resumo(chave)
+                    pendente = self._pendentes.setdefault(chave, novo())
+                pendente["linhas"].append(conteudo)
+                pendente["caracteres"] += len(conteudo) + len(separador)
+                if ao_enviar is not None:
+                    pendente["confirmacoes"].append(ao_enviar)
+                if len(pendente["linhas"]) >= self.max_linhas:
+                    self._enviar_resumo(chave)
+            elif operacao == "descarregar":
+                for chave_pendente in list(self._pendentes):
+                    self._enviar_resumo(chave_pendente)
+                extra.set()
+            elif operacao == "fechar":
+                for chave_pendente in list(self._pendentes):
+                    self._enviar_resumo(chave_pendente)
+                return
+            
+            # Envia os resumos que estão esperando há mais tempo que o intervalo
+            agora = time.monotonic()
+            for chave_pendente, pendente in list(self._pendentes.items()):
+                if agora - pendente["desde"] >= self.intervalo:
+                    self._enviar_resumo(chave_pendente)
+
+# Função para definir o nível de alerta com base no score
+def nivel_alerta(score):
+    if score > 0.8:
+        return "🔴 ALTO"
+    elif score > 0.6:
+        return "🟠 MÉDIO"
+    return "🟡 BAIXO"
+
+# Função para montar a mensagem de alerta de uma correspondência
+def formatar_alerta(resultado):
+    score_percentual = int(resultado['score'] * 100)
+    return (
+        f"*Entidade:* {resultado['entidade']} ({resultado['tipo']})\n"
+        f"*User ID:* {resultado['user_id']}\n"
+        f"*Merchant Name:* {resultado['merchant_name']}\n"
+        f"*Score:* {score_percentual}% ({nivel_alerta(resultado['score'])})"
+    )
+
+# Melhor correspondência de um user_id no placar (com __slots__, sem um dict por instância)
+class CorrespondenciaPlacar:
+    __slots__ = ("entidade", "tipo", "user_id", "merchant_name", "score", "ordem")
+    
+    def __init__(self, resultado, ordem):
+        self.entidade = sys.intern(resultado["entidade"])
+        self.tipo = sys.intern(resultado["tipo"])
+        self.user_id = resultado["user_id"]
+        self.merchant_name = resultado["merchant_name"]
+        self.score = resultado["score"]
+        self.ordem = ordem
+    
+    def como_dict(self):
+        return {
+            "entidade": self.entidade,
+            "tipo": self.tipo,
+            "user_id": self.user_id,
+            "merchant_name": self.merchant_name,
+            "score": self.score
+        }
+
+# Placar da execução: as correspondências chegam uma a uma e só a melhor de cada user_id acima de
+# score_minimo é guardada; um heap com as top_n maiores alimenta o ranking final. A memória depende
+# dos user_ids relevantes, não da quantidade de correspondências recebidas
+class PlacarCorrespondencias:
+    def __init__(self, score_minimo=SCORE_MINIMO_ALERTA, top_n=ALERTAS_RANKING_TOP_N):
+        self.score_minimo = score_minimo
+        self.top_n = top_n
+        self.melhores = {}
+        self.recebidas = 0
+        self.descartadas = 0
+        self._ranking = []
+        self._ordem = itertools.count()
+    
+    # Registra uma correspondência; devolve a nova melhor do user_id, ou None se ela foi descartada
+    # No empate com a melhor anterior, fica a primeira registrada
+    def adicionar(self, resultado):
+        self.recebidas += 1
+        anterior = self.melhores.get(resultado["user_id"])
+        if resultado["score"] <= self.score_minimo or (anterior is not None and resultado["score"] <= anterior.score):
+            self.descartadas += 1
+            return None
+        
+        melhor = CorrespondenciaPlacar(resultado, next(self._ordem))
+        self.melhores[melhor.user_id] = melhor
+        if self.top_n > 0:
+            heapq.heappush(self._ranking, (melhor.score, -melhor.ordem, melhor))
+            # Entradas de user_ids que melhoraram de score ficam velhas no heap; quando ele passa
+            # do dobro de top_n, fica só com as top_n maiores entradas ainda vigentes
+            if len(self._ranking) > 2 * self.top_n:
+                self._ranking = heapq.nlargest(self.top_n, self._vigentes())
+                heapq.heapify(self._ranking)
+        return melhor
+    
+    def _vigentes(self):
+        return (entrada for entrada in self._ranking if self.melhores.get(entrada[2].user_id) is entrada[2])
+    
+    # Maiores correspondências da execução, da maior para a menor (no empate, a primeira registrada)
+    def ranking(self):
+        return [entrada[2].como_dict() for entrada in heapq.nlargest(self.top_n, self._vigentes())]
+    
+    def resumo(self):
+        return (
+            f"Placar: {len(self.melhores)} user_ids com score acima de {self.score_minimo}; "
+            f"{self.descartadas} de {self.recebidas} correspondências descartadas"
+        )
+
+# Marcador de fim de fila entre as etapas do pipeline
+FIM_DA_FILA = object()
+
+# Função para iniciar uma etapa do pipeline
+# Cada worker consome itens da fila de entrada, aplica a função (que devolve um iterável
+# de itens) e publica na fila de saída, se houver uma. As filas em memória não têm limite:
+# o controle de ritmo entre a busca e as etapas seguintes fica na fila em disco (veja
+# PIPELINE_MAX_PENDENTES em executar_pipeline).
+# Quando o último worker termina, o fim da fila é repassado para a próxima etapa.
+def iniciar_etapa(nome, funcao, entrada, saida, workers=1):
+    restantes = [workers]
+    lock = threading.Lock()
+    
+    def trabalhador():
+        while True:
+            item = entrada.get()
+            if item is FIM_DA_FILA:
+                # Devolve o marcador para os outros workers da mesma etapa
+                entrada.put(FIM_DA_FILA)
+                break
+            try:
+                for produzido in funcao(item) or ():
+                    if saida is not None:
+                        saida.put(produzido)
+            except Exception as e:
+                print(f"Erro na etapa '{nome}': {e}")
+        
+        with lock:
+            restantes[0] -= 1
+            ultimo = restantes[0] == 0
+        if ultimo and saida is not None:
+            saida.put(FIM_DA_FILA)
+    
+    threads = [
+        threading.Thread(target=trabalhador, name=f"{nome}-{i}", daemon=True)
+        for i in range(max(workers, 1))
+    ]
+    for thread in threads:
+        thread.start()
+    return threads
+
+# Etapas de trabalho sobre a fila em disco: download -> extração -> correspondência
+# Cada thread reserva notícias da sua etapa em fila_trabalhos, processa e grava o resultado
+# (checkpoint) antes de pegar a próxima. Uma etapa termina quando a busca da execução acabou
+# e não há mais notícias nela nem nas etapas anteriores, ou quando o orçamento do BigQuery do
+# ciclo acaba (as notícias que faltam ficam para a execução ser retomada)
+def iniciar_etapas_da_fila(execucao):
+    prefixo = f"{socket.gethostname()}-{os.getpid()}"
+    
+    def iniciar(nome, etapa, anteriores, funcao, workers, **reserva):
+        def trabalhador():
+            dono = f"{prefixo}-{threading.current_thread().name}"
+            while True:
+                trabalhos = fila_trabalhos.reservar(execucao, etapa, dono, **reserva)
+                if not trabalhos:
+                    if fila_trabalhos.busca_concluida(execucao) and not fila_trabalhos.em_aberto(execucao, anteriores + (etapa,)):
+                        break
+                    time.sleep(FILA_INTERVALO_CONSULTA)
+                    continue
+                try:
+                    funcao(trabalhos, dono)
+                except OrcamentoBigQueryEsgotado as e:
+                    # As notícias ficam na etapa em que estão; a execução é retomada no próximo ciclo
+                    print(f"Etapa '{nome}' interrompida: {e}")
+                    for trabalho in trabalhos:
+                        fila_trabalhos.liberar(trabalho["id"], dono)
+                    break
+                except Exception as e:
+                    print(f"Erro na etapa '{nome}': {e}")
+                    for trabalho in trabalhos:
+                        fila_trabalhos.registrar_falha(trabalho["id"], dono, str(e))
+        
+        threads = [
+            threading.Thread(target=trabalhador, name=f"{nome}-{i}", daemon=True)
+            for i in range(max(workers, 1))
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+    
+    # Baixar o conteúdo da notícia
+    def etapa_download(trabalhos, dono):
+        for trabalho in trabalhos:
+            fila_trabalhos.avancar(trabalho["id"], dono, "baixada", dados=obter_conteudo_da_pagina(trabalho["url"]))
+    
+    # Extrair as entidades com o GPT
+    # Com OPENAI_AGRUPAR, cada trabalhador reserva até OPENAI_GRUPO_MAX_NOTICIAS notícias, e as
+    # curtas vão juntas em um único prompt
+    # Cópias da mesma matéria (republicada por outros portais) são extraídas uma vez só
+    # Uma falha na extração sobe para registrar_falha (a notícia volta para a fila); o conteúdo
+    # só entra no registro depois que a extração deu certo, e a URL, depois que a notícia foi
+    # descartada ou comparada com os merchants
+    def etapa_extracao(trabalhos, dono):
+        novas = []
+        for trabalho in trabalhos:
+            dados = trabalho["dados"]
+            if dados["conteudo"]:
+                original = registro_noticias.conteudo_parecido(dados["conteudo"])
+                # Ao retomar, a própria notícia pode já estar registrada
+                if original and canonicalizar_url(original) != canonicalizar_url(dados["url"]):
+                    print(f"Notícia quase idêntica a {original}, pulando: {dados['url']}")
+                    metricas.contar("noticias_puladas", motivo="quase_duplicata")
+                    registro_noticias.marcar_processada(dados["url"])
+                    fila_trabalhos.avancar(trabalho["id"], dono, "descartada")
+                    continue
+            novas.append(trabalho)
+        
+        if not novas:
+            return
+        
+        for trabalho, entidades in zip(novas, extrair_entidades_das_noticias([trabalho["dados"] for trabalho in novas])):
+            dados = trabalho["dados"]
+            if dados["conteudo"]:
+                registro_noticias.registrar_conteudo(dados["conteudo"], dados["url"])
+            
+            if entidades:
+                print(f"Entidades extraídas de '{dados['url']}': {entidades}")
+                fila_trabalhos.avancar(trabalho["id"], dono, "extraida", entidades=entidades)
+            else:
+                print(f"Nenhuma entidade encontrada em: {dados['url']}")
+                if dados["conteudo"]:
+                    registro_noticias.marcar_processada(dados["url"])
+                fila_trabalhos.avancar(trabalho["id"], dono, "descartada")
+    
+    # Buscar as entidades nos merchants
+    # As notícias reservadas juntas (até PIPELINE_LOTE_ENTIDADES entidades) vão em uma única
+    # consulta, e cada notícia recebe as correspondências das suas entidades
+    # Uma falha na consulta sobe para registrar_falha, e as notícias do lote voltam para a fila
+    def etapa_correspondencia(trabalhos, dono):
+        resultados = buscar_correspondencias([entidade for trabalho in trabalhos for entidade in trabalho["entidades"]])
+        por_mencao = {}
+        for resultado in resultados:
+            por_mencao.setdefault((resultado["entidade"], resultado["tipo"]), []).append(resultado)
+        
+        for trabalho in trabalhos:
+            mencoes = dict.fromkeys((entidade["texto"], entidade["tipo"]) for entidade in trabalho["entidades"])
+            if fila_trabalhos.gravar_resultados(
+                execucao, trabalho["id"], dono, [resultado for mencao in mencoes for resultado in por_mencao.get(mencao, [])]
+            ):
+                registro_noticias.marcar_processada(trabalho["url"])
+    
+    threads = []
+    threads += iniciar("download", "pendente", (), etapa_download, PIPELINE_WORKERS_DOWNLOAD)
+    threads += iniciar(
+        "extracao", "baixada", ("pendente",), etapa_extracao, PIPELINE_WORKERS_EXTRACAO,
+        limite=OPENAI_GRUPO_MAX_NOTICIAS if OPENAI_AGRUPAR else 1
+    )
+    threads += iniciar(
+        "correspondencia", "extraida", ("pendente", "baixada"), etapa_correspondencia, PIPELINE_WORKERS_CORRESPONDENCIA,
+        limite=PIPELINE_LOTE_ENTIDADES, max_entidades=PIPELINE_LOTE_ENTIDADES
+    )
+    return threads
+
+# Função chamada no início de cada processo trabalhador, antes das etapas (ex.: o benchmark
+# instala nela os dublês de OpenAI e BigQuery, que não passam para um processo novo)
+inicializar_processo = None
+
+# Processo trabalhador: autentica sem interação e roda as etapas da fila até a execução acabar
+# Os limites de taxa da conta da OpenAI e os de download (workers e conexões por site) são
+# divididos entre os `processos` trabalhadores; cada processo fica com pelo menos um
+# As métricas do processo vão para o JSONL; o textfile do Prometheus fica com o coordenador
+def executar_trabalhador(execucao, processos=1, inicializar=None):
+    if inicializar is not None:
+        inicializar()
+    
+    global bigquery_client, limitador_openai, orcamento_bigquery, HTTP_MAX_POR_HOST, PIPELINE_WORKERS_DOWNLOAD
+    limitador_openai = LimitadorTaxa(max(OPENAI_RPM // processos, 1), max(OPENAI_TPM // processos, 1))
+    HTTP_MAX_POR_HOST = max(HTTP_MAX_POR_HOST // processos, 1)
+    PIPELINE_WORKERS_DOWNLOAD = max(PIPELINE_WORKERS_DOWNLOAD // processos, 1)
+    if orcamento_bigquery.limite_ciclo:
+        orcamento_bigquery = OrcamentoBigQuery(orcamento_bigquery.limite_consulta, max(orcamento_bigquery.limite_ciclo // processos, 1))
+    if not USAR_INDICE_LOCAL:
+        bigquery_client = autenticar_bigquery(interativo=False)
+    
+    for thread in iniciar_etapas_da_fila(execucao):
+        thread.join()
+    
+    metricas.arquivo_prometheus = None
+    metricas.exportar()
+
+# Pipeline da execução: busca -> download -> extração -> correspondência -> alerta
+# A busca e o alerta rodam neste processo; as notícias encontradas vão para fila_trabalhos, de
+# onde as etapas intermediárias (em threads ou em FILA_PROCESSOS processos) as levam adiante.
+# Cada correspondência com score significativo vai para o Slack assim que é gravada na fila.
+# Se a execução for interrompida, a próxima retoma a mesma execução: as palavras-chave e feeds
+# já buscados não são buscados de novo, cada notícia continua da etapa em que parou e os
+# user_ids já alertados não são alertados de novo (só atualizados, se o score aumentar)
+@metricas.rastrear("executar_pipeline")
+def executar_pipeline(palavras_chave, fontes_rss=(), nova_execucao=False):
+    inicio = time.monotonic()
+    execucao, retomada = fila_trabalhos.iniciar_execucao(nova_execucao)
+    if retomada:
+        print(f"Retomando a execução {execucao}. {fila_trabalhos.resumo(execucao)}")
+    
+    fila_fontes = queue.Queue()
+    links_vistos = set()
+    links_lock = threading.Lock()
+    caixa_slack = CaixaSaidaSlack()
+    trabalhadores_parados = threading.Event()
+    
+    # O mesmo link encontrado por outra palavra-chave ou feed só é processado uma vez, e links
+    # já processados em execuções anteriores não são baixados de novo
+    # Com PIPELINE_MAX_PENDENTES notícias ainda por baixar ou extrair, a busca espera as etapas
+    # seguintes (backpressure); se os trabalhadores pararam, o link entra na fila para a retomada
+    def adicionar_link(link):
+        with links_lock:
+            if canonicalizar_url(link) in links_vistos:
+                return
+            links_vistos.add(canonicalizar_url(link))
+        
+        if registro_noticias.ja_processada(link):
+            print(f"Notícia já processada anteriormente: {link}")
+            metricas.contar("noticias_puladas", motivo="ja_processada")
+            return
+        while (
+            PIPELINE_MAX_PENDENTES > 0 and not trabalhadores_parados.is_set()
+            and fila_trabalhos.em_aberto(execucao, ("pendente", "baixada")) >= PIPELINE_MAX_PENDENTES
+        ):
+            time.sleep(FILA_INTERVALO_CONSULTA)
+        fila_trabalhos.adicionar(execucao, link)
+    
+    # Etapa 1: buscar notícias (Google por palavra-chave, ou um feed RSS/Atom filtrado pelas
+    # palavras-chave), enviar a lista de links de cada fonte e colocar as notícias na fila
+    # As buscas rodam em paralelo; o ritmo de chamadas ao Google fica a cargo de limitador_busca
+    def etapa_busca(fonte):
+        tipo, valor = fonte
+        if tipo == "rss":
+            itens = filtrar_itens_do_feed(buscar_feed(valor), palavras_chave)
+            if itens:
+                caixa_slack.abrir_thread(("links", valor), f"Notícias do último dia no feed {valor}:")
+            for i, (item, palavra) in enumerate(itens, 1):
+                caixa_slack.adicionar(("links", valor), f"{i}. {item['link']} ({palavra})")
+                adicionar_link(item["link"])
+        else:
+            print(f"\nBuscando notícias para '{valor}'...")
+            links = buscar_noticias(valor)
+            
+            if not links:
+                print(f"Nenhuma notícia encontrada para '{valor}'")
+            else:
+                caixa_slack.abrir_thread(("links", valor), f"Top notícias do último dia para '{valor}':")
+            
+            for i, link in enumerate(links, 1):
+                caixa_slack.adicionar(("links", valor), f"{i}. {link}")
+                adicionar_link(link)
+        
+        fila_trabalhos.concluir_fonte(execucao, f"{tipo}:{valor}")
+    
+    # Etapa 5: manter o melhor resultado por user_id e alertar novas correspondências
+    # Um user_id já alertado recebe uma atualização na thread de alertas quando chega uma
+    # correspondência de score maior que a alertada
+    # Ao retomar, os resultados já alertados voltam para o placar, sem novo alerta
+    # Retorna (linha, user_id do novo alerta ou None na atualização) para entregar no Slack
+    placar = PlacarCorrespondencias()
+    alertados = dict.fromkeys(fila_trabalhos.usuarios_alertados(execucao))
+    alerta = {"enviados": 0, "atualizados": 0, "primeiro": None, "thread": False}
+    
+    def etapa_alerta(resultado, enviar=True):
+        # Mostra apenas resultados com score significativo, uma vez por user_id (mais as atualizações)
+        melhor = placar.adicionar(resultado)
+        if melhor is None:
+            return
+        ja_alertado = melhor.user_id in alertados
+        atualizacao = ja_alertado and alertados[melhor.user_id] is not None
+        # Sem o score alertado (resultados retomados), só guarda o score, sem nova mensagem
+        if not enviar or (ja_alertado and not atualizacao):
+            if ja_alertado:
+                alertados[melhor.user_id] = melhor.score
+            return
+        alertados[melhor.user_id] = melhor.score
+        
+        if not alerta["thread"]:
+            caixa_slack.abrir_thread("alertas", "*ALERTA: Possíveis correspondências de entidades em notícias recentes*")
+            alerta["thread"] = True
+        
+        if atualizacao:
+            alerta["atualizados"] += 1
+            metricas.contar("alertas_atualizados", tipo=resultado["tipo"])
+            return f"*Score atualizado*\n{formatar_alerta(resultado)}", None
+        
+        alerta["enviados"] += 1
+        metricas.contar("alertas", tipo=resultado["tipo"])
+        if alerta["primeiro"] is None:
+            alerta["primeiro"] = time.monotonic() - inicio
+            print(f"Primeiro alerta encontrado após {alerta['primeiro']:.1f}s")
+        return formatar_alerta(resultado), melhor.user_id
+    
+    # Entrega os alertas de uma notícia comparada. Ela só vira "alertada", e os user_ids só entram
+    # no registro de alertas, depois que o Slack confirmou as mensagens com as linhas dela; se o
+    # processo cair antes disso (ou o envio falhar), a notícia continua "comparada" e é alertada de
+    # novo ao retomar. As confirmações chegam na thread única da caixa de saída, em ordem
+    def entregar_alertas(trabalho_id, resultados):
+        linhas = [linha for linha in (etapa_alerta(resultado) for resultado in resultados) if linha]
+        if not linhas:
+            fila_trabalhos.marcar_alertada(trabalho_id)
+            return
+        
+        restantes = [len(linhas)]
+        def confirmar(ok, user_id):
+            if not ok:
+                return
+            if user_id is not None:
+                fila_trabalhos.registrar_alerta(execucao, user_id)
+            restantes[0] -= 1
+            if not restantes[0]:
+                fila_trabalhos.marcar_alertada(trabalho_id)
+        
+        for linha, user_id in linhas:
+            caixa_slack.adicionar("alertas", linha, separador="\n\n", ao_enviar=lambda ok, user_id=user_id: confirmar(ok, user_id))
+    
+    # Só dos user_ids com alerta confirmado: os demais têm o alerta em uma notícia ainda "comparada",
+    # que é entregue de novo abaixo
+    for resultado in fila_trabalhos.resultados(execucao, etapa="alertada"):
+        if resultado["user_id"] in alertados:
+            etapa_alerta(resultado, enviar=False)
+    
+    # Os feeds vão primeiro: uma leitura de feed cobre todas as palavras-chave
+    fontes = [("rss", feed) for feed in fontes_rss] + [("busca", palavra) for palavra in palavras_chave]
+    for tipo, valor in fontes:
+        if not fila_trabalhos.fonte_concluida(execucao, f"{tipo}:{valor}"):
+            fila_fontes.put((tipo, valor))
+    fila_fontes.put(FIM_DA_FILA)
+    
+    threads_busca = iniciar_etapa("busca", etapa_busca, fila_fontes, None, PIPELINE_WORKERS_BUSCA)
+    if FILA_PROCESSOS > 0:
+        contexto = multiprocessing.get_context("spawn")
+        trabalhadores = [
+            contexto.Process(target=executar_trabalhador, args=(execucao, FILA_PROCESSOS, inicializar_processo), name=f"trabalhador-{i}")
+            for i in range(FILA_PROCESSOS)
+        ]
+        for processo in trabalhadores:
+            processo.start()
+    else:
+        trabalhadores = iniciar_etapas_da_fila(execucao)
+    
+    # Alerta as notícias comparadas até a busca acabar e a fila esvaziar
+    # Se todos os trabalhadores pararem antes disso, a execução fica para ser retomada
+    # Notícias já entregues à caixa de saída continuam "comparadas" até o Slack confirmar
+    entregues = set()
+    concluida = False
+    while True:
+        busca_ativa = any(thread.is_alive() for thread in threads_busca)
+        if not busca_ativa and not fila_trabalhos.busca_concluida(execucao):
+            fila_trabalhos.concluir_busca(execucao)
+        # Consultado antes dos comparados: sem etapas anteriores em aberto, nenhuma notícia vira
+        # "comparada" depois da consulta abaixo
+        em_andamento = fila_trabalhos.em_aberto(execucao, ETAPAS_FILA[:-2])
+        
+        for trabalho_id, resultados in fila_trabalhos.comparados(execucao):
+            if trabalho_id not in entregues:
+                entregues.add(trabalho_id)
+                entregar_alertas(trabalho_id, resultados)
+        
+        if not busca_ativa and not em_andamento:
+            concluida = True
+            break
+        if not any(trabalhador.is_alive() for trabalhador in trabalhadores):
+            trabalhadores_parados.set()
+        if not busca_ativa and trabalhadores_parados.is_set():
+            print(f"Os trabalhadores pararam antes do fim da execução {execucao}; ela será retomada na próxima. "
+                  f"{fila_trabalhos.resumo(execucao)}")
+            break
+        time.sleep(FILA_INTERVALO_CONSULTA)
+    
+    for trabalhador in trabalhadores:
+        trabalhador.join()
+    
+    if not alerta["enviados"] and concluida and not alertados:
+        caixa_slack.enviar("Nenhuma correspondência encontrada entre entidades de notícias e dados de merchants.")
+    caixa_slack.descarregar()
+    caixa_slack.fechar()
+    
+    # Notícias com alertas que o Slack não confirmou ficam para a próxima execução
+    if concluida and fila_trabalhos.em_aberto(execucao, ("comparada",)):
+        print(f"Alguns alertas não foram entregues ao Slack; a execução {execucao} será retomada na próxima.")
+        concluida = False
+    
+    if concluida:
+        fila_trabalhos.concluir_execucao(execucao)
+    print(fila_trabalhos.resumo(execucao))
+    
+    # Ranking das maiores correspondências da execução (uma por user_id)
+    ranking = placar.ranking()
+    print(placar.resumo())
+    for posicao, resultado in enumerate(ranking, 1):
+        print(f"{posicao}. {resultado['entidade']} x {resultado['merchant_name']} (User ID {resultado['user_id']}): {int(resultado['score'] * 100)}%")
+    
+    metricas.anotar(
+        execucao=execucao, retomada=retomada, palavras_chave=len(palavras_chave), fontes_rss=len(fontes_rss),
+        alertas=alerta["enviados"], alertas_atualizados=alerta["atualizados"], primeiro_alerta_s=alerta["primeiro"],
+        correspondencias=placar.recebidas, correspondencias_descartadas=placar.descartadas
+    )
+    print(
+        f"Pipeline concluído em {time.monotonic() - inicio:.1f}s: {alerta['enviados']} alertas "
+        f"({alerta['atualizados']} atualizados) "
+        f"em {caixa_slack.mensagens_enviadas} mensagens do Slack"
+    )
+    return ranking
+
+# Função para executar um ciclo completo: buscar, baixar, extrair, comparar e alertar
+# Usa o cliente BigQuery já autenticado em bigquery_client
+def executar_ciclo(palavras_chave, fontes_rss=(), nova_execucao=False):
+    metricas.novo_ciclo()
+    orcamento_bigquery.reiniciar()
+    caches = (cache_paginas, cache_entidades, cache_correspondencias, cache_padroes, cache_buscas, cache_feeds)
+    contagens = {cache.nome: (cache.acertos, cache.falhas) for cache in caches}
+    
+    # As correspondências em memória valem por ciclo; entre ciclos, vale o cache em disco com TTL
+    with _correspondencias_lock:
+        _correspondencias_memoria.clear()
+    
+    # Atualiza o índice local de merchants a partir do BigQuery, se estiver em uso
+    # Se a atualização falhar (erro do BigQuery ou orçamento recusado), o ciclo segue com o
+    # snapshot já gravado; só não há como seguir sem nenhum snapshot
+    if USAR_INDICE_LOCAL:
+        snapshot = obter_snapshot_merchants()
+        try:
+            snapshot.atualizar(bigquery_client)
+        except Exception as e:
+            metricas.contar("falhas_atualizacao_snapshot")
+            if not snapshot.watermark and not snapshot.total:
+                raise
+            print(f"Erro ao atualizar o snapshot de merchants, usando o de {snapshot.watermark}: {e}")
+    
+    # Buscar, baixar, extrair, comparar e alertar em etapas simultâneas
+    executar_pipeline(palavras_chave, fontes_rss, nova_execucao)
+    
+    # Resumo de uso dos caches
+    for cache in caches:
+        print(cache.resumo())
+    print(registro_noticias.resumo())
+    print(orcamento_bigquery.resumo())
+    
+    # Totais de cache do ciclo e exportação das métricas (JSON lines e Prometheus)
+    for cache in caches:
+        acertos, falhas = contagens[cache.nome]
+        metricas.contar("cache_acertos", cache.acertos - acertos, cache=cache.nome)
+        metricas.contar("cache_falhas", cache.falhas - falhas, cache=cache.nome)
+    metricas.contar("ciclos")
+    metricas.exportar()
+    print(metricas.resumo())
+
+# Função para deixar prontos os clientes reaproveitados entre os ciclos do modo serviço
+def aquecer_clientes():
+    for dependencia in (openai, search, bigquery, WebClient):
+        if isinstance(dependencia, ImportacaoTardia):
+            dependencia.carregar()
+    obter_sessao_http()
+    obter_cliente_slack()
+    if USAR_INDICE_LOCAL:
+        obter_snapshot_merchants()
+
+# Modo serviço: autentica e prepara os clientes uma vez e roda um ciclo a cada `intervalo`
+# segundos, até receber SIGTERM/SIGINT ou completar `ciclos` ciclos (0 = sem limite)
+# Um ciclo que passa do intervalo não acumula atraso: o próximo começa logo em seguida
+# As palavras-chave e os feeds são relidos a cada ciclo, sem precisar reiniciar o serviço
+def executar_servico(intervalo=SERVICO_INTERVALO, ciclos=0):
+    parar = threading.Event()
+    
+    def ao_receber_sinal(sinal, _quadro):
+        print(f"Sinal {signal.Signals(sinal).name} recebido, encerrando após o ciclo atual...")
+        parar.set()
+    
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, ao_receber_sinal)
+        signal.signal(signal.SIGINT, ao_receber_sinal)
+    
+    global bigquery_client
+    bigquery_client = autenticar_bigquery(interativo=False)
+    aquecer_clientes()
+    
+    ciclo = 0
+    proximo = time.monotonic()
+    while not parar.is_set():
+        ciclo += 1
+        inicio = time.monotonic()
+        print(f"\nIniciando ciclo {ciclo}...")
+        try:
+            executar_ciclo(carregar_palavras_chave(), carregar_fontes_rss())
+        except Exception as e:
+            print(f"Erro no ciclo {ciclo}: {e}")
+            metricas.contar("ciclos_com_erro")
+        print(f"Ciclo {ciclo} concluído em {time.monotonic() - inicio:.1f}s")
+        
+        if ciclos and ciclo >= ciclos:
+            break
+        proximo = max(proximo + intervalo, time.monotonic())
+        parar.wait(proximo - time.monotonic())
+    
+    print("Serviço encerrado.")
+
+def main(nova_execucao=False):
+    # Inicializa o cliente BigQuery
+    global bigquery_client
+    bigquery_client = autenticar_bigquery()
+    
+    executar_ciclo(carregar_palavras_chave(), carregar_fontes_rss(), nova_execucao)
+    
     print("Processo concluído.")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Busca notícias, extrai entidades com o GPT e compara com os merchants")
+    parser.add_argument("--servico", action="store_true", help="roda continuamente, com um ciclo a cada --intervalo segundos")
+    parser.add_argument("--intervalo", type=float, default=SERVICO_INTERVALO, help="segundos entre o início de dois ciclos no modo serviço")
+    parser.add_argument("--ciclos", type=int, default=0, help="encerra o modo serviço após este número de ciclos (0 = sem limite)")
+    parser.add_argument("--processos", type=int, default=FILA_PROCESSOS, help="processos trabalhadores da fila (0 = threads neste processo)")
+    parser.add_argument("--criar-tabela-tokens", action="store_true", help=f"cria (ou recria) a tabela {BIGQUERY_TABELA_TOKENS} e encerra")
+    parser.add_argument("--nova-execucao", action="store_true", help="abandona a execução interrompida em vez de retomá-la")
+    args = parser.parse_args()
+    FILA_PROCESSOS = args.processos
+    
+    if args.criar_tabela_tokens:
+        criar_tabela_tokens(autenticar_bigquery())
+    elif args.servico:
+        executar_servico(args.intervalo, args.ciclos)
+    else:
+        main(args.nova_execucao)
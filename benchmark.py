@@ -0,0 +1,1045 @@
+import argparse
+import contextlib
+import datetime
+import functools
+import hashlib
+import heapq
+import io
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from types import SimpleNamespace
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import openai
+
+import app
+
+# Palavras usadas para gerar nomes sintéticos de merchants
+PALAVRAS_NOMES = [
+    "silva", "souza", "santos", "oliveira", "pereira", "lima", "costa", "ferreira",
+    "maria", "joão", "ana", "carlos", "paulo", "fernanda", "lucas", "juliana",
+    "comercio", "mercado", "padaria", "restaurante", "farmácia", "pagamentos",
+    "tech", "digital", "brasil", "serviços", "transportes", "ltda", "me", "eireli"
+]
+
+# Implementação original de calcular_similaridade_substring (cúbica), usada como referência
+def similaridade_substring_referencia(str1, str2):
+    if str1 in str2:
+        return 0.7 + (len(str1) / len(str2)) * 0.3
+    elif str2 in str1:
+        return 0.7 + (len(str2) / len(str1)) * 0.3
+
+    min_length = 3
+    max_substr = ""
+    for i in range(len(str1)):
+        for j in range(i + min_length, len(str1) + 1):
+            substr = str1[i:j]
+            if substr in str2 and len(substr) > len(max_substr):
+                max_substr = substr
+
+    if len(max_substr) > min_length:
+        return 0.4 + (len(max_substr) / len(str1)) * 0.3
+
+    return 0.0
+
+# Extração de conteúdo original (cascata de regex), usada como referência
+def extrair_conteudo_regex_referencia(html):
+    html_limpo = re.sub(r'<script[^>]*>.*?</script>', ' ', html, flags=re.DOTALL)
+    html_limpo = re.sub(r'<style[^>]*>.*?</style>', ' ', html_limpo, flags=re.DOTALL)
+    html_limpo = re.sub(r'<!--.*?-->', ' ', html_limpo, flags=re.DOTALL)
+    html_limpo = re.sub(r'<nav[^>]*>.*?</nav>', ' ', html_limpo, flags=re.DOTALL)
+    html_limpo = re.sub(r'<header[^>]*>.*?</header>', ' ', html_limpo, flags=re.DOTALL)
+    html_limpo = re.sub(r'<footer[^>]*>.*?</footer>', ' ', html_limpo, flags=re.DOTALL)
+    html_limpo = re.sub(r'<aside[^>]*>.*?</aside>', ' ', html_limpo, flags=re.DOTALL)
+    html_limpo = re.sub(r'<iframe[^>]*>.*?</iframe>', ' ', html_limpo, flags=re.DOTALL)
+
+    conteudo = ""
+    padroes_conteudo = [
+        r'<article[^>]*>(.*?)</article>',
+        r'<div[^>]*class="[^"]*(?:content|article|post|news|materia|texto|entry|body|main)[^"]*"[^>]*>(.*?)</div>',
+        r'<div[^>]*id="[^"]*(?:content|article|post|news|materia|texto|entry|body|main)[^"]*"[^>]*>(.*?)</div>',
+        r'<main[^>]*>(.*?)</main>',
+        r'<section[^>]*class="[^"]*(?:content|article|post|news|materia)[^"]*"[^>]*>(.*?)</section>'
+    ]
+    for padrao in padroes_conteudo:
+        for match in re.findall(padrao, html_limpo, re.DOTALL):
+            if len(match) > 500:
+                conteudo = match
+                break
+        if conteudo:
+            break
+
+    if not conteudo or len(conteudo) < 500:
+        paragrafos = re.findall(r'<p[^>]*>(.*?)</p>', html_limpo, re.DOTALL)
+        conteudo = ' '.join([p for p in paragrafos if len(p) > 30])
+
+    conteudo_limpo = re.sub(r'<[^>]+>', ' ', conteudo)
+    conteudo_limpo = re.sub(r'\s+', ' ', conteudo_limpo).strip()
+    for entidade, caractere in (('&nbsp;', ' '), ('&amp;', '&'), ('&lt;', '<'), ('&gt;', '>'), ('&quot;', '"'), ('&#39;', "'")):
+        conteudo_limpo = conteudo_limpo.replace(entidade, caractere)
+
+    if len(conteudo_limpo) < 300:
+        todo_texto = re.sub(r'<[^>]+>', ' ', html_limpo)
+        todo_texto = re.sub(r'\s+', ' ', todo_texto).strip()
+        paragrafos = re.split(r'(?<=[.!?])\s+', todo_texto)
+        conteudo_limpo = ' '.join([p for p in paragrafos if len(p) > 50])
+
+    return conteudo_limpo[:15000]
+
+# Função para gerar uma página de notícia sintética
+# Retorna (html, frases do corpo da notícia, frases de boilerplate) para medir a extração
+def gerar_pagina_noticia(aleatorio, paragrafos=12):
+    def frase(prefixo):
+        nomes = " ".join(aleatorio.choice(PALAVRAS_NOMES).title() for _ in range(2))
+        return f"{prefixo} {aleatorio.randint(0, 10 ** 6)} menciona {nomes} em investigação sobre movimentações financeiras suspeitas."
+
+    corpo = [frase("Corpo") for _ in range(paragrafos)]
+    boilerplate = [frase("Menu") for _ in range(8)]
+    links = "".join(f'<li><a href="/noticia-{i}">{texto}</a></li>' for i, texto in enumerate(boilerplate[:4]))
+    script = "<script>var dados = {" + ", ".join(f'"k{i}": "<div class=\'content\'>{i}</div>"' for i in range(200)) + "};</script>"
+    corpo_html = "".join(f"<p>{texto}</p>" for texto in corpo)
+    relacionadas = f'<div class="related-news"><ul>{links}</ul></div>'
+    leiaumbem = "".join(f"<aside><p>{texto}</p></aside>" for texto in boilerplate[4:6])
+
+    variante = aleatorio.randint(0, 2)
+    if variante == 0:
+        principal = f"<article><h1>Título</h1>{corpo_html}{relacionadas}</article>"
+    elif variante == 1:
+        principal = f'<div class="main-container"><div class="materia-conteudo"><div class="texto">{corpo_html}</div></div>{relacionadas}</div>'
+    else:
+        principal = f'<div id="wrapper"><section>{corpo_html}</section></div><div>{relacionadas}</div>'
+
+    html = (
+        f"<html><head><title>Notícia sintética</title>{script}<style>.a{{color:red}}</style></head><body>"
+        f"<header><nav><ul>{links}</ul></nav></header>{leiaumbem}{principal}"
+        f"<footer><p>{boilerplate[6]}</p><p>{boilerplate[7]}</p></footer></body></html>"
+    )
+    return html, corpo, boilerplate
+
+# Função para medir a qualidade de um texto extraído contra as frases esperadas
+def medir_qualidade(conteudo, corpo, boilerplate):
+    encontradas = sum(1 for texto in corpo if texto in conteudo)
+    vazadas = sum(1 for texto in boilerplate if texto in conteudo)
+    return encontradas / len(corpo), vazadas / len(boilerplate)
+
+# Função para carregar páginas salvas (.html) de um diretório de fixtures
+def carregar_fixtures(diretorio):
+    paginas = []
+    if not diretorio:
+        return paginas
+    for nome in sorted(os.listdir(diretorio)):
+        if nome.endswith((".html", ".htm")):
+            with open(os.path.join(diretorio, nome), encoding="utf-8", errors="replace") as f:
+                paginas.append((nome, f.read()))
+    return paginas
+
+# Função para medir tempo de CPU e pico de memória de uma extração
+def medir_extracao(funcao, html):
+    tracemalloc.start()
+    inicio = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        conteudo = funcao(html)
+    tempo = time.process_time() - inicio
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return conteudo, tempo, pico
+
+# Benchmark da extração de conteúdo: extrator incremental x cascata de regex original
+# Em páginas sintéticas mede a cobertura do corpo da notícia e o boilerplate que vazou;
+# em fixtures reais mede a sobreposição de palavras entre as duas extrações
+def benchmark_extracao_html(paginas_sinteticas, fixtures):
+    extratores = {
+        "incremental": lambda html: app.extrair_conteudo_do_html(html, "http://exemplo/noticia")["conteudo"],
+        "regex_referencia": extrair_conteudo_regex_referencia,
+    }
+    medidas = {nome: {"cpu_s": [], "pico_bytes": [], "cobertura": [], "boilerplate": []} for nome in extratores}
+    sobreposicao = []
+
+    for html, corpo, boilerplate in paginas_sinteticas:
+        for nome, funcao in extratores.items():
+            conteudo, tempo, pico = medir_extracao(funcao, html)
+            cobertura, vazamento = medir_qualidade(conteudo, corpo, boilerplate)
+            medidas[nome]["cpu_s"].append(tempo)
+            medidas[nome]["pico_bytes"].append(pico)
+            medidas[nome]["cobertura"].append(cobertura)
+            medidas[nome]["boilerplate"].append(vazamento)
+
+    for _, html in fixtures:
+        saidas = {}
+        for nome, funcao in extratores.items():
+            saidas[nome], tempo, pico = medir_extracao(funcao, html)
+            medidas[nome]["cpu_s"].append(tempo)
+            medidas[nome]["pico_bytes"].append(pico)
+        palavras_novas = set(saidas["incremental"].split())
+        palavras_antigas = set(saidas["regex_referencia"].split())
+        if palavras_novas or palavras_antigas:
+            sobreposicao.append(len(palavras_novas & palavras_antigas) / len(palavras_novas | palavras_antigas))
+
+    relatorio = {}
+    for nome, valores in medidas.items():
+        relatorio[nome] = {
+            "paginas": len(valores["cpu_s"]),
+            "cpu_medio_por_pagina_s": statistics.mean(valores["cpu_s"]) if valores["cpu_s"] else None,
+            "pico_memoria_medio_bytes": statistics.mean(valores["pico_bytes"]) if valores["pico_bytes"] else None,
+            "cobertura_corpo": statistics.mean(valores["cobertura"]) if valores["cobertura"] else None,
+            "boilerplate_vazado": statistics.mean(valores["boilerplate"]) if valores["boilerplate"] else None,
+        }
+    relatorio["sobreposicao_fixtures"] = statistics.mean(sobreposicao) if sobreposicao else None
+    return relatorio
+
+# Benchmark da extração em HTML patológico: `profundidade` blocos de conteúdo aninhados
+# (fechados no fim) e a mesma quantidade de blocos nunca fechados, cada um com um parágrafo
+# A cascata de regex só é medida nos aninhados: nos blocos não fechados ela leva dezenas de segundos
+def benchmark_aninhamento(profundidade):
+    paragrafo = "<p>Texto do bloco com o nome de Maria Oliveira e da Acme Pagamentos.</p>"
+    paginas = {
+        "aninhados": "<html><body>" + '<div class="content">' * profundidade + paragrafo * 50 + "</div>" * profundidade + "</body></html>",
+        "nao_fechados": "<html><body>" + ('<div class="content">' + paragrafo) * profundidade + "</body></html>",
+    }
+    extratores = {
+        "incremental": lambda html: app.extrair_conteudo_do_html(html, "http://exemplo/noticia")["conteudo"],
+        "regex_referencia": extrair_conteudo_regex_referencia,
+    }
+    relatorio = {"profundidade": profundidade}
+    for caso, html in paginas.items():
+        relatorio[caso] = {}
+        for nome, funcao in extratores.items():
+            if caso == "nao_fechados" and nome == "regex_referencia":
+                continue
+            # Sem o tracemalloc de medir_extracao, que multiplica o tempo de CPU destas páginas
+            inicio = time.process_time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                conteudo = funcao(html)
+            relatorio[caso][nome] = {"cpu_s": time.process_time() - inicio, "caracteres": len(conteudo)}
+    return relatorio
+
+# Função para gerar nomes sintéticos de merchants
+def gerar_nomes(quantidade, semente=42):
+    aleatorio = random.Random(semente)
+    return [
+        " ".join(aleatorio.choice(PALAVRAS_NOMES) for _ in range(aleatorio.randint(1, 5)))
+        for _ in range(quantidade)
+    ]
+
+# Microbenchmark da similaridade de substring: confere que os scores são idênticos
+# aos da implementação original e mede o tempo das três variantes
+def benchmark_similaridade_substring(entidades, candidatos):
+    resultados = []
+    for entidade in entidades:
+        inicio = time.perf_counter()
+        referencia = [similaridade_substring_referencia(entidade, nome) for nome in candidatos]
+        tempo_referencia = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        por_par = [app.calcular_similaridade_substring(entidade, nome) for nome in candidatos]
+        tempo_por_par = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        em_lote = app.calcular_similaridade_substring_em_lote(entidade, candidatos)
+        tempo_em_lote = time.perf_counter() - inicio
+
+        if not referencia == por_par == em_lote:
+            raise AssertionError(f"Scores divergentes da implementação original para '{entidade}'")
+
+        resultados.append({
+            "entidade": entidade,
+            "candidatos": len(candidatos),
+            "referencia_s": tempo_referencia,
+            "por_par_s": tempo_por_par,
+            "em_lote_s": tempo_em_lote,
+        })
+    return resultados
+
+# Nomes citados nas fixtures de notícias, incluídos na tabela sintética para gerar correspondências
+MERCHANTS_FIXTURES = [
+    "Nova Horizonte Pagamentos Ltda", "Ricardo Mendes Albuquerque", "TransLog Logística S.A.",
+    "Construtora Pedra Alta", "Alpha Crédito Fácil ME", "Aurora Capital Investimentos",
+    "Banco Aurora Digital", "Rede Sul Distribuidora de Combustíveis", "Beatriz Carvalho Nunes Me",
+]
+
+SILABAS = [c + v for c in "bcdfglmnprstvz" for v in "aeiou"]
+SUFIXOS_MERCHANTS = ["", "", "Ltda", "Me", "Eireli", "S.A.", "Comercio", "Serviços", "Pagamentos"]
+
+# Função para gerar a tabela sintética maindb.merchants como uma lista de (user_id, merchant_name)
+# Os nomes são feitos de sílabas sorteadas, para que a maioria das entidades das notícias
+# sintéticas não case com milhares de linhas; os nomes das fixtures são incluídos na tabela
+def gerar_merchants(quantidade, semente=42):
+    aleatorio = random.Random(semente)
+    
+    def palavra():
+        return "".join(aleatorio.choice(SILABAS) for _ in range(aleatorio.randint(2, 4))).title()
+    
+    nomes = [
+        " ".join(filter(None, [palavra(), palavra(), aleatorio.choice(SUFIXOS_MERCHANTS)]))
+        for _ in range(quantidade)
+    ]
+    for nome in MERCHANTS_FIXTURES:
+        nomes[aleatorio.randrange(quantidade)] = nome
+    return [(str(100000 + i), nome) for i, nome in enumerate(nomes)]
+
+# Função para calcular p50/p95 e vazão de uma lista de intervalos (início, fim) de chamadas
+# A vazão usa o tempo de parede entre a primeira chamada e o fim da última, o que
+# considera as chamadas feitas em paralelo
+def resumir_intervalos(intervalos):
+    if not intervalos:
+        return {"chamadas": 0}
+    latencias = sorted(fim - inicio for inicio, fim in intervalos)
+    parede = max(fim for _, fim in intervalos) - min(inicio for inicio, _ in intervalos)
+    
+    def percentil(p):
+        return latencias[min(len(latencias) - 1, round(p / 100 * (len(latencias) - 1)))]
+    
+    return {
+        "chamadas": len(latencias),
+        "p50_s": percentil(50),
+        "p95_s": percentil(95),
+        "max_s": latencias[-1],
+        "total_s": sum(latencias),
+        "vazao_por_s": len(latencias) / parede if parede > 0 else None,
+    }
+
+# Registra a duração de cada chamada das funções instrumentadas do app, por nome
+class Medidor:
+    def __init__(self):
+        self.intervalos = {}
+        self._lock = threading.Lock()
+    
+    def envolver(self, nome, funcao):
+        def medida(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                fim = time.perf_counter()
+                with self._lock:
+                    self.intervalos.setdefault(nome, []).append((inicio, fim))
+        return medida
+    
+    # Substitui as funções do módulo pelas versões medidas (as etapas do pipeline as
+    # buscam no módulo a cada chamada, então a troca vale também dentro do main())
+    def instrumentar(self, modulo, *nomes):
+        for nome in nomes:
+            setattr(modulo, nome, self.envolver(nome, getattr(modulo, nome)))
+    
+    def relatorio(self):
+        return {nome: resumir_intervalos(intervalos) for nome, intervalos in self.intervalos.items()}
+
+# Servidor HTTP local que entrega as páginas de notícia com uma latência fixa por resposta
+# Também serve /feed.xml, um RSS com metade das notícias, e responde 304 a If-None-Match
+class ServidorNoticiasLocal:
+    def __init__(self, paginas, latencia=0.0):
+        self.paginas = {caminho: html.encode("utf-8") for caminho, html in paginas.items()}
+        self.latencia = latencia
+        self.url_feed = None
+        self.respostas_304 = 0
+        self._servidor = None
+    
+    def iniciar(self):
+        paginas, latencia, servidor_local = self.paginas, self.latencia, self
+        
+        class Manipulador(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def do_GET(self):
+                time.sleep(latencia)
+                corpo = paginas.get(self.path)
+                if corpo is None:
+                    self.send_error(404)
+                    return
+                etag = '"' + hashlib.blake2b(corpo, digest_size=8).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    servidor_local.respostas_304 += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/rss+xml" if self.path.endswith(".xml") else "text/html; charset=utf-8")
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+            
+            def log_message(self, *args):
+                pass
+        
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", 0), Manipulador)
+        self._servidor.daemon_threads = True
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+        host, porta = self._servidor.server_address
+        urls = [f"http://{host}:{porta}{caminho}" for caminho in self.paginas]
+        
+        publicado = datetime.datetime.now(datetime.timezone.utc).strftime("%a, %d %b %Y %H:%M:%S +0000")
+        itens = "".join(
+            f"<item><title>Notícia {i} sobre fintech</title><link>{url}</link><pubDate>{publicado}</pubDate></item>"
+            for i, url in enumerate(urls) if i % 2
+        )
+        self.paginas["/feed.xml"] = f'<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel>{itens}</channel></rss>'.encode("utf-8")
+        self.url_feed = f"http://{host}:{porta}/feed.xml"
+        return urls
+    
+    def parar(self):
+        if self._servidor is not None:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+
+# Função para montar as páginas servidas localmente: fixtures salvas + notícias sintéticas
+def montar_paginas(fixtures, quantidade, semente=42):
+    aleatorio = random.Random(semente)
+    paginas = {f"/fixtures/{nome}": html for nome, html in fixtures}
+    for i in range(quantidade):
+        paginas[f"/sinteticas/noticia-{i}.html"] = gerar_pagina_noticia(aleatorio)[0]
+    return paginas
+
+# Substituto de googlesearch.search: cada consulta devolve os próximos links da lista
+def criar_busca_local(urls, latencia=0.0):
+    restantes = list(urls)
+    lock = threading.Lock()
+    
+    def search(query, num_results=10, lang="pt", **kwargs):
+        time.sleep(latencia)
+        with lock:
+            links = restantes[:num_results]
+            del restantes[:num_results]
+        yield from links
+    
+    return search
+
+# Sequências de duas ou mais palavras com inicial maiúscula (com "da", "de", "dos"... no meio)
+PALAVRA_MAIUSCULA = r"[A-ZÀ-Þ][\wÀ-ÿ&.-]*"
+PADRAO_NOME_PROPRIO = re.compile(rf"{PALAVRA_MAIUSCULA}(?:\s+(?:d[aeo]s?\s+)?{PALAVRA_MAIUSCULA})+")
+SUFIXOS_EMPRESA = ("ltda", "s.a.", "me", "digital", "pagamentos", "investimentos", "logística", "combustíveis")
+
+# Função para "extrair" entidades de um texto sem LLM: nomes próprios por expressão regular
+def extrair_nomes_proprios(texto):
+    entidades = {}
+    for nome in PADRAO_NOME_PROPRIO.findall(texto):
+        nome = nome.rstrip(".")
+        tipo = "ORG" if nome.lower().split()[-1] in SUFIXOS_EMPRESA or nome.lower().startswith(("banco", "construtora", "rede")) else "PER"
+        entidades.setdefault(nome, tipo)
+    return [{"texto": nome, "tipo": tipo} for nome, tipo in entidades.items()]
+
+# Substituto do módulo openai: chat.completions.create responde no formato pedido pelo prompt
+# (lista de entidades, ou objeto por número de notícia no modo agrupado) após a latência configurada
+def criar_openai_local(latencia=0.0):
+    def create(model=None, messages=None, **kwargs):
+        time.sleep(latencia)
+        prompt = messages[-1]["content"]
+        corpo = prompt.split("Forneça APENAS")[0]
+        partes = re.split(r"Notícia (\d+): ", corpo)
+        if len(partes) > 1:
+            resposta = {numero: extrair_nomes_proprios(texto) for numero, texto in zip(partes[1::2], partes[2::2])}
+        else:
+            resposta = extrair_nomes_proprios(corpo.split("Texto da notícia:")[-1])
+        conteudo = json.dumps(resposta, ensure_ascii=False)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=conteudo))],
+            usage=SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(conteudo) // 4),
+        )
+    
+    return SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create)),
+        RateLimitError=openai.RateLimitError,
+        APIConnectionError=openai.APIConnectionError,
+        InternalServerError=openai.InternalServerError,
+    )
+
+# Linhas de uma consulta do dublê, com os bytes lidos como no QueryJob do BigQuery
+class ResultadoConsultaLocal(list):
+    total_bytes_processed = 0
+    
+    # A consulta do dublê já está concluída quando é devolvida
+    def result(self):
+        return self
+
+# Substituto de bigquery.Client sobre a tabela sintética de merchants
+# Responde à consulta por padrões (STRPOS sobre o merchant_name normalizado), à de nomes curtos
+# (nome normalizado idêntico), à criação e à consulta da tabela de tokens (clusterizada por
+# token: lê só as palavras consultadas) e à leitura incremental do snapshot (todas as linhas na primeira vez, nenhuma depois)
+# O dry run devolve os bytes da tabela inteira, como o BigQuery faz antes de podar os blocos
+class ClienteBigQueryLocal:
+    def __init__(self, merchants, latencia=0.0):
+        self.merchants = merchants
+        self.nomes_normalizados = [" ".join(re.sub(r"[^a-z0-9]+", " ", app.remover_acentos(nome.lower())).split()) for _, nome in merchants]
+        self.latencia = latencia
+        self.consultas = 0
+        self.dry_runs = 0
+        self.linhas_retornadas = 0
+        self.bytes_lidos = 0
+        self.bytes_merchants = sum(len(user_id) + len(nome.encode("utf-8")) for user_id, nome in merchants)
+        self.tokens = None
+        self.bytes_tokens = 0
+        self.watermark = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+    
+    def _bytes_linha_token(self, token, i):
+        return len(token) + len(self.merchants[i][0]) + len(self.merchants[i][1].encode("utf-8")) + len(self.nomes_normalizados[i])
+    
+    def query(self, query, job_config=None):
+        parametros = {p.name: p for p in getattr(job_config, "query_parameters", None) or []}
+        usa_tokens = "tokens" in parametros or ("nomes" in parametros and app.BIGQUERY_TABELA_TOKENS in query)
+        if usa_tokens and self.tokens is None:
+            raise RuntimeError(f"Not found: Table {app.BIGQUERY_TABELA_TOKENS}")
+        if getattr(job_config, "dry_run", False):
+            self.dry_runs += 1
+            return SimpleNamespace(total_bytes_processed=self.bytes_tokens if usa_tokens else self.bytes_merchants)
+        
+        time.sleep(self.latencia)
+        linhas = ResultadoConsultaLocal()
+        if "CREATE OR REPLACE TABLE" in query:
+            self.tokens = {}
+            for i, nome in enumerate(self.nomes_normalizados):
+                for token in set(nome.split()):
+                    self.tokens.setdefault(token, []).append(i)
+            self.bytes_tokens = sum(self._bytes_linha_token(token, i) for token, indices in self.tokens.items() for i in indices)
+            linhas.total_bytes_processed = self.bytes_merchants
+        elif "nomes" in parametros:
+            nomes = set(parametros["nomes"].values)
+            linhas.extend(
+                SimpleNamespace(padrao=nome, user_id=self.merchants[i][0], merchant_name=self.merchants[i][1])
+                for i, nome in enumerate(self.nomes_normalizados) if nome in nomes
+            )
+            linhas.total_bytes_processed = self.bytes_tokens if usa_tokens else self.bytes_merchants
+        elif usa_tokens:
+            for padrao in parametros["padroes"].values:
+                linhas.extend(
+                    SimpleNamespace(padrao=padrao, user_id=self.merchants[i][0], merchant_name=self.merchants[i][1])
+                    for i in self.tokens.get(app.palavra_mais_longa(padrao), ()) if padrao in self.nomes_normalizados[i]
+                )
+            linhas.total_bytes_processed = sum(
+                self._bytes_linha_token(token, i) for token in parametros["tokens"].values for i in self.tokens.get(token, ())
+            )
+        elif "padroes" in parametros:
+            linhas.extend(
+                SimpleNamespace(padrao=padrao, user_id=self.merchants[i][0], merchant_name=self.merchants[i][1])
+                for padrao in parametros["padroes"].values
+                for i, nome in enumerate(self.nomes_normalizados) if padrao in nome
+            )
+            linhas.total_bytes_processed = self.bytes_merchants
+        elif "watermark" in parametros:
+            pass
+        else:
+            linhas.extend(
+                SimpleNamespace(user_id=user_id, merchant_name=nome, watermark=self.watermark)
+                for user_id, nome in self.merchants
+            )
+            linhas.total_bytes_processed = self.bytes_merchants
+        
+        # Como no BigQuery, a consulta que passa do maximum_bytes_billed falha sem devolver linhas
+        limite = getattr(job_config, "maximum_bytes_billed", None)
+        if limite and linhas.total_bytes_processed > limite:
+            raise RuntimeError(f"bytesBilledLimitExceeded: {linhas.total_bytes_processed} bytes, limite de {limite}")
+        
+        self.consultas += 1
+        self.linhas_retornadas += len(linhas)
+        self.bytes_lidos += linhas.total_bytes_processed
+        return linhas
+
+# Substituto de slack.WebClient: conta as mensagens e responde com um ts após a latência
+class WebClientLocal:
+    latencia = 0.0
+    mensagens = 0
+    _lock = threading.Lock()
+    
+    def __init__(self, token=None, **kwargs):
+        self.token = token
+    
+    def chat_postMessage(self, channel=None, text=None, thread_ts=None, **kwargs):
+        time.sleep(self.latencia)
+        with self._lock:
+            WebClientLocal.mensagens += 1
+        return SimpleNamespace(data={"ok": True, "channel": channel, "ts": f"{time.time():.6f}"})
+
+# Função para isolar os caches, o registro e o snapshot do app em um diretório temporário
+def isolar_estado(diretorio):
+    app.cache_paginas = app.CacheDisco("paginas", app.CACHE_TTL_PAGINAS, diretorio=diretorio, descricao="páginas")
+    app.cache_entidades = app.CacheDisco("entidades", app.CACHE_TTL_ENTIDADES, diretorio=diretorio)
+    app.cache_correspondencias = app.CacheDisco("correspondencias", app.CACHE_TTL_CORRESPONDENCIAS, diretorio=diretorio)
+    app.cache_buscas = app.CacheDisco("buscas", app.CACHE_TTL_BUSCAS, diretorio=diretorio)
+    app.cache_feeds = app.CacheDisco("feeds", app.CACHE_TTL_BUSCAS, diretorio=diretorio)
+    app.cache_padroes = app.CacheDisco("padroes", app.CACHE_TTL_CORRESPONDENCIAS, diretorio=diretorio)
+    app.orcamento_bigquery = app.OrcamentoBigQuery()
+    app._correspondencias_memoria.clear()
+    app.registro_noticias = app.RegistroNoticias(os.path.join(diretorio, "registro.sqlite"))
+    app.fila_trabalhos = app.FilaTrabalhos(os.path.join(diretorio, "fila.sqlite"))
+    app._snapshot_merchants = app.SnapshotMerchants(os.path.join(diretorio, "snapshot"))
+    app._cliente_slack = None
+    app.metricas.arquivo_jsonl = os.path.join(diretorio, "metricas.jsonl")
+    app.metricas.arquivo_prometheus = os.path.join(diretorio, "shearch.prom")
+
+# Inicialização de cada processo trabalhador da fila: mesmo diretório isolado e mesmos dublês
+def preparar_processo_trabalhador(args, diretorio):
+    # Como nas seções, a saída do app é descartada (o relatório sai no stdout)
+    sys.stdout = open(os.devnull, "w")
+    isolar_estado(diretorio)
+    cliente_bigquery = ClienteBigQueryLocal(gerar_merchants(args.merchants, args.semente), args.latencia_bigquery)
+    app.openai = criar_openai_local(args.latencia_llm)
+    app.autenticar_bigquery = lambda *a, **k: cliente_bigquery
+    app.USAR_INDICE_LOCAL = args.indice_local
+    if args.tokens:
+        app.criar_tabela_tokens(cliente_bigquery)
+        app.BIGQUERY_USAR_TOKENS = True
+
+# Pico de memória residente do processo (KB), quando a plataforma informa
+def rss_pico_kb():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico // 1024 if platform.system() == "Darwin" else pico
+
+# Seções do benchmark; cada uma roda em um processo próprio para medir o pico de RSS isolado
+
+def secao_similaridade_substring(args):
+    candidatos = gerar_nomes(args.candidatos, args.semente)
+    entidades = ["maria oliveira", "comercial padarias do joão silva ltda", "acme pagamentos digitais"]
+    return {"resultados": benchmark_similaridade_substring(entidades, candidatos)}
+
+def secao_extracao_html(args):
+    aleatorio = random.Random(args.semente)
+    paginas = [gerar_pagina_noticia(aleatorio) for _ in range(args.paginas)]
+    relatorio = benchmark_extracao_html(paginas, carregar_fixtures(args.fixtures))
+    relatorio["aninhamento"] = benchmark_aninhamento(args.profundidade)
+    return relatorio
+
+# obter_conteudo_da_pagina contra o servidor local: primeira passada com o cache vazio
+# (download + extração) e segunda com as páginas já em cache
+# As páginas são baixadas com HTTP_MAX_CONCORRENCIA em paralelo, como na etapa de download
+def secao_pagina(args):
+    servidor = ServidorNoticiasLocal(montar_paginas(carregar_fixtures(args.fixtures), args.noticias, args.semente), args.latencia_http)
+    urls = servidor.iniciar()
+    relatorio = {"paginas": len(urls), "latencia_http_s": args.latencia_http}
+    try:
+        with tempfile.TemporaryDirectory() as diretorio:
+            isolar_estado(diretorio)
+            for passada in ("cache_vazio", "cache_cheio"):
+                medidor = Medidor()
+                original = app.obter_conteudo_da_pagina
+                medidor.instrumentar(app, "obter_conteudo_da_pagina")
+                inicio = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=app.HTTP_MAX_CONCORRENCIA) as executor:
+                    baixadas = list(executor.map(app.obter_conteudo_da_pagina, urls))
+                parede = time.perf_counter() - inicio
+                app.obter_conteudo_da_pagina = original
+                
+                medidas = medidor.relatorio()["obter_conteudo_da_pagina"]
+                medidas["parede_s"] = parede
+                medidas["bytes_extraidos"] = sum(len(dados["conteudo"]) for dados in baixadas)
+                relatorio[passada] = medidas
+    finally:
+        servidor.parar()
+    return relatorio
+
+# calcular_score_fuzzy das entidades das fixtures contra uma amostra da tabela de merchants
+def secao_score_fuzzy(args):
+    merchants = gerar_merchants(args.merchants, args.semente)
+    amostra = random.Random(args.semente).sample(merchants, min(args.amostra_score, len(merchants)))
+    entidades = [{"texto": texto, "tipo": "ORG" if i % 2 else "PER"} for i, texto in enumerate(MERCHANTS_FIXTURES)]
+    entidades += [{"texto": " ".join(nome.split()[:2]), "tipo": "PER"} for _, nome in amostra[:5]]
+    
+    intervalos = []
+    for entidade in entidades:
+        for _, nome in amostra:
+            inicio = time.perf_counter()
+            app.calcular_score_fuzzy(entidade, nome)
+            intervalos.append((inicio, time.perf_counter()))
+    
+    relatorio = resumir_intervalos(intervalos)
+    relatorio.update({"entidades": len(entidades), "merchants_por_entidade": len(amostra)})
+    
+    # Versão em lote (vetorizada quando o NumPy está disponível), que precisa dar os mesmos scores
+    # Os nomes das entidades entram na amostra para exercitar igualdade, contenção e palavra inteira
+    nomes = [nome for _, nome in amostra] + [entidade["texto"] for entidade in entidades]
+    nomes += [f"{entidade['texto']} Comercio" for entidade in entidades] + [f"X{entidade['texto']}" for entidade in entidades]
+    inicio = time.perf_counter()
+    escalares = [[app.calcular_score_fuzzy(entidade, nome) for nome in nomes] for entidade in entidades]
+    tempo_escalar = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    em_lote = app.calcular_scores_em_lote(entidades, nomes)
+    tempo_lote = time.perf_counter() - inicio
+    for entidade, esperados, obtidos in zip(entidades, escalares, em_lote):
+        for nome, esperado, obtido in zip(nomes, esperados, obtidos):
+            if esperado != obtido:
+                raise AssertionError(f"Score em lote divergente para {entidade['texto']!r} x {nome!r}: {obtido!r} != {esperado!r}")
+        esperados_top = heapq.nlargest(app.MATCH_LOCAL_TOP_K, range(len(esperados)), key=esperados.__getitem__)
+        if app.selecionar_melhores(obtidos, app.MATCH_LOCAL_TOP_K) != esperados_top:
+            raise AssertionError(f"Top-k divergente para {entidade['texto']!r}")
+    
+    relatorio["lote"] = {
+        "vetorizado": app.np is not None and app.SCORE_VETORIZADO,
+        "pares": len(entidades) * len(nomes),
+        "escalar_s": tempo_escalar,
+        "lote_s": tempo_lote,
+        "aceleracao": tempo_escalar / tempo_lote if tempo_lote else None
+    }
+    return relatorio
+
+# Agregação original do main(): guarda todas as correspondências, fica com a melhor de cada
+# user_id, ordena e só então filtra pelo score mínimo; usada como referência do placar
+def agregar_correspondencias_referencia(correspondencias, top_n):
+    todos_resultados = list(correspondencias)
+    resultados_por_usuario = {}
+    for resultado in todos_resultados:
+        user_id = resultado["user_id"]
+        if user_id not in resultados_por_usuario or resultado["score"] > resultados_por_usuario[user_id]["score"]:
+            resultados_por_usuario[user_id] = resultado
+    resultados_ordenados = sorted(resultados_por_usuario.values(), key=lambda x: x["score"], reverse=True)
+    relevantes = [resultado for resultado in resultados_ordenados if resultado["score"] > app.SCORE_MINIMO_ALERTA]
+    return {resultado["user_id"]: resultado["score"] for resultado in relevantes}, relevantes[:top_n]
+
+def agregar_correspondencias_placar(correspondencias, top_n):
+    placar = app.PlacarCorrespondencias(top_n=top_n)
+    for resultado in correspondencias:
+        placar.adicionar(resultado)
+    return {user_id: melhor.score for user_id, melhor in placar.melhores.items()}, placar.ranking()
+
+# Correspondências sintéticas, geradas uma a uma (a maioria abaixo do score mínimo, como em entidades amplas)
+def gerar_correspondencias(quantidade, usuarios, semente):
+    aleatorio = random.Random(semente)
+    for _ in range(quantidade):
+        user_id = aleatorio.randrange(usuarios)
+        yield {
+            "entidade": f"Entidade {user_id % 50}",
+            "tipo": "ORG",
+            "user_id": f"u{user_id}",
+            "merchant_name": f"Merchant {user_id}",
+            "score": aleatorio.betavariate(2, 8)
+        }
+
+# Placar de correspondências (melhor por user_id + ranking) contra a agregação original:
+# mesmos melhores e mesmo ranking, com o tempo e o pico de memória de cada uma
+def secao_placar(args):
+    relatorio = {"correspondencias": args.correspondencias, "usuarios": args.usuarios}
+    saidas = {}
+    for nome, agregar in (("referencia", agregar_correspondencias_referencia), ("placar", agregar_correspondencias_placar)):
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        saidas[nome] = agregar(gerar_correspondencias(args.correspondencias, args.usuarios, args.semente), app.ALERTAS_RANKING_TOP_N)
+        tempo = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        relatorio[nome] = {"tempo_s": tempo, "pico_memoria_kb": pico / 1024}
+    
+    melhores_referencia, ranking_referencia = saidas["referencia"]
+    melhores_placar, ranking_placar = saidas["placar"]
+    if melhores_referencia != melhores_placar:
+        raise AssertionError("Melhor correspondência por user_id divergente entre o placar e a referência")
+    if [(r["user_id"], r["score"]) for r in ranking_referencia] != [(r["user_id"], r["score"]) for r in ranking_placar]:
+        raise AssertionError("Ranking divergente entre o placar e a referência")
+    relatorio["user_ids_relevantes"] = len(melhores_placar)
+    return relatorio
+
+# main() completo com busca, OpenAI, BigQuery e Slack substituídos pelos dublês locais
+# Substitui busca, OpenAI, BigQuery e Slack do app pelos dublês locais e sobe o servidor de notícias
+def instalar_dubles(args):
+    merchants = gerar_merchants(args.merchants, args.semente)
+    cliente_bigquery = ClienteBigQueryLocal(merchants, args.latencia_bigquery)
+    servidor = ServidorNoticiasLocal(montar_paginas(carregar_fixtures(args.fixtures), args.noticias, args.semente), args.latencia_http)
+    urls = servidor.iniciar()
+    
+    app.search = criar_busca_local(urls, args.latencia_busca)
+    palavras_chave = list(app.PALAVRAS_CHAVE) + [f"tema {i}" for i in range(max(args.palavras_chave - len(app.PALAVRAS_CHAVE), 0))]
+    app.carregar_palavras_chave = lambda: palavras_chave[:args.palavras_chave]
+    app.carregar_fontes_rss = lambda: [servidor.url_feed]
+    app.limitador_busca = app.BaldeTokens(args.busca_taxa, app.BUSCA_RAJADA)
+    app.openai = criar_openai_local(args.latencia_llm)
+    app.WebClient = WebClientLocal
+    WebClientLocal.latencia = args.latencia_slack
+    app.autenticar_bigquery = lambda *a, **k: cliente_bigquery
+    app.USAR_INDICE_LOCAL = args.indice_local
+    if args.tokens:
+        app.criar_tabela_tokens(cliente_bigquery)
+        app.BIGQUERY_USAR_TOKENS = True
+    return merchants, cliente_bigquery, servidor, urls
+
+def secao_main(args):
+    merchants, cliente_bigquery, servidor, urls = instalar_dubles(args)
+    
+    medidor = Medidor()
+    medidor.instrumentar(
+        app, "buscar_noticias", "buscar_feed", "obter_conteudo_da_pagina", "extrair_entidades_gpt",
+        "buscar_correspondencias", "buscar_no_bigquery", "buscar_no_indice_local", "enviar_para_slack"
+    )
+    medidor.instrumentar(app.SnapshotMerchants, "atualizar")
+    
+    saida = io.StringIO()
+    try:
+        with tempfile.TemporaryDirectory() as diretorio:
+            isolar_estado(diretorio)
+            app.FILA_PROCESSOS = args.processos
+            app.inicializar_processo = functools.partial(preparar_processo_trabalhador, args, diretorio)
+            inicio = time.perf_counter()
+            with contextlib.redirect_stdout(saida):
+                app.main()
+            parede = time.perf_counter() - inicio
+    finally:
+        servidor.parar()
+    
+    log = saida.getvalue()
+    primeiro_alerta = re.search(r"Primeiro alerta encontrado após ([\d.]+)s", log)
+    alertas = re.search(r"Pipeline concluído em [\d.]+s: (\d+) alertas", log)
+    return {
+        "parede_s": parede,
+        "primeiro_alerta_s": float(primeiro_alerta.group(1)) if primeiro_alerta else None,
+        "alertas": int(alertas.group(1)) if alertas else None,
+        "etapas": medidor.relatorio(),
+        "dubles": {
+            "links_servidos": len(urls),
+            "respostas_304": servidor.respostas_304,
+            "consultas_bigquery": cliente_bigquery.consultas,
+            "linhas_bigquery": cliente_bigquery.linhas_retornadas,
+            "bytes_bigquery": cliente_bigquery.bytes_lidos,
+            "mensagens_slack": WebClientLocal.mensagens,
+        },
+        "contadores": {
+            nome + "".join(f"[{chave}={valor}]" for chave, valor in rotulos): total
+            for (nome, rotulos), total in sorted(app.metricas.contadores.items())
+        },
+        "indice_local": args.indice_local,
+        "tokens": args.tokens,
+        "processos": args.processos,
+        "merchants": len(merchants),
+    }
+
+# Acesso ao BigQuery com o dublê: consulta por STRPOS x tabela de tokens (tempo, linhas e bytes
+# estimados e lidos), cache por padrão (a segunda busca não pode consultar e precisa dar o mesmo
+# resultado) e orçamento (a consulta acima do limite é recusada depois do dry run, antes de rodar;
+# na tabela de tokens ela roda e o ciclo é cobrado pelos bytes lidos)
+def secao_bigquery(args):
+    merchants = gerar_merchants(args.merchants, args.semente)
+    cliente = ClienteBigQueryLocal(merchants, args.latencia_bigquery)
+    entidades = [{"texto": texto, "tipo": "ORG"} for texto in MERCHANTS_FIXTURES]
+    entidades += [{"texto": " ".join(nome.split()[:2]), "tipo": "PER"} for _, nome in random.Random(args.semente).sample(merchants, 20)]
+    app.bigquery_client = cliente
+    relatorio = {"merchants": len(merchants), "entidades": len(entidades)}
+    
+    def chaves(resultados):
+        return sorted((r["entidade"], r["tipo"], r["user_id"], r["merchant_name"], r["score"]) for r in resultados)
+    
+    with tempfile.TemporaryDirectory() as diretorio:
+        isolar_estado(diretorio)
+        encontrados = {}
+        for modo, usar_tokens in (("substring", False), ("tokens", True)):
+            app.BIGQUERY_USAR_TOKENS = usar_tokens
+            if usar_tokens:
+                app.criar_tabela_tokens(cliente)
+            
+            relatorio[modo] = {}
+            for rodada in ("consulta", "cache"):
+                consultas, bytes_lidos, usados = cliente.consultas, cliente.bytes_lidos, app.orcamento_bigquery.usados
+                estimados = app.metricas.contadores[("bytes_estimados_bigquery", ())]
+                inicio = time.perf_counter()
+                resultados = app.buscar_no_bigquery(entidades, propagar_erros=True)
+                relatorio[modo][rodada] = {
+                    "tempo_s": time.perf_counter() - inicio,
+                    "consultas": cliente.consultas - consultas,
+                    "bytes_estimados": app.metricas.contadores[("bytes_estimados_bigquery", ())] - estimados,
+                    "bytes_orcamento": app.orcamento_bigquery.usados - usados,
+                    "bytes_lidos": cliente.bytes_lidos - bytes_lidos,
+                    "correspondencias": len(resultados),
+                }
+                if rodada == "cache" and (relatorio[modo][rodada]["consultas"] or chaves(resultados) != encontrados[modo]):
+                    raise AssertionError(f"A segunda busca ({modo}) consultou o BigQuery ou mudou o resultado")
+                encontrados[modo] = chaves(resultados)
+        
+        # A tabela de tokens só deixa de fora nomes em que a palavra mais longa do padrão aparece pela metade
+        if not set(encontrados["tokens"]) <= set(encontrados["substring"]):
+            raise AssertionError("A tabela de tokens encontrou correspondências que a consulta por STRPOS não encontra")
+        
+        app.BIGQUERY_USAR_TOKENS = False
+        app.orcamento_bigquery = app.OrcamentoBigQuery(limite_consulta=cliente.bytes_merchants - 1)
+        consultas = cliente.consultas
+        try:
+            app.buscar_no_bigquery([{"texto": "Entidade Fora do Cache", "tipo": "ORG"}], propagar_erros=True)
+            recusada = False
+        except RuntimeError:
+            recusada = True
+        if not recusada or cliente.consultas != consultas:
+            raise AssertionError("A consulta acima do limite de bytes não foi recusada antes de rodar")
+        
+        # Na tabela de tokens, o mesmo limite abaixo da estimativa do dry run não recusa a consulta,
+        # e o orçamento do ciclo é cobrado pelos bytes lidos, não pelos estimados
+        app.BIGQUERY_USAR_TOKENS = True
+        app.orcamento_bigquery = app.OrcamentoBigQuery(limite_consulta=cliente.bytes_tokens - 1)
+        bytes_lidos = cliente.bytes_lidos
+        app.buscar_no_bigquery([{"texto": merchants[-1][1], "tipo": "ORG"}], propagar_erros=True)
+        if not 0 < app.orcamento_bigquery.usados == cliente.bytes_lidos - bytes_lidos:
+            raise AssertionError("O orçamento não foi acertado com os bytes lidos pela consulta na tabela de tokens")
+        app.BIGQUERY_USAR_TOKENS = False
+        relatorio["orcamento"] = {
+            "recusada": recusada, "dry_runs": cliente.dry_runs, "bytes_orcamento_tokens": app.orcamento_bigquery.usados
+        }
+    return relatorio
+
+# Modo serviço: tempo de importação do app (partida a frio) e duração de cada ciclo com os
+# clientes já prontos; a partir do segundo ciclo as notícias da busca já foram processadas
+def secao_servico(args):
+    comando = [sys.executable, "-c", "import time; inicio = time.perf_counter(); import app; print(time.perf_counter() - inicio)"]
+    importacoes = [
+        float(subprocess.run(comando, cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout)
+        for _ in range(3)
+    ]
+    
+    merchants, cliente_bigquery, servidor, urls = instalar_dubles(args)
+    # Os ciclos rodam em sequência, sem o intervalo real: sem isso, o limite de tokens por
+    # minuto da OpenAI gasto no primeiro ciclo atrasaria os seguintes
+    app.limitador_openai = app.LimitadorTaxa(app.OPENAI_RPM * 100, app.OPENAI_TPM * 100)
+    saida = io.StringIO()
+    try:
+        with tempfile.TemporaryDirectory() as diretorio:
+            isolar_estado(diretorio)
+            inicio = time.perf_counter()
+            with contextlib.redirect_stdout(saida):
+                app.executar_servico(intervalo=0, ciclos=args.ciclos)
+            parede = time.perf_counter() - inicio
+    finally:
+        servidor.parar()
+    
+    ciclos = [float(duracao) for duracao in re.findall(r"Ciclo \d+ concluído em ([\d.]+)s", saida.getvalue())]
+    return {
+        "importacao_app_s": statistics.median(importacoes),
+        "parede_s": parede,
+        "ciclos_s": ciclos,
+        "consultas_bigquery": cliente_bigquery.consultas,
+        "mensagens_slack": WebClientLocal.mensagens,
+        "respostas_304": servidor.respostas_304,
+        "merchants": len(merchants),
+    }
+
+SECOES = {
+    "similaridade_substring": secao_similaridade_substring,
+    "extracao_html": secao_extracao_html,
+    "pagina": secao_pagina,
+    "score_fuzzy": secao_score_fuzzy,
+    "main": secao_main,
+    "servico": secao_servico,
+    "placar": secao_placar,
+    "bigquery": secao_bigquery,
+}
+
+# Executa uma seção (no processo filho) com a saída do app descartada
+def executar_secao(nome, args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        resultado = SECOES[nome](args)
+    return {"resultado": resultado, "rss_pico_kb": rss_pico_kb()}
+
+# Função para achatar um relatório em {"secao.chave.subchave": número}
+def achatar_numeros(valor, prefixo=""):
+    if isinstance(valor, dict):
+        itens = valor.items()
+    elif isinstance(valor, list):
+        itens = enumerate(valor)
+    else:
+        if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            return {prefixo: valor}
+        return {}
+    numeros = {}
+    for chave, filho in itens:
+        numeros.update(achatar_numeros(filho, f"{prefixo}.{chave}" if prefixo else str(chave)))
+    return numeros
+
+# Função para comparar dois relatórios: variação relativa de cada número presente nos dois
+def comparar_relatorios(anterior, atual):
+    numeros_anteriores = achatar_numeros({k: v for k, v in anterior.items() if k != "meta"})
+    numeros_atuais = achatar_numeros({k: v for k, v in atual.items() if k != "meta"})
+    return {
+        chave: {
+            "anterior": numeros_anteriores[chave],
+            "atual": valor,
+            "variacao": (valor - numeros_anteriores[chave]) / numeros_anteriores[chave] if numeros_anteriores[chave] else None,
+        }
+        for chave, valor in numeros_atuais.items() if chave in numeros_anteriores
+    }
+
+# Função para identificar a versão medida (commit atual), quando disponível
+def versao_do_codigo():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    diretorio_fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "noticias")
+    
+    parser = argparse.ArgumentParser(description="Benchmarks do Shearch (offline, com dublês de busca, OpenAI, BigQuery e Slack)")
+    parser.add_argument("--secoes", default=",".join(SECOES), help=f"Seções a executar, separadas por vírgula ({', '.join(SECOES)})")
+    parser.add_argument("--candidatos", type=int, default=5000, help="Quantidade de nomes de merchants sintéticos (similaridade de substring)")
+    parser.add_argument("--paginas", type=int, default=50, help="Quantidade de páginas de notícia sintéticas (extração)")
+    parser.add_argument("--profundidade", type=int, default=8000, help="Blocos aninhados e não fechados do HTML patológico (extração)")
+    parser.add_argument("--fixtures", default=diretorio_fixtures, help="Diretório com páginas de notícias salvas (.html)")
+    parser.add_argument("--merchants", type=int, default=100000, help="Linhas da tabela sintética maindb.merchants")
+    parser.add_argument("--amostra-score", type=int, default=10000, help="Merchants comparados por entidade na seção score_fuzzy")
+    parser.add_argument("--noticias", type=int, default=30, help="Notícias sintéticas servidas pelo servidor local, além das fixtures")
+    parser.add_argument("--indice-local", action="store_true", help="Executa o main() com USAR_INDICE_LOCAL")
+    parser.add_argument("--ciclos", type=int, default=3, help="Ciclos do modo serviço na seção servico")
+    parser.add_argument("--correspondencias", type=int, default=200000, help="Correspondências sintéticas agregadas na seção placar")
+    parser.add_argument("--usuarios", type=int, default=50000, help="user_ids distintos das correspondências da seção placar")
+    parser.add_argument("--tokens", action="store_true", help="Executa o main() com a tabela de tokens do BigQuery (BIGQUERY_USAR_TOKENS)")
+    parser.add_argument("--processos", type=int, default=0, help="Processos trabalhadores da fila no main() (0 = threads)")
+    parser.add_argument("--palavras-chave", type=int, default=2, help="Palavras-chave buscadas (as do app e, além delas, temas sintéticos)")
+    parser.add_argument("--busca-taxa", type=float, default=app.BUSCA_TAXA, help="Buscas por segundo liberadas pelo balde de tokens")
+    parser.add_argument("--latencia-busca", type=float, default=0.2, help="Latência da busca do Google simulada (s)")
+    parser.add_argument("--latencia-http", type=float, default=0.05, help="Latência de cada página de notícia (s)")
+    parser.add_argument("--latencia-llm", type=float, default=0.5, help="Latência de cada chamada ao GPT (s)")
+    parser.add_argument("--latencia-bigquery", type=float, default=1.0, help="Latência de cada consulta ao BigQuery (s)")
+    parser.add_argument("--latencia-slack", type=float, default=0.1, help="Latência de cada mensagem do Slack (s)")
+    parser.add_argument("--saida", help="Arquivo onde gravar o relatório JSON (padrão: saída padrão)")
+    parser.add_argument("--comparar", help="Relatório JSON de uma execução anterior para calcular as variações")
+    parser.add_argument("--semente", type=int, default=42)
+    args = parser.parse_args()
+    
+    secoes = [nome.strip() for nome in args.secoes.split(",") if nome.strip()]
+    desconhecidas = [nome for nome in secoes if nome not in SECOES]
+    if desconhecidas:
+        parser.error(f"Seções desconhecidas: {', '.join(desconhecidas)}")
+    if not os.path.isdir(args.fixtures):
+        args.fixtures = None
+    
+    relatorio = {
+        "meta": {
+            "versao": versao_do_codigo(),
+            "data": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "parametros": vars(args),
+        }
+    }
+    
+    # Um processo novo por seção, para que o pico de RSS de uma não contamine a outra
+    for nome in secoes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            execucao = executor.submit(executar_secao, nome, args).result()
+        relatorio[nome] = dict(execucao["resultado"], rss_pico_kb=execucao["rss_pico_kb"])
+    
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            relatorio["comparacao"] = comparar_relatorios(json.load(f), relatorio)
+    
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+if __name__ == "__main__":
+    main()